@@ -0,0 +1,316 @@
+#/usr/bin/python
+
+# aggregate_functions.py
+# 2016_3_24
+
+### Summarizing a delimited file by group in one pass: how many lines each group has and,
+###    for chosen value columns, the sum, min, max and mean of each group's values. One summary
+###    table is written, with a line per group, instead of a file per group.
+###
+###    The running totals are kept in a dict. When it holds more than Max_groups groups (lots
+###    of distinct keys), it's written to a spill file, sorted by group, and emptied. At the
+###    end the spill files and what's left in memory are merged, group by group, into the
+###    summary, so memory is bounded by Max_groups whatever the number of groups.
+
+import os
+import heapq
+import shutil
+import cPickle
+import itertools
+
+import helper_functions
+import partition_functions
+import column_reader
+
+# Groups kept in memory before they're spilled to disk
+MAX_GROUPS = 1000000
+# Name of the summary table col_grep.py writes in out_DIR
+SUMMARY_FILE = "group_summary.txt"
+# Records per pickle in a spill file
+SPILL_CHUNK = 65536
+# Numbers written as integers when they are whole and at most this big (floats hold them exactly)
+MAX_EXACT = 2**53
+
+def check_value_columns(Value_columns):
+	""" Make sure Value_columns is a (possibly empty) list of column indices (integers >= 0).
+	"""
+	if type(Value_columns) not in [list, tuple]:
+		raise ValueError("Value_columns needs to be a list of column indices.")
+	for column in Value_columns:
+		if type(column) is not int or column < 0:
+			raise ValueError("Value_columns need to be integers >= 0, not: "+str(column))
+	if len(set(Value_columns)) != len(Value_columns):
+		raise ValueError("Value_columns has a column more than once: "+str(Value_columns))
+	return list(Value_columns)
+
+def new_record(N_values):
+	""" A group's running totals: [lines, then n, sum, min, max for each value column]
+		(n counts the values that were numbers, not NA).
+	"""
+	record = [0]
+	for k in range(N_values):
+		record.extend([0, 0.0, float("inf"), float("-inf")])
+	return record
+
+def combine_records(Record, Other):
+	""" Add the totals of Other into Record (of the same group).
+	"""
+	Record[0] += Other[0]
+	for j in range(1, len(Record), 4):
+		Record[j] += Other[j]
+		Record[j+1] += Other[j+1]
+		if Other[j+2] < Record[j+2]:
+			Record[j+2] = Other[j+2]
+		if Other[j+3] > Record[j+3]:
+			Record[j+3] = Other[j+3]
+	return Record
+
+def format_number(Value):
+	""" 3.0 -> "3", 0.25 -> "0.25"
+	"""
+	if abs(Value) <= MAX_EXACT and Value == int(Value):
+		return str(int(Value))
+	return repr(Value)
+
+def summary_header(Value_columns, Delim="\t"):
+	""" group, count, and n, sum, min, max, mean of each value column (named col<#>_...).
+	"""
+	names = ["group", "count"]
+	for column in Value_columns:
+		names.extend(["col"+str(column)+"_"+name for name in ["n", "sum", "min", "max", "mean"]])
+	return Delim.join(names)+"\n"
+
+def summary_line(Group, Record, Delim="\t"):
+	""" A group's line of the summary table. A value column with no numbers gets NA for its
+		sum, min, max and mean.
+	"""
+	fields = [Group, str(Record[0])]
+	for j in range(1, len(Record), 4):
+		n = Record[j]
+		if n == 0:
+			fields.extend(["0", "NA", "NA", "NA", "NA"])
+		else:
+			fields.extend([str(n), format_number(Record[j+1]), format_number(Record[j+2]),
+				format_number(Record[j+3]), repr(Record[j+1]/n)])
+	return Delim.join(fields)+"\n"
+
+def _spill_records(Spill_file):
+	""" Yield the (group, record) pairs of a spill file, in the (sorted) order they were written.
+	"""
+	with open(Spill_file, 'rb') as handle:
+		while True:
+			try:
+				chunk = cPickle.load(handle)
+			except EOFError:
+				return
+			for item in chunk:
+				yield item
+
+class Aggregator(object):
+	""" Keeps each group's running totals (see new_record), spilling them to Spill_dir when
+		there are more than Max_groups of them.
+
+		Arguments:
+			N_values:	number of value columns
+			Max_groups:	integer > 0. Most groups to hold in memory.
+			Spill_dir:	where to write spill files (made if needed, and removed by close()
+						if it was made here)
+	"""
+	def __init__(self, N_values, Max_groups=MAX_GROUPS, Spill_dir=None):
+		if type(Max_groups) is not int or Max_groups < 1:
+			raise ValueError("Max_groups needs to be an integer > 0.")
+		self.n_values = N_values
+		self.max_groups = Max_groups
+		self.spill_dir = Spill_dir
+		self.made_spill_dir = False
+		self.groups = dict()
+		self.spill_files = []
+		self.n_lines = 0
+		self.n_bytes = 0
+
+	def add_lines(self, Lines, Delim, Column_index, Value_columns, First_line=1, Progress=None):
+		""" Add each line's values to the totals of its group (the value at Column_index).
+
+			Values that are one of column_reader.NA_VALUES (or nan) are skipped. Anything else
+				that isn't a number is an error.
+
+			Returns: the number of lines added
+		"""
+		groups = self.groups
+		n_values = self.n_values
+		max_groups = self.max_groups
+		na_values = set(column_reader.NA_VALUES)
+		max_column = max([Column_index]+Value_columns)
+		n_splits = max_column+1
+		# (record index of each value column's n)
+		slots = [(column, 1+4*k) for k, column in enumerate(Value_columns)]
+		i = First_line
+		n_bytes = 0
+		for line in Lines:
+			fields = line.rstrip('\r\n').split(Delim, n_splits)
+			if len(fields) <= max_column or len(fields[Column_index]) == 0:
+				partition_functions.get_key(line, Delim, Column_index, i)
+				raise ValueError("Line "+str(i)+" has no column "+str(max_column)+".")
+			key = fields[Column_index]
+			record = groups.get(key)
+			if record is None:
+				if len(groups) >= max_groups:
+					self.spill()
+				record = new_record(n_values)
+				groups[key] = record
+			record[0] += 1
+			for column, j in slots:
+				text = fields[column]
+				try:
+					value = float(text)
+				except ValueError:
+					if text in na_values:
+						continue
+					raise ValueError("Line "+str(i)+" has "+repr(text)+" in column "+str(column)
+						+", which isn't a number.")
+				if value != value:
+					continue
+				record[j] += 1
+				record[j+1] += value
+				if value < record[j+2]:
+					record[j+2] = value
+				if value > record[j+3]:
+					record[j+3] = value
+			n_bytes += len(line)
+			i += 1
+			if Progress is not None and i & 8191 == 0 and Progress.due():
+				Progress.update(self.n_lines+i-First_line, self.n_bytes+n_bytes, len(groups))
+		self.n_lines += i-First_line
+		self.n_bytes += n_bytes
+		return i-First_line
+
+	def spill(self):
+		""" Write the groups in memory to a new spill file, sorted by group, and forget them.
+		"""
+		if self.spill_dir is None:
+			raise ValueError("More than "+str(self.max_groups)+" groups, and no Spill_dir to spill them to.")
+		if not os.path.isdir(self.spill_dir):
+			os.makedirs(self.spill_dir)
+			self.made_spill_dir = True
+		path = os.path.join(self.spill_dir, "spill_"+str(len(self.spill_files)).zfill(4))
+		items = sorted(self.groups.iteritems())
+		with open(path, 'wb') as handle:
+			for k in range(0, len(items), SPILL_CHUNK):
+				cPickle.dump(items[k:k+SPILL_CHUNK], handle, cPickle.HIGHEST_PROTOCOL)
+		self.spill_files.append(path)
+		self.groups.clear()
+
+	def merged(self):
+		""" Yield (group, record) for every group, sorted by group, merging the spill files
+			and the groups still in memory.
+		"""
+		runs = [_spill_records(path) for path in self.spill_files]
+		runs.append(iter(sorted(self.groups.iteritems())))
+		if len(runs) == 1:
+			for item in runs[0]:
+				yield item
+			return
+		for group, items in itertools.groupby(heapq.merge(*runs), key=lambda item: item[0]):
+			record = None
+			for item in items:
+				if record is None:
+					record = item[1]
+				else:
+					combine_records(record, item[1])
+			yield group, record
+
+	def close(self):
+		""" Remove the spill files (and Spill_dir, if it was made here).
+		"""
+		for path in self.spill_files:
+			if os.path.isfile(path):
+				os.remove(path)
+		self.spill_files = []
+		if self.made_spill_dir and os.path.isdir(self.spill_dir):
+			shutil.rmtree(self.spill_dir)
+			self.made_spill_dir = False
+
+def aggregate(In_file, Delim, Skip, Column_index, Value_columns, Out_file, Max_groups=MAX_GROUPS,
+	Spill_dir=None, Stats=None, Progress_secs=None):
+	""" Read In_file once, and write a table of each group's count and the n, sum, min, max and
+		mean of each of Value_columns (see summary_header) to Out_file, sorted by group.
+
+		Arguments:
+			In_file:		"/my_directory/my_file.txt" (may be gzip or zstd compressed)
+			Delim:			the actual delimiter character (e.g. '\\t', not 'tab'). The
+							summary is delimited by it too.
+			Skip:			integer >= 0. How many lines at the top to skip?
+			Column_index:	integer >= 0. Which column to group by? (0 is first column)
+			Value_columns:	list of column indices to summarize (empty to just count lines)
+			Out_file:		"/my_out_directory/group_summary.txt"
+			Max_groups:		integer > 0. Most groups to keep in memory before spilling them
+							to disk (see Aggregator).
+			Spill_dir:		Optional. Where to spill to. Defaults to a directory next to
+							Out_file (removed when done).
+			Stats:			Optional dict. Spill stats ("spills", "max_groups") are added to it.
+			Progress_secs:	Optional number. Print a progress record (see
+							partition_functions.Progress) every this many seconds.
+
+		Returns: (number of lines not skipped, number of groups)
+	"""
+	if type(Delim) is not str or len(Delim) == 0:
+		raise ValueError("Delim needs to be a non-empty string.")
+	if type(Skip) is not int or Skip < 0:
+		raise ValueError("Skip needs to be an integer >= 0.")
+	if type(Column_index) is not int or Column_index < 0:
+		raise ValueError("Column_index needs to be an integer >= 0.")
+	Value_columns = check_value_columns(Value_columns)
+	if Column_index in Value_columns:
+		raise ValueError("Column_index can't be one of Value_columns.")
+	if not os.path.isfile(In_file):
+		raise ValueError(In_file+" not found.")
+	if Spill_dir is None:
+		Spill_dir = os.path.join(os.path.dirname(os.path.abspath(Out_file)),
+			".aggregate_spill_"+str(os.getpid()))
+	if Progress_secs is None:
+		progress = None
+	elif helper_functions.compression_of(In_file) is None:
+		progress = partition_functions.Progress(os.path.getsize(In_file), Progress_secs)
+	else:
+		# (don't know how big it is uncompressed)
+		progress = partition_functions.Progress(None, Progress_secs)
+	aggregator = Aggregator(len(Value_columns), Max_groups, Spill_dir)
+	try:
+		with helper_functions.open_file(In_file, 'rb') as handle:
+			partition_functions.skip_lines(handle, Skip)
+			aggregator.add_lines(handle, Delim, Column_index, Value_columns, Skip+1, progress)
+		n_groups = 0
+		with open(Out_file+".tmp", 'wb') as out:
+			out.write(summary_header(Value_columns, Delim))
+			for group, record in aggregator.merged():
+				out.write(summary_line(group, record, Delim))
+				n_groups += 1
+		os.rename(Out_file+".tmp", Out_file)
+		if Stats is not None:
+			partition_functions.add_stats(Stats, {"spills": len(aggregator.spill_files),
+				"max_groups": Max_groups})
+	finally:
+		aggregator.close()
+	return aggregator.n_lines, n_groups
+
+def read_summary(Summary_file, Delim="\t"):
+	""" Read a summary table (from aggregate) back in.
+
+		Returns: dict of group -> dict of column name -> value (floats, or None for NA;
+			count and the n's are integers)
+	"""
+	summary = dict()
+	with open(Summary_file, 'rb') as handle:
+		names = handle.readline().rstrip('\r\n').split(Delim)
+		for line in handle:
+			fields = line.rstrip('\r\n').split(Delim)
+			row = dict()
+			for name, text in zip(names[1:], fields[1:]):
+				if name == "count" or name.endswith("_n"):
+					row[name] = int(text)
+				elif text == "NA":
+					row[name] = None
+				else:
+					row[name] = float(text)
+			summary[fields[0]] = row
+	return summary
@@ -0,0 +1,399 @@
+#!/usr/bin/python
+
+### benchmark.py
+### 2016_3_5
+
+###    Makes fake delimited files and times col_grep's partitioning, aggregation and prescan,
+###        bash_sort, grep_for_files and column_reader on them, so we can tell if a change made
+###        things faster or slower.
+###
+###    For each case we record: wall time, lines (or files) per second, peak memory (RSS, this
+###        process and any it started), and the most file descriptors open at once (this process
+###        and any it started, summed, sampled every 10ms). Each case runs in its own process,
+###        so they don't share memory peaks.
+###
+###    Results are written as JSON, one line per case, along with the settings and the git
+###        commit, so runs can be compared.
+###
+###    Usage:
+###        Make a test file:
+###            python benchmark.py generate out.txt --rows 1000000 --columns 5 --cardinality 1000 --skew zipf
+###        Run the benchmarks (makes its own test files in --work_dir):
+###            python benchmark.py run --rows 1000000 --cardinality 1000 --skew zipf --out results.json
+###            add --cases partition_stream,bash_sort to only run some of them
+###        Compare two runs:
+###            python benchmark.py compare before.json after.json
+
+import sys, os
+import argparse
+import bisect
+import json
+import multiprocessing
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+import helper_functions
+import partition_functions
+import column_reader
+import aggregate_functions
+import key_sketch
+
+CASES = ["partition_stream", "partition_mmap", "partition_local", "partition_buckets",
+    "partition_gz", "aggregate", "prescan", "bash_sort", "grep_for_files", "read_columns"]
+
+
+def zipf_weights(Cardinality, S):
+    """ Cumulative weights of a Zipf distribution over Cardinality keys (key k ~ 1/(k+1)^S).
+    """
+    cumulative = list()
+    total = 0.0
+    for k in range(Cardinality):
+        total += 1.0/(k+1)**S
+        cumulative.append(total)
+    return cumulative
+
+def generate_file(Path, Rows, Columns=5, Cardinality=1000, Skew="uniform", Zipf_s=1.1,
+    Delim=",", Key_column=1, Header=True, Seed=0):
+    """ Write a delimited file of Rows rows (plus a header) to Path.
+
+        Column Key_column holds keys key_0 ... key_<Cardinality-1>, picked uniformly or
+            Zipf distributed (key_0 most common). The other columns are a row number and
+            random numbers.
+
+        Returns: dict of key -> number of rows
+    """
+    if Skew != "uniform" and Skew != "zipf":
+        raise ValueError("Skew needs to be 'uniform' or 'zipf', not: "+str(Skew))
+    if Key_column >= Columns:
+        raise ValueError("Key_column needs to be < Columns")
+    rng = random.Random(Seed)
+    if Skew == "zipf":
+        cumulative = zipf_weights(Cardinality, Zipf_s)
+        total = cumulative[-1]
+    counts = dict()
+    with open(Path, 'wb') as handle:
+        if Header:
+            handle.write(Delim.join(["col_"+str(c) for c in range(Columns)])+"\n")
+        for i in xrange(Rows):
+            if Skew == "zipf":
+                k = bisect.bisect_left(cumulative, rng.random()*total)
+            else:
+                k = rng.randrange(Cardinality)
+            key = "key_"+str(k)
+            counts[key] = counts.get(key, 0)+1
+            fields = [str(i)]+["%.6f" % rng.random() for c in range(Columns-1)]
+            fields[Key_column] = key
+            handle.write(Delim.join(fields)+"\n")
+    return counts
+
+def generate_tree(Dir, Files, Per_dir=100, Seed=0):
+    """ Make Files empty files in a tree of directories (Per_dir files per directory,
+        and directories nested a few deep). About 1 in 10 file names contain 'match'.
+    """
+    rng = random.Random(Seed)
+    for i in xrange(Files):
+        d = i//Per_dir
+        sub = os.path.join(Dir, "d"+str(d % 10), "d"+str(d % 7), "d"+str(d))
+        if not os.path.isdir(sub):
+            os.makedirs(sub)
+        if rng.random() < 0.1:
+            name = "file_"+str(i)+"_match.txt"
+        else:
+            name = "file_"+str(i)+".txt"
+        open(os.path.join(sub, name), 'wb').close()
+
+def children_by_pid():
+    """ dict of PID -> PIDs of the processes it started, from the parent PID in each
+        /proc/<pid>/stat (for kernels without /proc/<pid>/task/<tid>/children).
+    """
+    children = dict()
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open("/proc/"+name+"/stat") as handle:
+                stat = handle.read()
+        except IOError:
+            # (process ended)
+            continue
+        # pid (command) state ppid ..., and the command may have spaces or parens in it
+        ppid = int(stat[stat.rindex(")")+2:].split()[1])
+        children.setdefault(ppid, list()).append(int(name))
+    return children
+
+def child_pids(Pid):
+    """ PIDs of the processes Pid started, from /proc/<pid>/task/<tid>/children.
+    """
+    children = list()
+    try:
+        tasks = os.listdir("/proc/"+str(Pid)+"/task")
+    except OSError:
+        # (process ended)
+        return children
+    for tid in tasks:
+        try:
+            with open("/proc/"+str(Pid)+"/task/"+tid+"/children") as handle:
+                children.extend(int(child) for child in handle.read().split())
+        except IOError:
+            # (thread ended)
+            pass
+    return children
+
+def count_fds(Pid):
+    """ File descriptors open in Pid and every process under it (children, their children, ...)
+        at the moment, all together. Processes that end while they're being counted are skipped.
+    """
+    if os.path.exists("/proc/self/task/"+str(os.getpid())+"/children"):
+        find_children = child_pids
+    else:
+        find_children = children_by_pid().get
+    total = 0
+    pids = [Pid]
+    seen = set()
+    while len(pids) > 0:
+        pid = pids.pop()
+        if pid in seen:
+            continue
+        seen.add(pid)
+        try:
+            total += len(os.listdir("/proc/"+str(pid)+"/fd"))
+        except OSError:
+            # (process ended, or isn't ours to look at)
+            continue
+        pids.extend(find_children(pid) or list())
+    return total
+
+class FdSampler(threading.Thread):
+    """ Keeps track of the most file descriptors this process and the processes it started
+        (e.g. parallel_partition's workers, sort) have had open at once, all together.
+    """
+    def __init__(self, Interval=0.01):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.interval = Interval
+        self.pid = os.getpid()
+        self.peak = 0
+        self.running = True
+
+    def run(self):
+        while self.running:
+            self.peak = max(self.peak, count_fds(self.pid))
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+        self.join()
+        self.peak = max(self.peak, count_fds(self.pid))
+
+def run_case(Case, Settings, Data, Work_dir):
+    """ Run one benchmark case (in this process).
+
+        Returns: number of items (lines or files) processed
+    """
+    out = tempfile.mkdtemp(dir=Work_dir)
+    try:
+        if Case == "partition_stream":
+            n, counts = partition_functions.stream_partition(Data["txt"], ",", 1, 1, out, "n_fold")
+        elif Case == "partition_mmap":
+            n, counts = partition_functions.stream_partition(Data["txt"], ",", 1, 1, out, "n_fold",
+                Scanner="mmap")
+        elif Case == "partition_local":
+            n, counts = partition_functions.parallel_partition(Data["txt"], ",", 1, 1, out, "n_fold",
+                Settings["workers"])
+        elif Case == "partition_buckets":
+            n, counts = partition_functions.stream_partition(Data["txt"], ",", 1, 1, out, "n_fold",
+                Buckets=Settings["buckets"])
+        elif Case == "partition_gz":
+            n, counts = partition_functions.stream_partition(Data["gz"], ",", 1, 1, out, "n_fold")
+        elif Case == "aggregate":
+            n, n_groups = aggregate_functions.aggregate(Data["txt"], ",", 1, 1, [2, 3],
+                os.path.join(out, aggregate_functions.SUMMARY_FILE))
+        elif Case == "prescan":
+            n = key_sketch.prescan(Data["txt"], ",", 1, 1)["lines_seen"]
+        elif Case == "bash_sort":
+            helper_functions.bash_sort(os.path.basename(Data["txt"]), os.path.dirname(Data["txt"])+"/",
+                out+"/", 2, Delim=",")
+            n = Settings["rows"]
+        elif Case == "read_columns":
+            # (needs numpy)
+            n = 0
+            for rows, keys, values in column_reader.column_batches(Data["txt"], ",", 1, [0, 1, 2],
+                ["int", "bytes", "float"]):
+                n += len(rows)
+        elif Case == "grep_for_files":
+            helper_functions.grep_for_files(Data["tree"]+"/", "match", Lacks="_9")
+            n = Settings["tree_files"]
+        else:
+            raise ValueError("Unknown case: "+str(Case))
+    finally:
+        shutil.rmtree(out)
+    return n
+
+def _measure_case(Case, Settings, Data, Work_dir, Queue):
+    """ Child process: run a case, and send back what it cost.
+    """
+    try:
+        sampler = FdSampler()
+        sampler.start()
+        start = time.time()
+        n = run_case(Case, Settings, Data, Work_dir)
+        wall = time.time()-start
+        sampler.stop()
+        # ru_maxrss is in kilobytes on linux
+        rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        Queue.put({"case": Case, "status": "ok", "items": n, "wall_sec": wall,
+            "items_per_sec": n/max(wall, 1e-9), "peak_rss_mb": rss/1024.0,
+            "peak_fds": sampler.peak})
+    except Exception as e:
+        Queue.put({"case": Case, "status": "failed", "error": repr(e)})
+
+def measure_case(Case, Settings, Data, Work_dir):
+    """ Run a case in its own process. Returns its result (a dict).
+    """
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_measure_case, args=(Case, Settings, Data, Work_dir, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=open(os.devnull, 'wb')).strip()
+    except (subprocess.CalledProcessError, OSError):
+        return ""
+
+def run_benchmarks(Settings, Cases, Work_dir, Repeats=1):
+    """ Make the test data, and measure each case Repeats times.
+
+        Returns: list of results (dicts)
+    """
+    data = dict()
+    data["txt"] = os.path.join(Work_dir, "bench_data.txt")
+    print "Generating "+str(Settings["rows"])+" rows..."
+    generate_file(data["txt"], Settings["rows"], Settings["columns"], Settings["cardinality"],
+        Settings["skew"], Settings["zipf_s"], Seed=Settings["seed"])
+    if "partition_gz" in Cases:
+        data["gz"] = data["txt"]+".gz"
+        with open(data["txt"], 'rb') as in_handle:
+            with helper_functions.open_file(data["gz"], 'wb', "gz") as out_handle:
+                shutil.copyfileobj(in_handle, out_handle)
+    if "grep_for_files" in Cases:
+        data["tree"] = os.path.join(Work_dir, "bench_tree")
+        print "Generating "+str(Settings["tree_files"])+" files..."
+        generate_tree(data["tree"], Settings["tree_files"], Seed=Settings["seed"])
+
+    info = {"commit": git_commit(), "host": platform.node(), "python": platform.python_version(),
+        "time": time.strftime("%Y_%m_%d_%H_%M_%S"), "settings": Settings}
+    results = list()
+    for case in Cases:
+        for r in range(Repeats):
+            result = measure_case(case, Settings, data, Work_dir)
+            result["repeat"] = r
+            result.update(info)
+            results.append(result)
+            if result["status"] == "ok":
+                print (case+"\t"+str(round(result["wall_sec"], 2))+" sec\t"
+                    +str(int(result["items_per_sec"]))+" /sec\t"+str(round(result["peak_rss_mb"], 1))
+                    +" MB\t"+str(result["peak_fds"])+" fds")
+            else:
+                print case+"\tFAILED: "+result["error"]
+    return results
+
+def best_by_case(Results):
+    """ Fastest ok result of each case.
+    """
+    best = dict()
+    for result in Results:
+        if result["status"] != "ok":
+            continue
+        if result["case"] not in best or result["wall_sec"] < best[result["case"]]["wall_sec"]:
+            best[result["case"]] = result
+    return best
+
+def read_results(Path):
+    with open(Path, 'rb') as handle:
+        return [json.loads(line) for line in handle if len(line.strip()) > 0]
+
+def compare_results(Before, After):
+    """ Print the fastest time of each case in two sets of results, and how they changed.
+    """
+    before = best_by_case(Before)
+    after = best_by_case(After)
+    print "case\tbefore_sec\tafter_sec\tspeedup\tbefore_MB\tafter_MB\tbefore_fds\tafter_fds"
+    for case in CASES:
+        if case not in before or case not in after:
+            continue
+        b = before[case]
+        a = after[case]
+        print (case+"\t"+str(round(b["wall_sec"], 3))+"\t"+str(round(a["wall_sec"], 3))+"\t"
+            +str(round(b["wall_sec"]/max(a["wall_sec"], 1e-9), 2))+"x\t"
+            +str(round(b["peak_rss_mb"], 1))+"\t"+str(round(a["peak_rss_mb"], 1))+"\t"
+            +str(b["peak_fds"])+"\t"+str(a["peak_fds"]))
+
+def parse_arguments(Argv):
+    parser = argparse.ArgumentParser(description="Benchmark col_grep and the file helpers.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    data_options = argparse.ArgumentParser(add_help=False)
+    data_options.add_argument("--rows", type=int, default=1000000)
+    data_options.add_argument("--columns", type=int, default=5)
+    data_options.add_argument("--cardinality", type=int, default=1000)
+    data_options.add_argument("--skew", default="uniform", choices=["uniform", "zipf"])
+    data_options.add_argument("--zipf_s", type=float, default=1.1)
+    data_options.add_argument("--seed", type=int, default=0)
+
+    generate = subparsers.add_parser("generate", parents=[data_options])
+    generate.add_argument("out_FILE")
+
+    run = subparsers.add_parser("run", parents=[data_options])
+    run.add_argument("--cases", default=",".join(CASES))
+    run.add_argument("--repeats", type=int, default=1)
+    run.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    run.add_argument("--buckets", type=int, default=64)
+    run.add_argument("--tree_files", type=int, default=20000)
+    run.add_argument("--work_dir", default=None)
+    run.add_argument("--out", default=None)
+
+    compare = subparsers.add_parser("compare")
+    compare.add_argument("before")
+    compare.add_argument("after")
+    return parser.parse_args(Argv)
+
+
+if __name__ == "__main__":
+    args = parse_arguments(sys.argv[1:])
+
+    if args.command == "generate":
+        generate_file(args.out_FILE, args.rows, args.columns, args.cardinality, args.skew,
+            args.zipf_s, Seed=args.seed)
+
+    elif args.command == "run":
+        cases = args.cases.split(",")
+        for case in cases:
+            if case not in CASES:
+                raise ValueError(case+" isn't one of: "+",".join(CASES))
+        settings = {"rows": args.rows, "columns": args.columns, "cardinality": args.cardinality,
+            "skew": args.skew, "zipf_s": args.zipf_s, "seed": args.seed, "workers": args.workers,
+            "buckets": args.buckets, "tree_files": args.tree_files}
+        work_dir = tempfile.mkdtemp(prefix="col_grep_bench_", dir=args.work_dir)
+        try:
+            results = run_benchmarks(settings, cases, work_dir, args.repeats)
+        finally:
+            shutil.rmtree(work_dir)
+        if args.out is not None:
+            with open(args.out, 'ab') as handle:
+                for result in results:
+                    handle.write(json.dumps(result, sort_keys=True)+"\n")
+            print "Results appended to "+args.out
+
+    else:
+        compare_results(read_results(args.before), read_results(args.after))
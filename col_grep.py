@@ -9,7 +9,8 @@
 ###
 ###    Arguments:
 ###        in_FILE
-###            non-zipped!
+###            plain text, gzip (.gz or BGZF) or zstd (.zst) compressed. Compressed files are
+###                decompressed as they're read (with pigz / zstd if they're on the PATH)
 ###        delim: how is the input file delimited? 
 ###            for comma, write: ,
 ###            for tab, write: tab
@@ -19,163 +20,613 @@
 ###        Column_index: which column to group by
 ###            integer (0 is first column)
 ###        out_DIR: where should files by written to?
-###            *Extant* and *empty* directory
+###            *Extant* and *empty* directory (unless it's from an earlier --incremental run)
 ###        folderize: Should each file be put into it's own sub-directory?
 ###            'y_fold' or 'n_fold'
 ###
+###    Options:
+###        --engine: 'stream' (default), 'local' or 'bsub'
+###            stream: read in_FILE once, writing each line to its group's file as we go.
+###                Only a bounded number of group files are kept open at a time, so this
+###                works for any number of groups.
+###            local: like stream, but split in_FILE into --workers byte ranges (at line breaks)
+###                that are partitioned by separate processes on this machine, then glued
+###                back together per group. Output is identical to stream's.
+###                gzip in_FILEs are split too, using an index of checkpoints in the compressed
+###                data (in_FILE.gzidx, built on the first run; see gzip_index.py). zstd in_FILEs
+###                are partitioned by a single process.
+###            bsub: the old way. Submit LSF jobs that each grep in_FILE for a batch of groups
+###                (see --target_mb). in_FILE gets read once per group!
+###                The jobs are checked on with bjobs, so ones that die are reported right away.
+###                Without LSF (no bsub on the PATH, or JOB_EXECUTOR=local), the jobs run on this
+###                machine instead (see job_executors.py).
+###        --workers: number of processes for --engine local (defaults to number of cores)
+###        --scanner: 'lines' (default) or 'mmap'. How each line's group is found.
+###            lines: read line by line, split off the columns up to the group.
+###            mmap: memory map in_FILE and find the group with a regex in the map itself,
+###                only copying out the group (plain text in_FILE only).
+###            To see how fast each is on your file, run:
+###                python -c "import partition_functions as p; p.compare_scanners('in_file.txt', '\t', 1, 3)"
+###        --max_open: max number of group files each process keeps open at once
+###        --buffer_mb: hold up to this many MB of lines in memory (split between --workers), and
+###            write them out a group at a time, biggest groups first, when it fills up. Fewer,
+###            bigger writes and far fewer file opens, which helps a lot on NFS/GPFS scratch.
+###            Prints how many writes it took, so the cap can be tuned. (default: off)
+###            (stream / local engines and --incremental only)
+###        --buckets: integer. Instead of a file per group, write lines to this many files
+###            (bucket_0000, bucket_0001, ...) by a hash of the group, plus bucket_index.txt
+###            listing which bucket each group is in and how many lines it has. Use this
+###            for columns with lots (like, millions) of distinct values.
+###            partition_functions.bucket_key_lines() pulls one group's lines back out.
+###            (stream / local engines only)
+###        --groups: comma separated list of groups. Only write the files of these groups.
+###            Uses an index of where each group's lines are in in_FILE (in_FILE.col<#>.idx,
+###            see column_index.py), which is built the first time and reused until in_FILE
+###            changes, so pulling a few groups out of a big file again is quick.
+###            (plain text in_FILE only, ignores --engine)
+###        --incremental: for files that keep getting appended to (like logs). Saves a checkpoint
+###            in out_DIR every --checkpoint_mb of in_FILE. Running again on the same out_DIR only
+###            reads the lines added to in_FILE since the last run (and appends them to the
+###            group files). If a run gets killed, the next one resumes from its last checkpoint.
+###            (plain text in_FILE only, ignores --engine)
+###        --checkpoint_mb: how often --incremental saves a checkpoint (default 256)
+###        --prescan: don't write anything. Just read in_FILE (or --sample of its lines) and print
+###            about how many distinct groups there are and which groups are biggest, using a
+###            fixed amount of memory (see key_sketch.py), and recommend whether to write a file
+###            per group, use --buckets, or use --aggregate. Worth doing first on a column that
+###            might have millions of distinct values.
+###        --sample: for --prescan, the fraction of lines to look at, like 0.1 (default 1)
+###        --aggregate: don't write any group files. Instead read in_FILE once and write one table,
+###            out_DIR/group_summary.txt, with a line per group: its number of lines and, for each
+###            of --value_columns, how many of its values are numbers (NA, nan and empty ones are
+###            skipped) and their sum, min, max and mean (see aggregate_functions.py).
+###            (ignores --engine)
+###        --value_columns: comma separated column indices for --aggregate to summarize, like 3,5
+###            (default: none, just count lines per group)
+###        --max_groups: for --aggregate, the most groups to hold in memory. Beyond that, totals
+###            are spilled to disk, and merged at the end (default 1000000)
+###        --compress: 'gz' or 'bgzf'. Write each group's file compressed (as group.gz)
+###            (stream / local engines only)
+###        --target_mb: for --engine bsub, about how much work (MB read + written) to give each
+###            job. Each group a job greps costs a read of in_FILE plus writing the group, so
+###            big groups get jobs (nearly) to themselves and small ones get packed together.
+###            Defaults to 10x the size of in_FILE (about 10 groups per job, like it used to be).
+###            The planned jobs are printed before they're submitted.
+###        --max_jobs: for --engine bsub, the most jobs to submit (default 1000)
+###        --timeout: for --engine bsub, give up on batches that haven't finished after this
+###            many seconds (default: wait forever)
+###        --progress_secs: print a progress record this often (default 60, 0 for none): MB read,
+###            lines/sec, groups seen, files open and about how long is left. With --engine local,
+###            each worker prints its own; with --engine bsub, how many batches are done.
+###        --stats_file: where to write a JSON file of stats about the run when it's done
+###            (default col_grep_stats.json): lines and bytes per group, how long each phase
+###            took (discovery, partitioning, merging, submitting, waiting), and file opens /
+###            buffered writes. Handy for spotting skewed groups, and runs that got slower.
+###
 ###    Assumptions:
 ###        The skipped lines aren't formatted like the rest of the file, and/or the col of interest
 ###            in the skipped lines are not grep-identical to any row below the skipped lines in
 ###            the col of interest.
 ###        ***The col of interest doesn't have something unix/bash-interpretable in it***
-###        You're using a LSF job schedule and the following bash command looks familiar:
+###        If using --engine bsub, you're using a LSF job schedule and the following bash
+###            command looks familiar:
 ###            > bsub -e error.err -o out.out python my_fav_script.py
 ###        The out_DIR exists and is *EMPTY*
 ###
 ###    Usage:
-###        python grep_col.py in_file.txt delim skip Column_# out_DIR folderize
+###        python col_grep.py in_file.txt delim skip Column_# out_DIR folderize [--engine local --workers 8]
 ###
 ###    Note:
 ###        I suggest submitting this script as a job and to include the -e err and -o out files.
 
 import sys, os
-from subprocess import Popen
+import argparse
+import multiprocessing
 import time
+import json
+import shutil
+
+import helper_functions
+import partition_functions
+import column_index
+import aggregate_functions
+import key_sketch
+import job_executors
+
+MANIFEST_DIR = "cowabunga_manifests"
 
-print "Initiating grep_col.py"
-print "Argument List:", str(sys.argv[1:])
+def parse_arguments(Argv):
+    parser = argparse.ArgumentParser(description="Split a file into one file per group at a column.")
+    parser.add_argument("in_FILE")
+    parser.add_argument("delim")
+    parser.add_argument("skip", type=int)
+    parser.add_argument("Column_index", type=int)
+    parser.add_argument("out_DIR")
+    parser.add_argument("folderize")
+    parser.add_argument("--engine", default="stream", choices=["stream", "local", "bsub"])
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--scanner", default="lines", choices=["lines", "mmap"])
+    parser.add_argument("--max_open", type=int, default=None)
+    parser.add_argument("--buffer_mb", type=float, default=None)
+    parser.add_argument("--buckets", type=int, default=None)
+    parser.add_argument("--groups", default=None)
+    parser.add_argument("--incremental", action="store_true")
+    parser.add_argument("--checkpoint_mb", type=int, default=256)
+    parser.add_argument("--prescan", action="store_true")
+    parser.add_argument("--sample", type=float, default=1.0)
+    parser.add_argument("--aggregate", action="store_true")
+    parser.add_argument("--value_columns", default="")
+    parser.add_argument("--max_groups", type=int, default=aggregate_functions.MAX_GROUPS)
+    parser.add_argument("--compress", default=None, choices=["gz", "bgzf"])
+    parser.add_argument("--timeout", type=float, default=None)
+    parser.add_argument("--target_mb", type=float, default=None)
+    parser.add_argument("--max_jobs", type=int, default=1000)
+    parser.add_argument("--progress_secs", type=float, default=60)
+    parser.add_argument("--stats_file", default="col_grep_stats.json")
+    return parser.parse_args(Argv)
 
-if (len(sys.argv)-1 != 6):
-    raise Exception("Expected 6 command arguments.")
+# Sub-routine each bsub job runs. It greps each of its groups into a temp file that is
+#  renamed once complete, then writes a manifest for its batch (also written to a temp file
+#  and renamed), so the driver only ever sees finished files.
+COWABUNGA = r'''#!/usr/bin/python
+import sys, os, json, traceback
+from subprocess import call
 in_FILE = str(sys.argv[1])
-delim = str(sys.argv[2])
-skip = int(sys.argv[3])
-Column_index = int(sys.argv[4])
-out_DIR = str(sys.argv[5])
+files = str(sys.argv[2])
+out_DIR = str(sys.argv[3])
+delim = str(sys.argv[4])
+if delim == 'tab':
+	delim = '\t'
+Column_index = int(sys.argv[5])
 folderize = str(sys.argv[6])
-
-if not (os.path.isfile(in_FILE)):
-    raise ValueError(in_FILE+" not found. Is it a *full* and valid file path?")
-
-# If tab-delimited, need to make sure it will be python-interpretable:
-if delim != "," and delim != "tab":
-    raise ValueError("This script was only tested with ',' or 'tab', not '"+delim+"'")
-    
-if skip < 0:
-    raise ValueError("Skip needs to be integer >= 0")
-
-if Column_index < 0:
-    raise ValueError("Column_index needs to be integer >= 0")
-
-if not (os.path.isdir(out_DIR)):
-    raise ValueError(out_DIR+" not found. Is it a valid + extant directory?")
-
-if len(os.listdir(out_DIR)) > 0:
-    raise ValueError(out_DIR+" already contains files. Please choose another dir or empty it.")
-
-if folderize != "y_fold" and folderize != "n_fold":
-    raise ValueError("folderize needs to be 'y_fold' or 'n_fold', not: "+folderize)
-
-# Sub-routine
-if os.path.isfile("cowabunga.py"):
-    print "FYI, we're overwriting something called 'cowabunga.py'"
-with open("cowabunga.py", 'wb') as handle:
-    handle.write("#!/usr/bin/python\n")
-    handle.write("import sys, os, pdb\nfrom subprocess import call\n")
-    handle.write("in_FILE = str(sys.argv[1])\n")
-    handle.write("files = str(sys.argv[2])\n")
-    handle.write("out_DIR = str(sys.argv[3])\n")
-    handle.write("delim = str(sys.argv[4])\n")
-    handle.write("if delim == 'tab':\n\tdelim='\t'\n")
-    handle.write("Column_index = int(sys.argv[5])\n")
-    handle.write("folderize = str(sys.argv[6])\n")
-    handle.write("files = files.split(',')\n")
-    handle.write("col_seps = Column_index * (\".*\"+delim)\n")
-    handle.write("for f in files:\n")
-    handle.write("\tif folderize =='n_fold':\n")
-    handle.write("\t\tnew_out_FILE = os.path.join(out_DIR, f)\n")
-    handle.write("\tif folderize =='y_fold':\n")
-    handle.write("\t\tnew_out_DIR = os.path.join(out_DIR, f)\n")
-    handle.write("\t\tos.makedirs(new_out_DIR)\n")
-    handle.write("\t\tnew_out_FILE = os.path.join(new_out_DIR, f)\n")
-    handle.write("\tout = call([\"grep $'\"+col_seps+\"\"+f+\"' \"+in_FILE+\" > \"+new_out_FILE],shell=True)")
-
-
-# Convert delim to '\t' if it is tab
-if delim == "tab":
-    delim_check = '\t'
-# Else delim is kept the same ',' in this case
-else:
-    delim_check = delim
-
-# Get unique set of elements from column of interest
-# Yes, I could combine the step after this into this loop, too,
-#     but it's my house and I can do what I want.
-groups = set()
-i = 0
+manifest = str(sys.argv[7])
+# files is a file listing this batch's groups, one per line
+with open(files, 'rb') as handle:
+	files = [line.rstrip('\r\n') for line in handle]
+col_seps = Column_index * (".*"+delim)
+# zgrep for gzip'd in_FILEs
 with open(in_FILE, 'rb') as handle:
-    for line in handle:
-        # Don't get unique elements from skipped lines
-        if i < skip:
-            i+=1
-            continue
-        if delim_check not in line:
-            raise ValueError("You fool! '"+delim_check+"' isn't the delim of the file!")
-        # Otherwise, get those unique elements from the col of interest
-        if len(line.rstrip('\r\n').split(delim_check)[Column_index]) > 0: 
-            groups.add(line.rstrip('\r\n').split(delim_check)[Column_index])
+	if handle.read(2) == "\x1f\x8b":
+		grep = "zgrep"
+	else:
+		grep = "grep"
+report = {"groups": files, "done": [], "status": "ok", "error": ""}
+try:
+	for f in files:
+		if folderize == 'n_fold':
+			new_out_DIR = out_DIR
+		if folderize == 'y_fold':
+			new_out_DIR = os.path.join(out_DIR, f)
+			os.makedirs(new_out_DIR)
+		new_out_FILE = os.path.join(new_out_DIR, f)
+		tmp_out_FILE = os.path.join(new_out_DIR, "."+f+".tmp")
+		out = call([grep+" $'"+col_seps+f+"' "+in_FILE+" > "+tmp_out_FILE], shell=True,
+			executable="/bin/bash")
+		# (with bash, for the $'...' quoting: /bin/sh isn't bash everywhere)
+		# grep exits with 1 if nothing matched, 2 if something went wrong
+		if out > 1:
+			raise Exception("grep exited with "+str(out)+" for group "+f)
+		os.rename(tmp_out_FILE, new_out_FILE)
+		report["done"].append(f)
+except Exception:
+	report["status"] = "failed"
+	report["error"] = traceback.format_exc()
+with open(manifest+".tmp", 'wb') as handle:
+	json.dump(report, handle)
+os.rename(manifest+".tmp", manifest)
+'''
+
+def write_cowabunga():
+    """ Write the sub-routine each bsub job runs to grep its groups out of in_FILE, and
+        make an empty directory for the batch manifests.
+
+        Returns: the (absolute) manifest directory
+    """
+    if os.path.isfile("cowabunga.py"):
+        print "FYI, we're overwriting something called 'cowabunga.py'"
+    with open("cowabunga.py", 'wb') as handle:
+        handle.write(COWABUNGA)
+    manifest_DIR = os.path.abspath(MANIFEST_DIR)
+    if os.path.isdir(manifest_DIR):
+        print "FYI, we're overwriting something called '"+MANIFEST_DIR+"'"
+        shutil.rmtree(manifest_DIR)
+    os.mkdir(manifest_DIR)
+    return manifest_DIR
+
+def discover_groups(in_FILE, delim_check, skip, Column_index, scanner, progress=None):
+    """ Get unique set of elements from column of interest, and how big each group is.
+
+        Returns: (dict of group -> bytes of its lines, dict of group -> number of lines)
+    """
+    group_bytes = dict()
+    group_lines = dict()
+    i = 0
+    n_bytes = 0
+    # (Skipped lines are skipped by the scanner)
+    for key, line in partition_functions.scan_file(in_FILE, delim_check, skip, Column_index, scanner):
+        if key in group_bytes:
+            group_bytes[key] += len(line)
+            group_lines[key] += 1
         else:
-            raise ValueError("Line "+str(i)+" was empty in col of interest.")
+            group_bytes[key] = len(line)
+            group_lines[key] = 1
         i+=1
-lines_not_skipped = i-skip
-
-# Want to grep 10 groups at a time from the file.
-ten = list()
-n_groups = len(groups)
-i = 0
-for group in groups:
-    ten.insert(0,group) 
-    i+=1
-    # At every 10th group added to the list (or if end of groups reached):
-    if len(ten) == 10 or i == n_groups:
-        # Join each element with a comma
-        joined=",".join(ten)
+        n_bytes += len(line)
+        if progress is not None and i & 8191 == 0:
+            progress.update(i, n_bytes, len(group_bytes))
+    return group_bytes, group_lines
+
+def print_batch_plan(plan, group_bytes, Show=20):
+    """ Print how many jobs there'll be, how much work each has, and the Show biggest jobs.
+    """
+    MB = 1024.0*1024.0
+    works = [work for work, batch in plan]
+    print "=============="
+    print "Planned "+str(len(plan))+" bsub jobs for "+str(len(group_bytes))+" groups."
+    if len(plan) == 0:
+        return
+    print ("Estimated work per job (MB read + written): min "+str(round(works[-1]/MB, 1))
+        +", median "+str(round(works[len(works)//2]/MB, 1))+", max "+str(round(works[0]/MB, 1)))
+    print "job	groups	work_MB	lines_MB	biggest_group"
+    for k in range(min(Show, len(plan))):
+        work, batch = plan[k]
+        print (str(k)+"	"+str(len(batch))+"	"+str(round(work/MB, 1))+"	"
+            +str(round(sum(group_bytes[g] for g in batch)/MB, 1))+"	"+batch[0])
+    if len(plan) > Show:
+        print "... ("+str(len(plan)-Show)+" more jobs)"
+
+def submit_batches(plan, in_FILE, out_DIR, delim, Column_index, folderize, manifest_DIR):
+    """ Submit one bsub job per batch of groups in the plan (from plan_batches), to the
+        default job executor (LSF, or this machine if there's no bsub; see job_executors.py).
+
+        Batch k's groups are listed in manifest_DIR/batch_k.groups, and it writes its
+            manifest to manifest_DIR/batch_k.json when it is done.
+
+        Returns: (list of batches (each a list of groups), list of their jobs' JobHandles)
+    """
+    executor = job_executors.default_executor()
+    batches = list()
+    jobs = list()
+    for work, batch in plan:
+        groups_file = os.path.join(manifest_DIR, "batch_"+str(len(batches))+".groups")
+        manifest = os.path.join(manifest_DIR, "batch_"+str(len(batches))+".json")
+        with open(groups_file, 'wb') as handle:
+            for group in batch:
+                handle.write(group+"\n")
+        batches.append(batch)
         # Generate the sys command
-        command = in_FILE+" "+joined+" "+out_DIR+" "+delim+" "+str(Column_index)+" "+folderize
-        # Submit a system command, without waiting. Save error files just in case.
-        proc = Popen(["bsub -e cowabunga.err -o cowabunga.out python cowabunga.py "+command],shell=True,
-            stdin=None, stdout=None, stderr=None, close_fds=True)
-        if i != n_groups:
-            ten = list()
-        continue
-
-# Wait for all groups to be written to file
-group_check = list(groups)
-while len(group_check) > 0:
-    # look through each file in out_DIR
-    for f in os.listdir(out_DIR):
-        # if file name is a group and the file size is > 0:
-        if f in group_check and os.stat(os.path.join(out_DIR,f)).st_size > 0:
-            group_check.remove(f)
-    # Give the program a break: these are files my cowabunga minion script
-    #  are trying to write to.
-    time.sleep(5)
-
-print "=============="
-print "Processed "+str(lines_not_skipped)+" lines into "+str(len(groups))+" groups from file:\n"+in_FILE
-print "Groups were written to directory:\n"+out_DIR
-print "=============="
-print "cowabunga.err looks like:"
-with open("cowabunga.err") as handle:
-    for line in handle:
-        print line.rstrip("\n\r")
-print "=============="
-print "cowabunga.out looks like:"
-with open("cowabunga.out") as handle:
-    for line in handle:
-        print line.rstrip("\n\r")
+        command = in_FILE+" "+groups_file+" "+out_DIR+" "+delim+" "+str(Column_index)+" "+folderize+" "+manifest
+        # Submit it, without waiting for it. Save error files just in case.
+        jobs.extend(executor.submit("bsub -e cowabunga.err -o cowabunga.out python cowabunga.py "+command))
+    return batches, jobs
+
+def wait_for_batches(batches, jobs, manifest_DIR, Interval=5, Timeout=None, Progress_secs=None):
+    """ Wait for every batch to write its manifest.
+
+        Arguments:
+            batches, jobs: from submit_batches
+            manifest_DIR: where the batches write their manifests
+            Interval: seconds to wait between checks, to start with. Checks get further apart
+                (up to 2 minutes) while no batch is finishing.
+            Timeout: Optional. Give up on batches that haven't reported after this many seconds.
+            Progress_secs: Optional. Print how many batches are done this often.
+
+        The jobs are checked on all at once (one bjobs call) along with the manifests, so
+            batches whose job died without writing its manifest are given up on right away.
+
+        Returns: (dict of batch number -> manifest for batches that failed,
+            list of batch numbers that never reported)
+    """
+    pending = set(range(len(batches)))
+    failed = dict()
+    missing = list()
+    tracker = job_executors.JobTracker(jobs, Interval=Interval)
+    start = time.time()
+    last_progress = start
+    while len(pending) > 0:
+        # Check on the jobs before the manifests: a finished job has written its manifest
+        tracker.poll()
+        n_pending = len(pending)
+        # Only finished manifests are ever named batch_k.json (they're renamed into place)
+        for f in os.listdir(manifest_DIR):
+            if not (f.startswith("batch_") and f.endswith(".json")):
+                continue
+            k = int(f[len("batch_"):-len(".json")])
+            if k not in pending:
+                continue
+            pending.remove(k)
+            with open(os.path.join(manifest_DIR, f)) as handle:
+                report = json.load(handle)
+            if report["status"] != "ok":
+                failed[k] = report
+        for k in sorted(pending):
+            if jobs[k].done():
+                pending.remove(k)
+                missing.append(k)
+        if len(pending) == 0:
+            break
+        if Timeout is not None and time.time()-start > Timeout:
+            break
+        if Progress_secs is not None and time.time()-last_progress >= Progress_secs:
+            last_progress = time.time()
+            n_done = len(batches)-len(pending)
+            record = ("waiting: "+str(n_done)+" of "+str(len(batches))+" batches done ("
+                +str(len(failed)+len(missing))+" failed), "
+                +partition_functions.format_seconds(last_progress-start)+" so far")
+            if n_done > 0:
+                record += (", about "+partition_functions.format_seconds(
+                    len(pending)*(last_progress-start)/n_done)+" left")
+            print record
+            sys.stdout.flush()
+        # Give the program a break: my cowabunga minion scripts are working on it.
+        time.sleep(tracker.next_wait(n_pending-len(pending)))
+    return failed, sorted(missing+list(pending))
+
+def report_failed_batches(batches, jobs, failed, missing):
+    """ Print which batches failed or never reported, and which groups they were writing.
+    """
+    print "=============="
+    for k in sorted(failed):
+        report = failed[k]
+        print "Batch "+str(k)+" failed. Unfinished groups: "+",".join(
+            [g for g in report["groups"] if g not in report["done"]])
+        print report["error"].rstrip("\n\r")
+    for k in missing:
+        print "Batch "+str(k)+" never reported back. Groups: "+",".join(batches[k])
+        print jobs[k].describe()
+
+def write_stats(stats_FILE, stats, group_lines):
+    """ Write the run's stats (a dict) to stats_FILE as JSON, with the lines and bytes of
+        each group (biggest first) under "groups".
+    """
+    group_bytes = stats.pop("group_bytes", dict())
+    stats["groups"] = [{"group": g, "lines": group_lines[g], "bytes": group_bytes.get(g)}
+        for g in sorted(group_lines, key=lambda g: (-group_lines[g], g))]
+    with open(stats_FILE+".tmp", 'wb') as handle:
+        json.dump(stats, handle, indent=1, sort_keys=True)
+    os.rename(stats_FILE+".tmp", stats_FILE)
+
+def print_cowabunga_logs():
+    print "=============="
+    print "cowabunga.err looks like:"
+    with open("cowabunga.err") as handle:
+        for line in handle:
+            print line.rstrip("\n\r")
+    print "=============="
+    print "cowabunga.out looks like:"
+    with open("cowabunga.out") as handle:
+        for line in handle:
+            print line.rstrip("\n\r")
+
+def remove_cowabunga():
+    """ Remove sub-routine, the manifests, and the error / out files
+    """
+    shutil.rmtree(os.path.abspath(MANIFEST_DIR))
+    os.remove("cowabunga.py")
+    os.remove("cowabunga.err")
+    os.remove("cowabunga.out")
+
+
+if __name__ == "__main__":
+    print "Initiating col_grep.py"
+    print "Argument List:", str(sys.argv[1:])
+
+    args = parse_arguments(sys.argv[1:])
+    in_FILE = args.in_FILE
+    delim = args.delim
+    skip = args.skip
+    Column_index = args.Column_index
+    out_DIR = args.out_DIR
+    folderize = args.folderize
+
+    if not (os.path.isfile(in_FILE)):
+        raise ValueError(in_FILE+" not found. Is it a *full* and valid file path?")
+
+    # If tab-delimited, need to make sure it will be python-interpretable:
+    if delim != "," and delim != "tab":
+        raise ValueError("This script was only tested with ',' or 'tab', not '"+delim+"'")
         
-# Remove sub-routine and the error / out files
-os.remove("cowabunga.py")
-os.remove("cowabunga.err")
-os.remove("cowabunga.out")
\ No newline at end of file
+    if skip < 0:
+        raise ValueError("Skip needs to be integer >= 0")
+
+    if Column_index < 0:
+        raise ValueError("Column_index needs to be integer >= 0")
+
+    if args.workers < 1:
+        raise ValueError("--workers needs to be integer >= 1")
+
+    if args.buckets is not None and args.buckets < 1:
+        raise ValueError("--buckets needs to be integer >= 1")
+
+    if args.progress_secs < 0:
+        raise ValueError("--progress_secs needs to be >= 0")
+
+    if args.buffer_mb is not None and args.buffer_mb <= 0:
+        raise ValueError("--buffer_mb needs to be > 0")
+
+    if args.incremental:
+        if args.groups is not None:
+            raise ValueError("--incremental and --groups don't go together")
+        if args.checkpoint_mb < 1:
+            raise ValueError("--checkpoint_mb needs to be integer >= 1")
+        if helper_functions.compression_of(in_FILE) is not None:
+            raise ValueError("--incremental only works on plain text (not compressed) in_FILEs")
+
+    if args.prescan:
+        if not 0 < args.sample <= 1:
+            raise ValueError("--sample needs to be > 0 and <= 1")
+    elif args.sample != 1.0:
+        raise ValueError("--sample only works with --prescan")
+
+    if args.aggregate:
+        if args.groups is not None or args.incremental:
+            raise ValueError("--aggregate doesn't go with --groups or --incremental")
+        if args.buckets is not None or args.compress is not None:
+            raise ValueError("--aggregate writes no group files, so --buckets and --compress don't apply")
+        if args.max_groups < 1:
+            raise ValueError("--max_groups needs to be integer >= 1")
+        try:
+            value_columns = [int(c) for c in args.value_columns.split(",") if len(c.strip()) > 0]
+        except ValueError:
+            raise ValueError("--value_columns needs to be comma separated integers, not: "+args.value_columns)
+        if Column_index in value_columns:
+            raise ValueError("--value_columns can't include Column_index")
+    elif len(args.value_columns) > 0:
+        raise ValueError("--value_columns only works with --aggregate")
+
+    if args.groups is not None:
+        if args.buckets is not None:
+            raise ValueError("--groups and --buckets don't go together")
+        if helper_functions.compression_of(in_FILE) is not None:
+            raise ValueError("--groups only works on plain text (not compressed) in_FILEs")
+        # (each group once, in the order given)
+        groups = []
+        for group in args.groups.split(","):
+            if group not in groups:
+                groups.append(group)
+
+    if args.groups is None and not args.incremental and not args.aggregate and args.engine == "bsub":
+        if args.compress is not None:
+            raise ValueError("--compress only works with --engine stream or local")
+        if args.buckets is not None:
+            raise ValueError("--buckets only works with --engine stream or local")
+        if args.buffer_mb is not None:
+            raise ValueError("--buffer_mb only works with --engine stream or local")
+        if args.target_mb is not None and args.target_mb <= 0:
+            raise ValueError("--target_mb needs to be > 0")
+        if args.max_jobs < 1:
+            raise ValueError("--max_jobs needs to be integer >= 1")
+        if helper_functions.compression_of(in_FILE) == "zst":
+            raise ValueError("--engine bsub can't grep zstd files. Use --engine stream or local")
+
+    if not (os.path.isdir(out_DIR)):
+        raise ValueError(out_DIR+" not found. Is it a valid + extant directory?")
+
+    if len(os.listdir(out_DIR)) > 0 and not args.incremental:
+        raise ValueError(out_DIR+" already contains files. Please choose another dir or empty it.")
+
+    if folderize != "y_fold" and folderize != "n_fold":
+        raise ValueError("folderize needs to be 'y_fold' or 'n_fold', not: "+folderize)
+
+    # Convert delim to '\t' if it is tab
+    if delim == "tab":
+        delim_check = '\t'
+    # Else delim is kept the same ',' in this case
+    else:
+        delim_check = delim
+
+    if args.prescan:
+        scan = key_sketch.prescan(in_FILE, delim_check, skip, Column_index, Sample=args.sample)
+        key_sketch.print_prescan(scan, key_sketch.recommend(scan, args.max_open))
+        print "Nothing was written (--prescan). Run again without it to partition in_FILE."
+        sys.exit(0)
+
+    if args.buffer_mb is None:
+        buffer_bytes = None
+    else:
+        buffer_bytes = int(args.buffer_mb*1024*1024)
+    if args.progress_secs == 0:
+        progress_secs = None
+    else:
+        progress_secs = args.progress_secs
+    output_stats = dict()
+    # phase -> seconds
+    phases = dict()
+
+    start_time = time.time()
+    if args.aggregate:
+        lines_not_skipped, n_groups = aggregate_functions.aggregate(in_FILE, delim_check, skip,
+            Column_index, value_columns, os.path.join(out_DIR, aggregate_functions.SUMMARY_FILE),
+            Max_groups=args.max_groups, Stats=output_stats, Progress_secs=progress_secs)
+        phases["aggregating"] = time.time()-start_time
+        # (the per group counts are in the summary table, which may be huge)
+        group_counts = dict()
+    elif args.groups is not None:
+        group_counts = column_index.extract_groups(in_FILE, delim_check, skip, Column_index,
+            groups, out_DIR, folderize, Compress=args.compress, Stats=output_stats)
+        phases["extracting"] = time.time()-start_time
+        lines_not_skipped = sum(group_counts.itervalues())
+        n_groups = len([g for g in group_counts if group_counts[g] > 0])
+    elif args.incremental:
+        lines_not_skipped, group_counts = partition_functions.incremental_partition(
+            in_FILE, delim_check, skip, Column_index, out_DIR, folderize, Max_open=args.max_open,
+            Compress=args.compress, Buckets=args.buckets, Scanner=args.scanner,
+            Checkpoint_bytes=args.checkpoint_mb*1024*1024, Buffer_bytes=buffer_bytes,
+            Stats=output_stats, Progress_secs=progress_secs)
+        phases["partitioning"] = time.time()-start_time
+        n_groups = len(group_counts)
+    elif args.engine == "stream":
+        lines_not_skipped, group_counts = partition_functions.stream_partition(
+            in_FILE, delim_check, skip, Column_index, out_DIR, folderize, Max_open=args.max_open,
+            Compress=args.compress, Buckets=args.buckets, Scanner=args.scanner,
+            Buffer_bytes=buffer_bytes, Stats=output_stats, Progress_secs=progress_secs)
+        phases["partitioning"] = time.time()-start_time
+        n_groups = len(group_counts)
+    elif args.engine == "local":
+        lines_not_skipped, group_counts = partition_functions.parallel_partition(
+            in_FILE, delim_check, skip, Column_index, out_DIR, folderize, args.workers,
+            Max_open=args.max_open, Compress=args.compress, Buckets=args.buckets,
+            Scanner=args.scanner, Buffer_bytes=buffer_bytes, Stats=output_stats,
+            Progress_secs=progress_secs)
+        # (partitioning and merging, if it came to that)
+        phases.update(output_stats.pop("phase_seconds", {"partitioning": time.time()-start_time}))
+        n_groups = len(group_counts)
+    else:
+        manifest_DIR = write_cowabunga()
+        if progress_secs is None:
+            progress = None
+        else:
+            progress = partition_functions.Progress(None, progress_secs, "discovery")
+        group_bytes, group_counts = discover_groups(in_FILE, delim_check, skip, Column_index,
+            args.scanner, progress)
+        output_stats["group_bytes"] = group_bytes
+        lines_not_skipped = sum(group_counts.itervalues())
+        n_groups = len(group_bytes)
+        phases["discovery"] = time.time()-start_time
+        scan_bytes = os.path.getsize(in_FILE)
+        if args.target_mb is None:
+            # About the work of the old 10 groups per job
+            target_bytes = 10*scan_bytes
+        else:
+            target_bytes = args.target_mb*1024*1024
+        plan = partition_functions.plan_batches(group_bytes, scan_bytes, target_bytes, args.max_jobs)
+        print_batch_plan(plan, group_bytes)
+        phase_start = time.time()
+        batches, jobs = submit_batches(plan, in_FILE, out_DIR, delim, Column_index, folderize, manifest_DIR)
+        phases["submitting"] = time.time()-phase_start
+        phase_start = time.time()
+        failed, missing = wait_for_batches(batches, jobs, manifest_DIR, Timeout=args.timeout,
+            Progress_secs=progress_secs)
+        phases["waiting"] = time.time()-phase_start
+
+    elapsed = max(time.time()-start_time, 1e-9)
+
+    print "=============="
+    print "Processed "+str(lines_not_skipped)+" lines into "+str(n_groups)+" groups from file:\n"+in_FILE
+    print "in "+str(round(elapsed, 1))+" seconds ("+str(int(lines_not_skipped/elapsed))+" lines/sec)"
+    if args.buckets is not None:
+        print "Groups were hashed into "+str(args.buckets)+" buckets (see "+partition_functions.BUCKET_INDEX+")"
+    if "flushes" in output_stats:
+        print ("Buffered output: "+str(output_stats["flushes"])+" writes of "
+            +str(output_stats["bytes_flushed"]//max(output_stats["flushes"], 1))+" bytes on average (biggest "
+            +str(output_stats["max_flush"])+"), buffer filled up "+str(output_stats["cap_hits"])
+            +" times, "+str(output_stats["opens"])+" file opens")
+    if args.aggregate:
+        if output_stats.get("spills", 0) > 0:
+            print ("More than "+str(args.max_groups)+" groups, so totals were spilled to disk "
+                +str(output_stats["spills"])+" times")
+        print "Summary of each group was written to:\n"+os.path.join(out_DIR, aggregate_functions.SUMMARY_FILE)
+    else:
+        print "Groups were written to directory:\n"+out_DIR
+    output_stats.update({"in_FILE": os.path.abspath(in_FILE), "out_DIR": os.path.abspath(out_DIR),
+        "argv": sys.argv[1:], "lines": lines_not_skipped, "n_groups": n_groups,
+        "seconds": elapsed, "lines_per_sec": lines_not_skipped/elapsed, "phase_seconds": phases})
+    write_stats(args.stats_file, output_stats, group_counts)
+    print "Stats were written to:\n"+args.stats_file
+    if args.groups is None and not args.incremental and not args.aggregate and args.engine == "bsub":
+        print_cowabunga_logs()
+        if len(failed) > 0 or len(missing) > 0:
+            report_failed_batches(batches, jobs, failed, missing)
+            raise Exception(str(len(failed))+" batches failed and "+str(len(missing))
+                +" never reported. Left cowabunga.py, its logs, and "+MANIFEST_DIR+" for you to look at.")
+        remove_cowabunga()
@@ -19,6 +19,9 @@
 ###            integer (0 is first column)
 ###        out_DIR: where should files by written to?
 ###            Extant directory
+###        workers: Optional. Split the work over this many processes on this machine
+###            instead of submitting bsub jobs.
+###            integer >= 1
 ###
 ###    Assumptions:
 ###        The skipped lines aren't formatted like the rest of the file, and/or the col of interest
@@ -27,22 +30,27 @@
 ###        ***The col of interest doesn't have something unix/bash-interpretable in it***
 ###
 ###    Usage:
-###        python grep_col.py in_file.txt delim skip Column_# out_DIR
+###        python grep_col.py in_file.txt delim skip Column_# out_DIR [workers]
 
 import sys, os
 from subprocess import Popen
 import time
 
+import partition_functions
+
 print "Initiating folderize_by_column.py"
 print "Argument List:", str(sys.argv[1:])
 
-if (len(sys.argv)-1 != 5):
-    raise Exception("Expected 5 command arguments.")
+if (len(sys.argv)-1 != 5 and len(sys.argv)-1 != 6):
+    raise Exception("Expected 5 (or 6) command arguments.")
 in_FILE = str(sys.argv[1])
 delim = str(sys.argv[2])
 skip = int(sys.argv[3])
 Column_index = int(sys.argv[4])
 out_DIR = str(sys.argv[5])
+workers = None
+if len(sys.argv)-1 == 6:
+    workers = int(sys.argv[6])
 
 #pdb.set_trace()
 
@@ -62,6 +70,25 @@ if Column_index < 0:
 if not (os.path.isdir(out_DIR)):
     raise ValueError(out_DIR+" not found. Is it a valid + extant directory?")
 
+if workers is not None and workers < 1:
+    raise ValueError("workers needs to be integer >= 1")
+
+# Convert delim to '\t' if it is tab
+if delim == "tab":
+    delim_check = '\t'
+# Else delim is kept the same ',' in this case
+else:
+    delim_check = delim
+
+# Local mode: partition on this machine, no bsub jobs
+if workers is not None:
+    lines_not_skipped, group_counts = partition_functions.parallel_partition(
+        in_FILE, delim_check, skip, Column_index, out_DIR, "n_fold", workers)
+    print "=============="
+    print "Processed "+str(lines_not_skipped)+" lines into "+str(len(group_counts))+" groups from file:\n"+in_FILE
+    print "Groups were written to directory:\n"+out_DIR
+    sys.exit(0)
+
 # Sub-python routine
 if os.path.isfile("cowabunga.py"):
     print "FYI, we're overwriting something called 'cowabunga.py'"
@@ -79,13 +106,6 @@ with open("cowabunga.py", 'wb') as handle:
     handle.write("for f in files:\n")
     handle.write("\tout_FILE = os.path.join(out_DIR, f)\n")
     handle.write("\tout = call([\"grep $'\"+col_seps+\"\"+f+\"' \"+in_FILE+\" > \"+out_FILE],shell=True)")
-    
-# Convert delim to '\t' if it is tab
-if delim == "tab":
-    delim_check = '\t'
-# Else delim is kept the same ',' in this case
-else:
-    delim_check = delim
 
 # Get unique set of elements from column of interest
 # Yes, I could combine the step after this into this loop, too,
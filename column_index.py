@@ -0,0 +1,240 @@
+#/usr/bin/python
+
+# column_index.py
+# 2016_2_27
+
+### An index of where each value of a column is in a (plain text) file, so the lines of a few
+###    values can be pulled out with a handful of seeks instead of reading the whole file.
+###
+###    The index is saved next to the file (my_file.txt.col3.idx for column 3). It records the
+###    file's size and modification time, and is rebuilt by get_index() when either changes.
+###
+###    For each value, the index holds byte ranges of runs of consecutive lines with that value.
+###    Sorted (or grouped) files need one range per value, unsorted files up to one per line.
+
+import os
+import struct
+from array import array
+
+import helper_functions
+import partition_functions
+
+MAGIC = "COLIDX1\n"
+HEADER = struct.Struct("<QdQIH")
+KEY_ENTRY = struct.Struct("<HQQQ")
+# array typecode of an 8 byte unsigned integer (python 2 has no 'Q')
+OFFSET_TYPECODE = 'L'
+if array(OFFSET_TYPECODE).itemsize != 8:
+	raise ImportError("column_index.py needs 8 byte unsigned longs (64 bit python).")
+
+
+def index_path(In_file, Column_index):
+	"""Where the index of In_file's column Column_index lives: "In_file.col<Column_index>.idx"
+	"""
+	return In_file+".col"+str(Column_index)+".idx"
+
+class ColumnIndex(object):
+	""" A loaded column index. See build_index and get_index.
+
+		Attributes:
+			in_file, index_file, delim, skip, column_index
+			size, mtime: of in_file when the index was built
+			keys: dict of value -> (first run, number of runs, number of lines)
+	"""
+	def __init__(self, In_file, Index_file):
+		self.in_file = In_file
+		self.index_file = Index_file
+		with open(Index_file, 'rb') as handle:
+			if handle.read(len(MAGIC)) != MAGIC:
+				raise ValueError(Index_file+" isn't a column index.")
+			self.size, self.mtime, self.skip, self.column_index, delim_len = HEADER.unpack(
+				handle.read(HEADER.size))
+			self.delim = handle.read(delim_len)
+			n_keys, n_runs = struct.unpack("<QQ", handle.read(16))
+			self.keys = dict()
+			for k in xrange(n_keys):
+				key_len, first_run, key_runs, key_lines = KEY_ENTRY.unpack(handle.read(KEY_ENTRY.size))
+				self.keys[handle.read(key_len)] = (first_run, key_runs, key_lines)
+			self.runs_offset = handle.tell()
+
+	def is_current(self):
+		""" Is in_file the same size and age it was when the index was built?
+		"""
+		if not os.path.isfile(self.in_file):
+			return False
+		stat = os.stat(self.in_file)
+		return stat.st_size == self.size and stat.st_mtime == self.mtime
+
+	def runs(self, Key):
+		""" Return the (start byte, number of bytes) of each run of Key's lines, in file order.
+		"""
+		if Key not in self.keys:
+			return []
+		first_run, key_runs, key_lines = self.keys[Key]
+		offsets = array(OFFSET_TYPECODE)
+		with open(self.index_file, 'rb') as handle:
+			handle.seek(self.runs_offset+first_run*16)
+			offsets.fromstring(handle.read(key_runs*16))
+		return [(offsets[2*r], offsets[2*r+1]) for r in xrange(key_runs)]
+
+	def n_lines(self, Key):
+		if Key not in self.keys:
+			return 0
+		return self.keys[Key][2]
+
+	def n_bytes(self, Key):
+		return sum(length for start, length in self.runs(Key))
+
+	def read_chunks(self, Key, Chunk_size=1024*1024):
+		""" Yield Key's lines from in_file as chunks of text (each ends on a whole line,
+			except maybe the last line of the file).
+		"""
+		if not self.is_current():
+			raise ValueError(self.in_file+" changed since "+self.index_file+" was built.")
+		with open(self.in_file, 'rb') as handle:
+			for start, length in self.runs(Key):
+				handle.seek(start)
+				while length > 0:
+					chunk = handle.read(min(length, Chunk_size))
+					if len(chunk) == 0:
+						break
+					length -= len(chunk)
+					if length > 0:
+						# Finish the line, so every chunk holds whole lines
+						rest = handle.readline()
+						length -= len(rest)
+						chunk += rest
+					yield chunk
+
+	def lines(self, Key):
+		""" Yield Key's lines from in_file.
+		"""
+		for chunk in self.read_chunks(Key):
+			for line in chunk.splitlines(True):
+				yield line
+
+def build_index(In_file, Delim, Skip, Column_index, Index_file=None):
+	""" Read In_file once, and save an index of where the lines of each value of a column are.
+
+		Arguments:
+			In_file:		"/my_directory/my_file.txt" [plain text, not compressed]
+			Delim:			the actual delimiter character (e.g. '\\t', not 'tab')
+			Skip:			integer >= 0. How many lines at the top to skip?
+			Column_index:	integer >= 0. Which column to index? (0 is first column)
+			Index_file:		Optional. Where to save it. Defaults to index_path(In_file, Column_index)
+
+		Returns: the ColumnIndex
+	"""
+	if not os.path.isfile(In_file):
+		raise ValueError(In_file+" not found.")
+	if helper_functions.compression_of(In_file) is not None:
+		raise ValueError("Can only index plain text files, and "+In_file+" is compressed.")
+	if type(Skip) is not int or Skip < 0:
+		raise ValueError("Skip needs to be an integer >= 0.")
+	if type(Column_index) is not int or Column_index < 0:
+		raise ValueError("Column_index needs to be an integer >= 0.")
+	if Index_file is None:
+		Index_file = index_path(In_file, Column_index)
+
+	stat = os.stat(In_file)
+	# value -> array of (start, length) pairs of its runs of lines
+	key_runs = dict()
+	key_lines = dict()
+	pos = partition_functions.skip_offset(In_file, Skip)
+	i = Skip
+	with open(In_file, 'rb') as handle:
+		handle.seek(pos)
+		for line in handle:
+			key = partition_functions.get_key(line, Delim, Column_index, i)
+			runs = key_runs.get(key)
+			if runs is None:
+				key_runs[key] = array(OFFSET_TYPECODE, [pos, len(line)])
+				key_lines[key] = 1
+			else:
+				# Does this line carry on the key's last run?
+				if runs[-2]+runs[-1] == pos:
+					runs[-1] += len(line)
+				else:
+					runs.append(pos)
+					runs.append(len(line))
+				key_lines[key] += 1
+			pos += len(line)
+			i += 1
+
+	tmp_file = Index_file+".tmp"
+	with open(tmp_file, 'wb') as out:
+		out.write(MAGIC)
+		out.write(HEADER.pack(stat.st_size, stat.st_mtime, Skip, Column_index, len(Delim)))
+		out.write(Delim)
+		keys = sorted(key_runs)
+		out.write(struct.pack("<QQ", len(keys), sum(len(r)//2 for r in key_runs.itervalues())))
+		first_run = 0
+		for key in keys:
+			n_runs = len(key_runs[key])//2
+			out.write(KEY_ENTRY.pack(len(key), first_run, n_runs, key_lines[key]))
+			out.write(key)
+			first_run += n_runs
+		for key in keys:
+			key_runs[key].tofile(out)
+	# So nobody ever reads a half written index
+	os.rename(tmp_file, Index_file)
+	return ColumnIndex(In_file, Index_file)
+
+def get_index(In_file, Delim, Skip, Column_index, Index_file=None):
+	""" Load the index of In_file's column, (re)building it if it is missing, out of date,
+		or was built with a different Delim or Skip.
+
+		Arguments are the same as build_index.
+
+		Returns: the ColumnIndex
+	"""
+	if Index_file is None:
+		Index_file = index_path(In_file, Column_index)
+	if os.path.isfile(Index_file):
+		index = ColumnIndex(In_file, Index_file)
+		if (index.is_current() and index.delim == Delim and index.skip == Skip
+			and index.column_index == Column_index):
+			return index
+		print "FYI, "+Index_file+" is out of date. Rebuilding it."
+	return build_index(In_file, Delim, Skip, Column_index, Index_file)
+
+def extract_groups(In_file, Delim, Skip, Column_index, Groups, Out_dir, Folderize,
+	Compress=None, Stats=None):
+	""" Write the lines of just the given groups to their own files, using (and if needed
+		building) the index of In_file's column.
+
+		Arguments:
+			Groups:		list of values from the column of interest (repeats are ignored)
+			Out_dir, Folderize, Compress: as in partition_functions.stream_partition
+			Stats:		Optional dict. Gets the bytes of each group's lines ("group_bytes").
+			(the rest are the same as build_index)
+
+		Returns: dict of group -> number of lines (0 for groups that aren't in In_file,
+			which get no file)
+	"""
+	# (each group once, in the order given; a repeat would make its directory / file twice)
+	seen = set()
+	unique_groups = []
+	for group in Groups:
+		if group not in seen:
+			seen.add(group)
+			unique_groups.append(group)
+	index = get_index(In_file, Delim, Skip, Column_index)
+	group_counts = dict()
+	for group in unique_groups:
+		group_counts[group] = index.n_lines(group)
+		if Stats is not None:
+			Stats.setdefault("group_bytes", dict())[group] = index.n_bytes(group)
+		if group_counts[group] == 0:
+			print "FYI, "+group+" isn't in "+In_file
+			continue
+		if Folderize == "y_fold":
+			os.makedirs(os.path.join(Out_dir, group))
+		path = partition_functions.group_file_path(Out_dir, group, Folderize, Compress)
+		with helper_functions.open_file(path, 'wb', Compress) as out:
+			chunk = ""
+			for chunk in index.read_chunks(group):
+				out.write(chunk)
+			if chunk[-1:] != "\n":
+				out.write("\n")
+	return group_counts
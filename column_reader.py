@@ -0,0 +1,205 @@
+#/usr/bin/python
+
+# column_reader.py
+# 2016_3_21
+
+### Reading columns of delimited files (plain, gzip or zstd) into typed numpy arrays, a batch of
+###    lines at a time, so numeric work on them can be done on whole arrays instead of line
+###    by line in python.
+###
+###    Each batch is split with a single str.split over the whole batch (when every line has
+###    the same number of columns, which is the usual case), and converted to numbers by numpy,
+###    so there's no python loop per line. Memory is bounded by the batch size.
+###
+###    Needs numpy.
+
+import itertools
+
+import helper_functions
+
+# numpy is optional for the rest of the repo, but this needs it
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+# How a column can be read: 64 bit integers, 64 bit floats, or fixed width byte strings
+#  (as wide as the widest value in the batch)
+COLUMN_TYPES = ["int", "float", "bytes"]
+# Values of float columns that are read as nan
+NA_VALUES = ["", "NA", "NaN", "nan", "N/A", "."]
+
+
+def check_columns(Columns, Types):
+	""" Make sure Columns is a column index (integer >= 0, 0 is first column) or a non-empty
+		list of them, and Types is a type (see COLUMN_TYPES) or a list of one per column.
+
+		Returns: (list of columns, list of types)
+	"""
+	if type(Columns) is int:
+		Columns = [Columns]
+	if type(Columns) not in [list, tuple] or len(Columns) == 0:
+		raise ValueError("Columns needs to be a column index or a non-empty list of them.")
+	for column in Columns:
+		if type(column) is not int or column < 0:
+			raise ValueError("Columns need to be integers >= 0, not: "+str(column))
+	if Types is None:
+		Types = "bytes"
+	if type(Types) is str:
+		Types = [Types]*len(Columns)
+	if type(Types) not in [list, tuple] or len(Types) != len(Columns):
+		raise ValueError("Types needs to be a type, or a list of one per column.")
+	for kind in Types:
+		if kind not in COLUMN_TYPES:
+			raise ValueError("Types need to be one of "+str(COLUMN_TYPES)+", not: "+str(kind))
+	return list(Columns), list(Types)
+
+def split_batch(Lines, Delim, Columns, Width, First_line=1):
+	""" Split a batch of lines and pull out Columns.
+
+		Arguments:
+			Lines:		list of lines (with their line breaks)
+			Delim:		"\t"
+			Columns:	list of column indices
+			Width:		how many columns lines (usually) have
+			First_line:	line number of Lines[0] in the file, for errors
+
+		If every line has Width columns, the whole batch is split at once. Otherwise it's
+			split line by line: blank lines are skipped, and lines without all of Columns
+			are an error.
+
+		Returns: list of one list of values per column
+	"""
+	text = "".join(Lines)
+	if "\r" in text:
+		text = text.replace("\r\n", "\n")
+	if text.endswith("\n"):
+		text = text[:-1]
+	rows = text.split("\n")
+	# Only if every line has exactly Width columns (and none is blank) do the fields of the
+	#  whole batch line up, Width to a line. (The counts are done in C, not a python loop.)
+	if (len(rows) == len(Lines) and "" not in rows
+		and set(map(str.count, rows, itertools.repeat(Delim, len(rows)))) == set([Width-1])):
+		fields = Delim.join(rows).split(Delim)
+		return [fields[column::Width] for column in Columns]
+	needed = max(Columns)+1
+	values = [list() for column in Columns]
+	for i, line in enumerate(Lines):
+		line = line.rstrip("\r\n")
+		if len(line) == 0:
+			continue
+		fields = line.split(Delim)
+		if len(fields) < needed:
+			raise ValueError("Line "+str(First_line+i)+" has "+str(len(fields))+" columns, but column "
+				+str(needed-1)+" is wanted: "+line[:200])
+		for column_values, column in zip(values, Columns):
+			column_values.append(fields[column])
+	return values
+
+def to_array(Values, Kind, Column=None, First_line=None):
+	""" Make a list of strings into a numpy array of Kind ('int', 'float' or 'bytes').
+
+		Floats that are one of NA_VALUES become nan.
+	"""
+	if Kind == "bytes":
+		return numpy.array(Values, dtype=str)
+	if Kind == "int":
+		dtype = numpy.int64
+	else:
+		dtype = numpy.float64
+	try:
+		# (numpy parses each string in C, no python loop)
+		return numpy.fromiter(Values, dtype, len(Values))
+	except ValueError:
+		pass
+	if Kind == "float":
+		na_values = set(NA_VALUES)
+		try:
+			return numpy.fromiter(["nan" if value in na_values else value for value in Values],
+				dtype, len(Values))
+		except ValueError:
+			pass
+	# Find the culprit (the slow way, it's just for the error message)
+	for i, value in enumerate(Values):
+		try:
+			if Kind == "int":
+				int(value)
+			elif value not in NA_VALUES:
+				float(value)
+		except ValueError:
+			raise ValueError("Can't read "+repr(value)+" as "+Kind+" (column "+str(Column)
+				+", value "+str(i+1)+" of the batch starting at line "+str(First_line)+")")
+	raise ValueError("Can't read column "+str(Column)+" as "+Kind)
+
+def column_batches(Path, Delim, Skip, Columns, Types=None, Batch_lines=65536):
+	""" Read columns of a delimited file, a batch of lines at a time.
+
+		Arguments:
+			Path:			"/my_directory/my_file.txt[.gz|.zst]"
+			Delim:			"\t"
+			Skip:			integer >= 0. How many lines (header, ...) to skip.
+			Columns:		column index or list of them (0 is first column)
+			Types:			Optional. 'int', 'float' or 'bytes' for every column, or a list
+								of one per column. Defaults to 'bytes'.
+			Batch_lines:	integer > 0. Most lines per batch.
+
+		Yields: a list with an array per column (in the order of Columns), each with a
+			value per line of the batch
+
+		Example usage:
+			total = 0.0
+			for keys, values in column_batches("my_file.txt.gz", "\t", 1, [0, 3], ["bytes", "float"]):
+				total += numpy.nansum(values)
+	"""
+	if numpy is None:
+		raise ImportError("numpy isn't installed, and column_batches needs it.")
+	if type(Delim) is not str or len(Delim) == 0:
+		raise ValueError("Delim needs to be a non-empty string.")
+	if type(Skip) is not int or Skip < 0:
+		raise ValueError("Skip needs to be an integer >= 0.")
+	if type(Batch_lines) is not int or Batch_lines < 1:
+		raise ValueError("Batch_lines needs to be an integer > 0.")
+	Columns, Types = check_columns(Columns, Types)
+	handle = helper_functions.open_file(Path)
+	try:
+		for line in itertools.islice(handle, Skip):
+			pass
+		line_number = Skip+1
+		width = None
+		while True:
+			lines = list(itertools.islice(handle, Batch_lines))
+			if len(lines) == 0:
+				break
+			if width is None:
+				width = lines[0].rstrip("\r\n").count(Delim)+1
+			values = split_batch(lines, Delim, Columns, width, line_number)
+			yield [to_array(column_values, kind, column, line_number)
+				for column_values, kind, column in zip(values, Types, Columns)]
+			line_number += len(lines)
+	finally:
+		handle.close()
+
+def read_columns(Path, Delim, Skip, Columns, Types=None, Batch_lines=65536):
+	""" Read whole columns of a delimited file (see column_batches for the arguments).
+
+		Returns: a list with an array per column
+	"""
+	Columns, Types = check_columns(Columns, Types)
+	batches = list(column_batches(Path, Delim, Skip, Columns, Types, Batch_lines))
+	if len(batches) == 0:
+		return [to_array([], kind) for kind in Types]
+	return [numpy.concatenate([batch[k] for batch in batches]) for k in range(len(Columns))]
+
+
+if __name__ == "__main__":
+	# Checks of split_batch: lines of other widths (even ones that add up to the right number
+	#  of fields) and blank lines have to go the line by line way
+	assert split_batch(["a,1,x\n", "b,2,y\n"], ",", [0, 2], 3) == [["a", "b"], ["x", "y"]]
+	try:
+		split_batch(["a,1,x\n", "b,2\n", "c,3,y,z\n"], ",", [0, 1, 2], 3)
+		raise AssertionError("a line without column 2 wasn't caught")
+	except ValueError:
+		pass
+	assert split_batch(["a,1,x\n", "\n", "c,3,y,z,w\n"], ",", [1], 3) == [["1", "3"]]
+	assert split_batch(["a,1,x\n", "\n", "c,3,y,z,w\n"], ",", [0, 2], 3) == [["a", "c"], ["x", "y"]]
+	print "column_reader checks passed."
@@ -0,0 +1,305 @@
+#!/usr/bin/python
+
+### fake_lsf.py
+### 2016_3_19
+
+###    A stand-in for LSF's bsub and bjobs, for trying out job submission and tracking (and
+###        col_grep's --engine bsub) on a machine without LSF. Jobs run right away, in the
+###        background, on this machine.
+###
+###    bsub understands:
+###        -J name, or a job array: -J "name[1-10]" / "name[1-5,8,10-12]", with an optional
+###            limit on how many tasks run at once: "name[1-100]%10"
+###            Each task gets LSB_JOBID and LSB_JOBINDEX (0 if not an array) set, like in LSF.
+###        -e / -o log files (appended to), with %J (job ID) and %I (array index) filled in.
+###        -q queue (only printed). Other options are ignored.
+###
+###        The command is run with /bin/sh, like LSF does.
+###
+###    bjobs understands:
+###        job IDs, like 12 or 12[3] (default: every unfinished job, or every job with -a)
+###        -o "field field ... delimiter='|'" with the fields jobid, jobindex, stat, exit_code,
+###            job_name, queue and user. Otherwise prints LSF's usual table.
+###        -noheader. Other options are ignored.
+###        Unknown jobs get "Job <N> is not found" on stderr, like LSF. To see what a job LSF has
+###            forgotten looks like, delete its file from $FAKE_LSF_DIR.
+###
+###    Jobs are kept track of in $FAKE_LSF_DIR (default /tmp/fake_lsf_<user>), one JSON file
+###        per job, with each task's status (PEND, RUN, DONE or EXIT) and exit code.
+###
+###    Usage:
+###        Put fake bsub on the PATH:
+###            python fake_lsf.py install /tmp/fake_lsf_bin
+###            export PATH=/tmp/fake_lsf_bin:$PATH
+###        Then use bsub and bjobs as usual:
+###            bsub -J "test[1-4]%2" -o test_%I.out 'echo $LSB_JOBINDEX'
+###            bjobs -a
+
+import sys, os
+import fcntl
+import getpass
+import json
+import re
+import subprocess
+import time
+
+# bsub options that take a value (all others we might see are flags)
+VALUE_OPTIONS = ["-J", "-e", "-o", "-eo", "-oo", "-q", "-n", "-R", "-W", "-M", "-P", "-G",
+    "-u", "-w", "-m", "-g", "-sla", "-app", "-cwd", "-E", "-Ep"]
+
+def state_dir():
+    """ Where jobs are kept track of ($FAKE_LSF_DIR), made if needed.
+    """
+    path = os.environ.get("FAKE_LSF_DIR", "/tmp/fake_lsf_"+getpass.getuser())
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    return path
+
+def job_path(Job_id):
+    return os.path.join(state_dir(), "job_"+str(Job_id)+".json")
+
+def read_job(Job_id):
+    with open(job_path(Job_id)) as handle:
+        return json.load(handle)
+
+def write_job(Job):
+    """ Save a job's state (written to a temp file and renamed, so readers never see half of it).
+    """
+    path = job_path(Job["id"])
+    with open(path+".tmp", 'wb') as handle:
+        json.dump(Job, handle)
+    os.rename(path+".tmp", path)
+
+def next_job_id():
+    """ A new job ID (counting up from 1, across processes).
+    """
+    with open(os.path.join(state_dir(), "next_id"), 'a+') as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        handle.seek(0)
+        text = handle.read().strip()
+        if len(text) > 0:
+            job_id = int(text)
+        else:
+            job_id = 1
+        handle.seek(0)
+        handle.truncate()
+        handle.write(str(job_id+1))
+    return job_id
+
+def parse_array(Name):
+    """ "name[1-3,7]%2" -> ("name", [1, 2, 3, 7], 2). Not an array: ("name", [0], None)
+    """
+    match = re.match(r"^(.*)\[([0-9,\-:]+)\](?:%([0-9]+))?$", Name)
+    if match is None:
+        return Name, [0], None
+    indices = []
+    for part in match.group(2).split(","):
+        # (LSF also allows start-end:step)
+        step = 1
+        if ":" in part:
+            part, step = part.split(":")
+            step = int(step)
+        if "-" in part:
+            start, end = part.split("-")
+            indices.extend(range(int(start), int(end)+1, step))
+        else:
+            indices.append(int(part))
+    limit = None
+    if match.group(3) is not None:
+        limit = int(match.group(3))
+    return match.group(1), indices, limit
+
+def log_path(Template, Job_id, Index):
+    if Template is None:
+        return os.devnull
+    return Template.replace("%J", str(Job_id)).replace("%I", str(Index))
+
+def bsub(Argv):
+    """ Record a job (or job array), start running it in the background, and say so like bsub does.
+    """
+    options = dict()
+    i = 0
+    while i < len(Argv) and Argv[i].startswith("-"):
+        if Argv[i] in VALUE_OPTIONS:
+            options[Argv[i]] = Argv[i+1]
+            i += 2
+        else:
+            i += 1
+    command = " ".join(Argv[i:])
+    if len(command) == 0:
+        sys.stderr.write("fake bsub: no command given\n")
+        return 255
+    name, indices, limit = parse_array(options.get("-J", command.split(" ")[0]))
+    job_id = next_job_id()
+    job = {"id": job_id, "name": name, "command": command, "cwd": os.getcwd(),
+        "err": options.get("-e", options.get("-eo")), "out": options.get("-o", options.get("-oo")),
+        "queue": options.get("-q", "normal"), "limit": limit, "submitted": time.time(),
+        "tasks": dict((str(k), {"status": "PEND", "exit_code": None}) for k in indices)}
+    write_job(job)
+    devnull = open(os.devnull, 'r+b')
+    subprocess.Popen([sys.executable, os.path.abspath(__file__), "_run", str(job_id)],
+        stdin=devnull, stdout=devnull, stderr=devnull, close_fds=True, preexec_fn=os.setsid)
+    if "-q" in options:
+        print "Job <"+str(job_id)+"> is submitted to queue <"+options["-q"]+">."
+    else:
+        print "Job <"+str(job_id)+"> is submitted to default queue <normal>."
+    return 0
+
+# bjobs -o fields we know, and the header LSF prints for each
+BJOBS_FIELDS = {"jobid": "JOBID", "jobindex": "JOBINDEX", "stat": "STAT", "exit_code": "EXIT_CODE",
+    "job_name": "JOB_NAME", "queue": "QUEUE", "user": "USER"}
+
+def bjobs(Argv):
+    """ Print the state of jobs (or tasks of job arrays) like bjobs does.
+    """
+    show_all = False
+    header = True
+    fields = None
+    delimiter = " "
+    wanted = []
+    i = 0
+    while i < len(Argv):
+        if Argv[i] == "-o":
+            fields = []
+            for field in Argv[i+1].split():
+                if field.startswith("delimiter="):
+                    delimiter = field[len("delimiter="):].strip("'\"")
+                elif field in BJOBS_FIELDS:
+                    fields.append(field)
+                else:
+                    sys.stderr.write(field+": Illegal field name\n")
+                    return 255
+            i += 2
+            continue
+        if Argv[i] == "-a":
+            show_all = True
+        elif Argv[i] == "-noheader":
+            header = False
+        elif not Argv[i].startswith("-"):
+            wanted.append(Argv[i])
+        i += 1
+    # (job ID, index or None for all of its tasks)
+    if len(wanted) == 0:
+        targets = []
+        for f in os.listdir(state_dir()):
+            if f.startswith("job_") and f.endswith(".json"):
+                targets.append((int(f[len("job_"):-len(".json")]), None))
+        targets.sort()
+    else:
+        targets = []
+        for target in wanted:
+            match = re.match(r"^([0-9]+)(?:\[([0-9]+)\])?$", target)
+            if match is None:
+                sys.stderr.write(target+": Illegal job ID.\n")
+                return 255
+            index = match.group(2)
+            if index is not None:
+                index = int(index)
+            targets.append((int(match.group(1)), index))
+    rows = []
+    not_found = False
+    for job_id, index in targets:
+        try:
+            job = read_job(job_id)
+        except (IOError, ValueError):
+            sys.stderr.write("Job <"+str(job_id)+("" if index is None else "["+str(index)+"]")
+                +"> is not found\n")
+            not_found = True
+            continue
+        indices = sorted(int(k) for k in job["tasks"])
+        if index is not None:
+            if index not in indices:
+                sys.stderr.write("Job <"+str(job_id)+"["+str(index)+"]> is not found\n")
+                not_found = True
+                continue
+            indices = [index]
+        for k in indices:
+            task = job["tasks"][str(k)]
+            if len(wanted) == 0 and not show_all and task["status"] in ["DONE", "EXIT"]:
+                continue
+            name = job["name"]
+            if k != 0:
+                name += "["+str(k)+"]"
+            exit_code = "-"
+            if task["status"] == "EXIT":
+                exit_code = str(task["exit_code"])
+            rows.append({"jobid": str(job_id), "jobindex": str(k), "stat": task["status"],
+                "exit_code": exit_code, "job_name": name, "queue": job.get("queue", "normal"),
+                "user": getpass.getuser()})
+    if fields is None:
+        if header and len(rows) > 0:
+            print "JOBID   USER    STAT  QUEUE      FROM_HOST   EXEC_HOST   JOB_NAME   SUBMIT_TIME"
+        for row in rows:
+            print (row["jobid"].ljust(8)+row["user"].ljust(8)+row["stat"].ljust(6)+row["queue"].ljust(11)
+                +"localhost".ljust(12)+"localhost".ljust(12)+row["job_name"].ljust(11)+"-")
+    else:
+        if header:
+            print delimiter.join(BJOBS_FIELDS[field] for field in fields)
+        for row in rows:
+            print delimiter.join(row[field] for field in fields)
+    if len(wanted) == 0 and len(rows) == 0:
+        sys.stderr.write("No unfinished job found\n")
+    if not_found:
+        return 255
+    return 0
+
+def run_job(Job_id):
+    """ Run a job's tasks (at most its limit at once), keeping its state file up to date.
+    """
+    job = read_job(Job_id)
+    pending = sorted(int(k) for k in job["tasks"])
+    running = dict()
+    limit = job["limit"] or len(pending)
+    while len(pending) > 0 or len(running) > 0:
+        while len(pending) > 0 and len(running) < limit:
+            index = pending.pop(0)
+            env = dict(os.environ)
+            env["LSB_JOBID"] = str(Job_id)
+            env["LSB_JOBINDEX"] = str(index)
+            with open(log_path(job["out"], Job_id, index), 'ab') as out:
+                with open(log_path(job["err"], Job_id, index), 'ab') as err:
+                    running[index] = subprocess.Popen(["/bin/sh", "-c", job["command"]],
+                        cwd=job["cwd"], env=env, stdout=out, stderr=err, close_fds=True)
+            job["tasks"][str(index)]["status"] = "RUN"
+            write_job(job)
+        time.sleep(0.05)
+        for index, process in running.items():
+            code = process.poll()
+            if code is None:
+                continue
+            del running[index]
+            task = job["tasks"][str(index)]
+            task["exit_code"] = code
+            if code == 0:
+                task["status"] = "DONE"
+            else:
+                task["status"] = "EXIT"
+            write_job(job)
+
+def install(Bin_dir):
+    """ Write a bsub and a bjobs that run this script into Bin_dir.
+    """
+    if not os.path.isdir(Bin_dir):
+        os.makedirs(Bin_dir)
+    for command in ["bsub", "bjobs"]:
+        path = os.path.join(Bin_dir, command)
+        with open(path, 'wb') as handle:
+            handle.write("#!/bin/sh\nexec "+sys.executable+" "+os.path.abspath(__file__)
+                +" "+command+" \"$@\"\n")
+        os.chmod(path, 0755)
+    print "Fake LSF commands are in "+Bin_dir+". Put it first on your PATH."
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        raise ValueError("Usage: python fake_lsf.py install BIN_DIR (or: bsub ... / bjobs ...)")
+    if sys.argv[1] == "install":
+        install(sys.argv[2])
+    elif sys.argv[1] == "bsub":
+        sys.exit(bsub(sys.argv[2:]))
+    elif sys.argv[1] == "bjobs":
+        sys.exit(bjobs(sys.argv[2:]))
+    elif sys.argv[1] == "_run":
+        run_job(int(sys.argv[2]))
+    else:
+        raise ValueError("Unknown command: "+sys.argv[1])
@@ -0,0 +1,340 @@
+#/usr/bin/python
+
+# file_search.py
+# 2016_3_12
+
+### Finding files by name in big directory trees (see helper_functions.grep_for_files).
+###
+###    Directories are listed by a pool of threads (with scandir, when there is one), a level
+###    of the tree at a time.
+###
+###    A FileIndex keeps each directory's listing on disk, along with the directory's
+###    modification time. A directory's mtime changes whenever a file or subdirectory is added
+###    to, removed from or renamed in it, so refreshing the index only lists the directories
+###    that changed (and stats the rest), and searching it doesn't touch the tree at all.
+
+import os
+import re
+import stat
+import time
+import fnmatch
+import cPickle
+from multiprocessing.pool import ThreadPool
+
+# os.scandir is python 3.5+. The scandir package backports it, otherwise use listdir + stat.
+try:
+	from os import scandir
+except ImportError:
+	try:
+		from scandir import scandir
+	except ImportError:
+		scandir = None
+
+STYLES = ["substring", "glob", "regex"]
+# Directories changed this recently get listed again on the next refresh, in case they
+#  change again within the resolution of their mtime.
+MTIME_SLACK = 2.0
+
+
+def list_dir(Dir):
+	""" List a directory.
+
+		Like os.walk: symlinks to directories count as directories (and aren't followed),
+			and anything that can't be listed counts as empty.
+
+		Returns: (its mtime, or None if it should be listed again next time,
+			tuple of file names, tuple of subdirectory names that can be gone into)
+	"""
+	files = []
+	subdirs = []
+	try:
+		mtime = os.stat(Dir).st_mtime
+		if scandir is not None:
+			for entry in scandir(Dir):
+				if entry.is_dir():
+					if not entry.is_symlink():
+						subdirs.append(entry.name)
+				else:
+					files.append(entry.name)
+		else:
+			for name in os.listdir(Dir):
+				path = os.path.join(Dir, name)
+				mode = os.lstat(path).st_mode
+				if stat.S_ISDIR(mode):
+					subdirs.append(name)
+				elif not stat.S_ISLNK(mode) or not os.path.isdir(path):
+					files.append(name)
+	except OSError:
+		return None, (), ()
+	if time.time()-mtime < MTIME_SLACK:
+		mtime = None
+	return mtime, tuple(files), tuple(subdirs)
+
+def _dir_mtime(Dir):
+	""" mtime of Dir, or None if it's gone.
+	"""
+	try:
+		return os.stat(Dir).st_mtime
+	except OSError:
+		return None
+
+def scan_tree(Root, Workers=8, Listings=None):
+	""" List every directory under Root, Workers directories at a time.
+
+		Arguments:
+			Root:		"/my_directory"
+			Workers:	integer > 0. Number of threads.
+			Listings:	Optional dict of an earlier scan. Directories whose mtime hasn't
+						changed since it are only stat'ed, not listed again.
+
+		Returns: (dict of directory (relative to Root, "" for Root) -> list_dir(directory),
+			number of directories listed, number reused from Listings)
+	"""
+	if type(Workers) is not int or Workers < 1:
+		raise ValueError("Workers needs to be an integer > 0.")
+	if Listings is None:
+		Listings = dict()
+	listings = dict()
+	n_listed = 0
+	n_reused = 0
+	pool = ThreadPool(Workers)
+	try:
+		level = [""]
+		while len(level) > 0:
+			# Directories from the last scan: see which ones changed
+			old = [d for d in level if d in Listings and Listings[d][0] is not None]
+			if len(old) > 0:
+				mtimes = dict(zip(old, pool.map(_dir_mtime, [os.path.join(Root, d) for d in old])))
+			else:
+				mtimes = dict()
+			to_list = []
+			for d in level:
+				if d in mtimes and mtimes[d] == Listings[d][0]:
+					listings[d] = Listings[d]
+					n_reused += 1
+				else:
+					to_list.append(d)
+			for d, listing in zip(to_list, pool.map(list_dir, [os.path.join(Root, d) for d in to_list])):
+				listings[d] = listing
+				n_listed += 1
+			next_level = []
+			for d in level:
+				for subdir in listings[d][2]:
+					next_level.append(os.path.join(d, subdir))
+			level = next_level
+	finally:
+		pool.close()
+		pool.join()
+	return listings, n_listed, n_reused
+
+def name_matcher(Patterns, Lacks=(), Style="substring"):
+	""" Return a function of a file name that says if it matches.
+
+		Arguments:
+			Patterns:	a pattern, or list of patterns. A name has to match all of them.
+			Lacks:		a pattern, or list of patterns. A name can't match any of them.
+			Style:		how patterns match a name:
+						'substring': the pattern is in the name
+						'glob': shell style, like '*.txt' or 'sample_??.gz' (see fnmatch)
+						'regex': re.search finds the pattern in the name
+	"""
+	if Style not in STYLES:
+		raise ValueError("Style needs to be 'substring', 'glob', or 'regex', not: "+str(Style))
+	if isinstance(Patterns, str):
+		Patterns = [Patterns]
+	if isinstance(Lacks, str):
+		Lacks = [Lacks]
+	# (an empty Lacks means nothing, like it always has for grep_for_files)
+	Lacks = [lack for lack in Lacks if len(lack) > 0]
+	if Style == "substring":
+		def matches(Name, Pattern):
+			return Pattern in Name
+		include = list(Patterns)
+		exclude = Lacks
+	else:
+		if Style == "glob":
+			include = [re.compile(fnmatch.translate(p)) for p in Patterns]
+			exclude = [re.compile(fnmatch.translate(p)) for p in Lacks]
+		else:
+			include = [re.compile(p) for p in Patterns]
+			exclude = [re.compile(p) for p in Lacks]
+		def matches(Name, Pattern):
+			return Pattern.search(Name) is not None
+	def matcher(Name):
+		for pattern in include:
+			if not matches(Name, pattern):
+				return False
+		for pattern in exclude:
+			if matches(Name, pattern):
+				return False
+		return True
+	return matcher
+
+def walk_listings(Root, Listings):
+	""" Yield (directory, tuple of file names) for every directory in Listings (from
+		scan_tree), in the order os.walk would, with directory paths starting with Root.
+	"""
+	if "" not in Listings:
+		return
+	stack = [""]
+	while len(stack) > 0:
+		d = stack.pop()
+		mtime, files, subdirs = Listings[d]
+		yield os.path.join(Root, d), files
+		for subdir in reversed(subdirs):
+			stack.append(os.path.join(d, subdir))
+
+def search_listings(Root, Listings, Patterns, Lacks=(), Style="substring"):
+	""" Return the full paths (starting with Root) of the files in Listings whose names
+		match (see name_matcher), in os.walk order.
+	"""
+	matcher = name_matcher(Patterns, Lacks, Style)
+	matched_files = []
+	for directory, files in walk_listings(Root, Listings):
+		for f in files:
+			if matcher(f):
+				matched_files.append(os.path.join(directory, f))
+	return matched_files
+
+class FileIndex(object):
+	""" The listing of every directory under Root, saved in Index_file.
+
+		Arguments:
+			Root:		"/my_directory"
+			Index_file:	Optional. Where to save the index (with save()).
+			Workers:	integer > 0. Number of threads to list directories with.
+
+		If Index_file exists and is of the same Root it's loaded, otherwise the index
+			starts empty. Either way, refresh() brings it up to date.
+
+		Index_file can be in Root's tree: it (and its temp files) are left out of the
+			listings, so saving it doesn't count as a change to its directory.
+	"""
+	def __init__(self, Root, Index_file=None, Workers=8):
+		self.root = os.path.abspath(Root)
+		self.index_file = Index_file
+		self.workers = Workers
+		self.listings = dict()
+		# When refresh() was last run (None if never)
+		self.refreshed = None
+		if Index_file is not None and os.path.isfile(Index_file):
+			try:
+				with open(Index_file, 'rb') as handle:
+					saved = cPickle.load(handle)
+				if saved["root"] == self.root:
+					self.listings = saved["listings"]
+					self.refreshed = saved.get("refreshed")
+				else:
+					print "FYI, "+Index_file+" is an index of "+saved["root"]+", not "+self.root+". Rebuilding it."
+			except (EOFError, KeyError, cPickle.UnpicklingError):
+				print "FYI, "+Index_file+" is not a file index. Rebuilding it."
+
+	def refresh(self):
+		""" Re-list the directories that changed since the last refresh.
+
+			Returns: (number of directories listed, number that hadn't changed)
+		"""
+		refreshed = time.time()
+		listings, n_listed, n_reused = scan_tree(self.root, self.workers, self.listings)
+		own_dir = self._own_dir()
+		if own_dir in listings and listings[own_dir] is not self.listings.get(own_dir):
+			mtime, files, subdirs = listings[own_dir]
+			files = tuple(f for f in files if not self._is_own_file(f))
+			listings[own_dir] = (mtime, files, subdirs)
+			# (listed again just because the index was saved there)
+			old = self.listings.get(own_dir)
+			if old is not None and old[1:] == listings[own_dir][1:]:
+				n_listed -= 1
+				n_reused += 1
+		self.listings = listings
+		self.refreshed = refreshed
+		return n_listed, n_reused
+
+	def _own_dir(self):
+		""" Index_file's directory, relative to Root ("" for Root), or None if it isn't in
+			Root's tree.
+		"""
+		if self.index_file is None:
+			return None
+		own_dir = os.path.relpath(os.path.dirname(os.path.abspath(self.index_file)), self.root)
+		if own_dir == os.curdir:
+			return ""
+		if own_dir == os.pardir or own_dir.startswith(os.pardir+os.sep):
+			return None
+		return own_dir
+
+	def _is_own_file(self, Name):
+		""" Is Name Index_file, or one of its temp files (see save)?
+		"""
+		name = os.path.basename(self.index_file)
+		return Name == name or (Name.startswith(name+".") and Name.endswith(".tmp"))
+
+	def save(self):
+		""" Save the index to Index_file (written to a temp file and renamed).
+		"""
+		if self.index_file is None:
+			raise ValueError("This FileIndex has no Index_file to save to.")
+		tmp_file = self.index_file+"."+str(os.getpid())+".tmp"
+		with open(tmp_file, 'wb') as handle:
+			cPickle.dump({"root": self.root, "listings": self.listings, "refreshed": self.refreshed}, handle,
+				cPickle.HIGHEST_PROTOCOL)
+		os.rename(tmp_file, self.index_file)
+
+	def search(self, Patterns, Lacks=(), Style="substring"):
+		""" Return the full paths of the files whose names match (see name_matcher).
+		"""
+		return search_listings(self.root, self.listings, Patterns, Lacks, Style)
+
+def find_files(Dir, Patterns, Lacks=(), Style="substring", Index_file=None, Workers=8,
+	Refresh=True):
+	""" Search a directory (recursively) for files whose names match (see name_matcher).
+
+		Arguments:
+			Dir:		"/my_directory/"
+			Patterns, Lacks, Style: see name_matcher
+			Index_file:	Optional. Keep a FileIndex of Dir here, so the next search only lists
+						the directories that changed since this one.
+			Workers:	integer > 0. Number of threads to list directories with.
+			Refresh:	With an Index_file, check for changes first? True, False (then the
+						search doesn't touch Dir at all, but may be out of date), or a number
+						of seconds: only check if the index was last checked longer ago
+						than that.
+
+		Returns: list of the full paths of the files that matched, in os.walk order
+	"""
+	if Index_file is None:
+		listings, n_listed, n_reused = scan_tree(Dir, Workers)
+		return search_listings(Dir, listings, Patterns, Lacks, Style)
+	if type(Refresh) is not bool and (type(Refresh) not in [int, float] or Refresh < 0):
+		raise ValueError("Refresh needs to be True, False, or a number of seconds >= 0.")
+	index = _loaded_index(Dir, Index_file, Workers)
+	if type(Refresh) is bool:
+		stale = Refresh
+	else:
+		stale = index.refreshed is None or time.time()-index.refreshed > Refresh
+	if stale or "" not in index.listings:
+		index.refresh()
+		# (even if nothing changed, so when it was checked is known to the next search, in
+		#  this process or another one, for Refresh=<seconds>)
+		index.save()
+		_LOADED[os.path.abspath(Index_file)] = (index, os.stat(Index_file).st_mtime)
+	# (paths start with Dir as given, like os.walk's)
+	return search_listings(Dir, index.listings, Patterns, Lacks, Style)
+
+# abspath of Index_file -> (its FileIndex, the Index_file's mtime when it was loaded / saved)
+_LOADED = dict()
+
+def _loaded_index(Dir, Index_file, Workers):
+	""" The FileIndex in Index_file, kept in memory between calls (until Index_file changes),
+		so searching in a loop doesn't load it every time.
+	"""
+	path = os.path.abspath(Index_file)
+	if path in _LOADED and os.path.isfile(path):
+		index, mtime = _LOADED[path]
+		if mtime == os.stat(path).st_mtime and index.root == os.path.abspath(Dir):
+			index.workers = Workers
+			return index
+	index = FileIndex(Dir, Index_file, Workers)
+	if os.path.isfile(path):
+		_LOADED[path] = (index, os.stat(path).st_mtime)
+	return index
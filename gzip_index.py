@@ -0,0 +1,572 @@
+#/usr/bin/python
+
+# gzip_index.py
+# 2016_3_22
+
+### Random access into gzip (and BGZF) files, without decompressing everything before the
+###    part you want.
+###
+###    Reading the file once builds an index of checkpoints about every Spacing bytes (of
+###    decompressed data), saved next to the file (my_file.txt.gz.gzidx). Any byte (or line)
+###    can then be read by decompressing from the checkpoint before it, so reading deep into a
+###    100 GB file costs about Spacing bytes of decompression instead of everything before it.
+###    It's the same trick as zlib's examples/zran.c:
+###        Inside a gzip member, a checkpoint is the end of a deflate block: where it is (to the
+###        bit) in the compressed file, and the 32 KB of data before it (which the next blocks
+###        can refer back to). Decompressing picks up from there.
+###        At the start of a gzip member (every BGZF block is one) nothing from before is needed,
+###        so a checkpoint is just where the member starts.
+###
+###    The index records the file's size and modification time, and get_gzip_index() rebuilds
+###    it when either changes. It also counts the lines before each checkpoint, to go straight
+###    to line N.
+###
+###    Python's zlib module can't stop at deflate blocks or start in the middle of a byte, so
+###    this calls the zlib library itself (with ctypes). available() says if it could be loaded.
+
+import os
+import bisect
+import cPickle
+import collections
+import ctypes
+import ctypes.util
+import zlib
+
+import helper_functions
+
+# Default decompressed bytes between checkpoints. Reading from anywhere costs up to this much
+#  decompression; the index takes up about 10 KB per checkpoint.
+SPACING = 16*1024*1024
+# How far back deflate can refer
+WINDOW_SIZE = 32768
+# Compressed bytes read at a time, and most decompressed bytes per inflate call
+READ_SIZE = 256*1024
+OUT_SIZE = 256*1024
+INDEX_VERSION = 1
+
+# zlib constants
+Z_OK = 0
+Z_STREAM_END = 1
+Z_NEED_DICT = 2
+Z_BUF_ERROR = -5
+Z_NO_FLUSH = 0
+Z_BLOCK = 5
+# windowBits for: a gzip (or zlib) header, raw deflate data
+GZIP_WBITS = 47
+RAW_WBITS = -15
+
+
+class _ZStream(ctypes.Structure):
+	""" zlib's z_stream.
+	"""
+	_fields_ = [("next_in", ctypes.c_void_p), ("avail_in", ctypes.c_uint),
+		("total_in", ctypes.c_ulong), ("next_out", ctypes.c_void_p),
+		("avail_out", ctypes.c_uint), ("total_out", ctypes.c_ulong), ("msg", ctypes.c_char_p),
+		("state", ctypes.c_void_p), ("zalloc", ctypes.c_void_p), ("zfree", ctypes.c_void_p),
+		("opaque", ctypes.c_void_p), ("data_type", ctypes.c_int), ("adler", ctypes.c_ulong),
+		("reserved", ctypes.c_ulong)]
+
+def _load_zlib():
+	""" The zlib library (ctypes.CDLL), or None if it can't be found.
+	"""
+	for name in [ctypes.util.find_library("z"), "libz.so.1", "libz.dylib"]:
+		if name is None:
+			continue
+		try:
+			library = ctypes.CDLL(name)
+		except OSError:
+			continue
+		stream = ctypes.POINTER(_ZStream)
+		library.zlibVersion.restype = ctypes.c_char_p
+		library.inflateInit2_.argtypes = [stream, ctypes.c_int, ctypes.c_char_p, ctypes.c_int]
+		library.inflate.argtypes = [stream, ctypes.c_int]
+		library.inflateEnd.argtypes = [stream]
+		library.inflatePrime.argtypes = [stream, ctypes.c_int, ctypes.c_int]
+		library.inflateSetDictionary.argtypes = [stream, ctypes.c_char_p, ctypes.c_uint]
+		return library
+	return None
+
+_ZLIB = _load_zlib()
+
+def available():
+	""" Can gzip files be indexed here (could the zlib library be loaded)?
+	"""
+	return _ZLIB is not None
+
+
+class _Inflater(object):
+	""" A zlib inflate stream, fed compressed data with feed() and run with inflate().
+	"""
+	def __init__(self, Window_bits, Bits=0, Bits_value=0, Dictionary=None):
+		if _ZLIB is None:
+			raise ImportError("Couldn't load the zlib library, so can't read gzip files at random.")
+		self.stream = _ZStream()
+		self.input = ""
+		self.out = ctypes.create_string_buffer(OUT_SIZE)
+		ret = _ZLIB.inflateInit2_(ctypes.byref(self.stream), Window_bits, _ZLIB.zlibVersion(),
+			ctypes.sizeof(_ZStream))
+		if ret != Z_OK:
+			raise ValueError("zlib inflateInit2 failed ("+str(ret)+")")
+		if Bits > 0:
+			_ZLIB.inflatePrime(ctypes.byref(self.stream), Bits, Bits_value)
+		if Dictionary is not None:
+			_ZLIB.inflateSetDictionary(ctypes.byref(self.stream), Dictionary, len(Dictionary))
+
+	def feed(self, Data):
+		""" Give it more compressed data (only once it has used up what it had).
+		"""
+		# (keep a reference, so the string stays where next_in points)
+		self.input = Data
+		self.stream.next_in = ctypes.cast(ctypes.c_char_p(Data), ctypes.c_void_p)
+		self.stream.avail_in = len(Data)
+
+	def unused(self):
+		""" The compressed data it was given but hasn't used.
+		"""
+		if self.stream.avail_in == 0:
+			return ""
+		return self.input[len(self.input)-self.stream.avail_in:]
+
+	def inflate(self, Flush=Z_NO_FLUSH):
+		""" Decompress what it can (up to OUT_SIZE bytes).
+
+			Returns: (zlib's return code, decompressed data)
+		"""
+		self.stream.next_out = ctypes.addressof(self.out)
+		self.stream.avail_out = OUT_SIZE
+		ret = _ZLIB.inflate(ctypes.byref(self.stream), Flush)
+		if ret not in [Z_OK, Z_STREAM_END, Z_BUF_ERROR]:
+			if ret == Z_NEED_DICT:
+				raise ValueError("Not a gzip file (it wants a dictionary).")
+			raise ValueError("Corrupt gzip data (zlib error "+str(ret)+": "+str(self.stream.msg)+")")
+		return ret, ctypes.string_at(self.out, OUT_SIZE-self.stream.avail_out)
+
+	def data_type(self):
+		return self.stream.data_type
+
+	def close(self):
+		if self.stream is not None:
+			_ZLIB.inflateEnd(ctypes.byref(self.stream))
+			self.stream = None
+
+	def __del__(self):
+		self.close()
+
+
+# A checkpoint:
+#	out:			offset in the decompressed data
+#	lines:			number of newlines before out
+#	after_newline:	is out the start of a line? (the byte before it is a newline, or out is 0)
+#	offset:			offset in the compressed file (of the byte with the first bits to use,
+#						if bits > 0)
+#	bits:			bits of the byte before offset still to use (0-7), for a checkpoint
+#						inside a gzip member
+#	window:			the 32 KB before out (zlib compressed), for a checkpoint inside a member.
+#						None for the start of a member.
+Point = collections.namedtuple("Point", ["out", "lines", "after_newline", "offset", "bits", "window"])
+
+def index_path(In_file):
+	"""Where the index of In_file lives: "In_file.gzidx"
+	"""
+	return In_file+".gzidx"
+
+class GzipIndex(object):
+	""" A loaded gzip index. See build_gzip_index and get_gzip_index.
+
+		Attributes:
+			in_file, index_file
+			size, mtime: of in_file when the index was built
+			spacing: decompressed bytes between checkpoints
+			points: list of checkpoints (Points), in file order. The first is the start.
+			length: decompressed size of in_file
+			n_lines: number of lines of in_file (a last line without a newline counts)
+	"""
+	def __init__(self, In_file, Index_file):
+		self.in_file = In_file
+		self.index_file = Index_file
+		with open(Index_file, 'rb') as handle:
+			try:
+				saved = cPickle.load(handle)
+			except (EOFError, cPickle.UnpicklingError, ValueError):
+				raise ValueError(Index_file+" isn't a gzip index.")
+		if type(saved) is not dict or saved.get("version") != INDEX_VERSION:
+			raise ValueError(Index_file+" isn't a gzip index (of this version).")
+		self.size = saved["size"]
+		self.mtime = saved["mtime"]
+		self.spacing = saved["spacing"]
+		self.points = [Point(*point) for point in saved["points"]]
+		self.length = saved["length"]
+		self.n_lines = saved["n_lines"]
+		self._outs = [point.out for point in self.points]
+		# The first line that starts at or after each checkpoint
+		self._first_lines = [point.lines+1 if point.after_newline else point.lines+2
+			for point in self.points]
+
+	def is_current(self):
+		""" Is in_file the same size and age it was when the index was built?
+		"""
+		if not os.path.isfile(self.in_file):
+			return False
+		stat = os.stat(self.in_file)
+		return stat.st_size == self.size and stat.st_mtime == self.mtime
+
+	def point_at(self, Offset):
+		""" The last checkpoint at or before decompressed byte Offset.
+		"""
+		return self.points[max(0, bisect.bisect_right(self._outs, Offset)-1)]
+
+	def point_at_line(self, Line):
+		""" The last checkpoint at or before the start of line Line (1 is the first line).
+		"""
+		return self.points[max(0, bisect.bisect_right(self._first_lines, Line)-1)]
+
+def _save_index(Index_file, Saved):
+	tmp_file = Index_file+".tmp"
+	with open(tmp_file, 'wb') as handle:
+		cPickle.dump(Saved, handle, cPickle.HIGHEST_PROTOCOL)
+	# So nobody ever reads a half written index
+	os.rename(tmp_file, Index_file)
+
+def build_gzip_index(In_file, Spacing=SPACING, Index_file=None):
+	""" Read In_file once, and save an index of checkpoints to decompress it from.
+
+		Arguments:
+			In_file:	"/my_directory/my_file.txt.gz" (gzip or BGZF, can be several gzip
+							files glued together)
+			Spacing:	integer > 0. About how many decompressed bytes between checkpoints.
+			Index_file:	Optional. Where to save it. Defaults to index_path(In_file)
+
+		Returns: the GzipIndex
+	"""
+	if not os.path.isfile(In_file):
+		raise ValueError(In_file+" not found.")
+	if helper_functions.compression_of(In_file) != "gz":
+		raise ValueError(In_file+" isn't gzip compressed.")
+	if type(Spacing) is not int or Spacing < 1:
+		raise ValueError("Spacing needs to be an integer > 0.")
+	if Index_file is None:
+		Index_file = index_path(In_file)
+
+	stat = os.stat(In_file)
+	points = [tuple(Point(0, 0, True, 0, 0, None))]
+	# decompressed / compressed bytes so far, and newlines so far
+	total_out = 0
+	total_in = 0
+	n_newlines = 0
+	last_byte = "\n"
+	# The last decompressed pieces, at least WINDOW_SIZE bytes of them (joined only when needed)
+	recent = collections.deque()
+	recent_bytes = 0
+	with open(In_file, 'rb') as handle:
+		inflater = _Inflater(GZIP_WBITS)
+		data = ""
+		while True:
+			if inflater.stream.avail_in == 0:
+				data = handle.read(READ_SIZE)
+				if len(data) == 0:
+					break
+				inflater.feed(data)
+			before = inflater.stream.avail_in
+			ret, out = inflater.inflate(Z_BLOCK)
+			total_in += before-inflater.stream.avail_in
+			if len(out) > 0:
+				total_out += len(out)
+				n_newlines += out.count("\n")
+				last_byte = out[-1]
+				recent.append(out)
+				recent_bytes += len(out)
+				while recent_bytes-len(recent[0]) >= WINDOW_SIZE:
+					recent_bytes -= len(recent.popleft())
+			if ret == Z_STREAM_END:
+				# End of a gzip member. Another one may follow (the rest of data, or more of the file)
+				rest = inflater.unused()
+				inflater.close()
+				inflater = _Inflater(GZIP_WBITS)
+				if total_out-points[-1][0] > Spacing:
+					points.append(tuple(Point(total_out, n_newlines, last_byte == "\n", total_in, 0, None)))
+				if len(rest) > 0:
+					inflater.feed(rest)
+				continue
+			data_type = inflater.data_type()
+			# At the end of a deflate block that isn't a member's last
+			if data_type & 128 and not data_type & 64 and total_out-points[-1][0] > Spacing:
+				bits = data_type & 7
+				window = "".join(recent)[-WINDOW_SIZE:]
+				points.append(tuple(Point(total_out, n_newlines, last_byte == "\n",
+					total_in, bits, zlib.compress(window, 1))))
+			if ret == Z_BUF_ERROR and len(out) == 0 and inflater.stream.avail_in > 0:
+				raise ValueError("Corrupt gzip data in "+In_file)
+		inflater.close()
+	if last_byte != "\n":
+		n_newlines += 1
+	_save_index(Index_file, {"version": INDEX_VERSION, "size": stat.st_size, "mtime": stat.st_mtime,
+		"spacing": Spacing, "points": points, "length": total_out, "n_lines": n_newlines})
+	return GzipIndex(In_file, Index_file)
+
+def get_gzip_index(In_file, Spacing=SPACING, Index_file=None):
+	""" Load the index of In_file, (re)building it if it is missing or out of date.
+
+		Arguments are the same as build_gzip_index.
+
+		Returns: the GzipIndex
+	"""
+	if Index_file is None:
+		Index_file = index_path(In_file)
+	if os.path.isfile(Index_file):
+		try:
+			index = GzipIndex(In_file, Index_file)
+			if index.is_current():
+				return index
+			print "FYI, "+Index_file+" is out of date. Rebuilding it."
+		except ValueError:
+			print "FYI, "+Index_file+" isn't a gzip index. Rebuilding it."
+	else:
+		print "FYI, indexing "+In_file+" (saved as "+Index_file+")."
+	return build_gzip_index(In_file, Spacing, Index_file)
+
+def current_index(In_file, Index_file=None):
+	""" The index of In_file if it has an up to date one (and it can be used here), else None.
+	"""
+	if not available():
+		return None
+	if Index_file is None:
+		Index_file = index_path(In_file)
+	if not os.path.isfile(Index_file):
+		return None
+	try:
+		index = GzipIndex(In_file, Index_file)
+	except ValueError:
+		return None
+	if not index.is_current():
+		return None
+	return index
+
+
+class IndexedGzipReader(object):
+	""" Read a gzip file like a plain one, seek() included: seeking decompresses from the
+		checkpoint before the spot (see GzipIndex).
+
+		Arguments:
+			In_file:	"/my_directory/my_file.txt.gz"
+			Index:		Optional GzipIndex of In_file. Defaults to get_gzip_index(In_file).
+	"""
+	def __init__(self, In_file, Index=None):
+		if Index is None:
+			Index = get_gzip_index(In_file)
+		if not Index.is_current():
+			raise ValueError(In_file+" changed since "+Index.index_file+" was built.")
+		self.index = Index
+		self.handle = open(In_file, 'rb')
+		self.inflater = None
+		# Decompressed data not returned yet, starting at offset pos of the file
+		self.buffer = ""
+		self.pos = 0
+		# compressed trailer bytes still to skip (after a member ends, when inflating raw)
+		self.skip = 0
+		self.eof = False
+		self._start(Index.points[0])
+
+	def _start(self, Point):
+		""" Start decompressing at a checkpoint.
+		"""
+		if self.inflater is not None:
+			self.inflater.close()
+		if Point.window is None:
+			self.handle.seek(Point.offset)
+			self.inflater = _Inflater(GZIP_WBITS)
+			self.raw = False
+		else:
+			bits_value = 0
+			if Point.bits > 0:
+				self.handle.seek(Point.offset-1)
+				bits_value = ord(self.handle.read(1)) >> (8-Point.bits)
+			else:
+				self.handle.seek(Point.offset)
+			self.inflater = _Inflater(RAW_WBITS, Point.bits, bits_value, zlib.decompress(Point.window))
+			self.raw = True
+		self.buffer = ""
+		self.pos = Point.out
+		self.skip = 0
+		self.eof = False
+
+	def _fill(self):
+		""" Decompress some more onto the buffer. Returns False at the end of the file.
+		"""
+		while not self.eof:
+			if self.inflater.stream.avail_in == 0:
+				data = self.handle.read(READ_SIZE)
+				if len(data) == 0:
+					self.eof = True
+					return False
+				if self.skip > 0:
+					skipped = min(self.skip, len(data))
+					self.skip -= skipped
+					data = data[skipped:]
+					if len(data) == 0:
+						continue
+				self.inflater.feed(data)
+			ret, out = self.inflater.inflate()
+			if ret == Z_BUF_ERROR and len(out) == 0 and self.inflater.stream.avail_in > 0:
+				raise ValueError("Corrupt gzip data in "+self.index.in_file)
+			if ret == Z_STREAM_END:
+				rest = self.inflater.unused()
+				if self.raw:
+					# Raw inflating leaves the member's 8 byte trailer (crc, length)
+					skipped = min(8, len(rest))
+					rest = rest[skipped:]
+					self.skip = 8-skipped
+				self.inflater.close()
+				self.inflater = _Inflater(GZIP_WBITS)
+				self.raw = False
+				if len(rest) > 0:
+					self.inflater.feed(rest)
+			if len(out) > 0:
+				self.buffer += out
+				return True
+		return False
+
+	def seek(self, Offset, Whence=0):
+		""" Go to decompressed byte Offset (Whence 0), Offset from here (1), or from the end (2).
+		"""
+		if Whence == 1:
+			Offset += self.pos
+		elif Whence == 2:
+			Offset += self.index.length
+		if Offset < 0:
+			raise ValueError("Can't seek before the start of the file.")
+		if not (self.pos <= Offset <= self.pos+len(self.buffer)):
+			point = self.index.point_at(Offset)
+			# (carry on from here if that's closer than the checkpoint)
+			if not (self.pos+len(self.buffer) <= Offset and point.out <= self.pos):
+				self._start(point)
+		while self.pos+len(self.buffer) < Offset:
+			self.pos += len(self.buffer)
+			self.buffer = ""
+			if not self._fill():
+				return
+		self.buffer = self.buffer[Offset-self.pos:]
+		self.pos = Offset
+
+	def tell(self):
+		return self.pos
+
+	def read(self, Size=-1):
+		""" Read up to Size decompressed bytes (all the rest, if Size < 0).
+		"""
+		while (Size < 0 or len(self.buffer) < Size) and self._fill():
+			pass
+		if Size < 0:
+			Size = len(self.buffer)
+		data = self.buffer[:Size]
+		self.buffer = self.buffer[Size:]
+		self.pos += len(data)
+		return data
+
+	def readline(self):
+		k = self.buffer.find("\n")
+		while k < 0:
+			searched = len(self.buffer)
+			if not self._fill():
+				break
+			k = self.buffer.find("\n", searched)
+		if k < 0:
+			k = len(self.buffer)-1
+		line = self.buffer[:k+1]
+		self.buffer = self.buffer[k+1:]
+		self.pos += len(line)
+		return line
+
+	def __iter__(self):
+		""" Yield lines from here (tell() is only up to date between lines, like a file's).
+		"""
+		while True:
+			k = self.buffer.rfind("\n")
+			if k < 0:
+				if self._fill():
+					continue
+				# The end of the file: a last line without a newline
+				if len(self.buffer) > 0:
+					line = self.buffer
+					self.buffer = ""
+					self.pos += len(line)
+					yield line
+				return
+			pieces = self.buffer[:k].split("\n")
+			self.buffer = self.buffer[k+1:]
+			for piece in pieces:
+				line = piece+"\n"
+				self.pos += len(line)
+				yield line
+
+	def close(self):
+		if self.inflater is not None:
+			self.inflater.close()
+			self.inflater = None
+		self.handle.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *Exception_info):
+		self.close()
+
+def read_range(In_file, Start, Length, Index=None):
+	""" Return Length decompressed bytes of In_file from decompressed byte Start (fewer at
+		the end of the file).
+	"""
+	with IndexedGzipReader(In_file, Index) as reader:
+		reader.seek(Start)
+		return reader.read(Length)
+
+def lines_from(In_file, First, Last=None, Index=None):
+	""" Yield lines First through Last (1 = first line; Last defaults to the end of the file),
+		decompressing from the checkpoint before line First.
+	"""
+	if type(First) is not int or First < 1:
+		raise ValueError("First needs to be an integer > 0.")
+	if Last is not None and (type(Last) is not int or Last < First):
+		raise ValueError("Last needs to be an integer >= First.")
+	with IndexedGzipReader(In_file, Index) as reader:
+		point = reader.index.point_at_line(First)
+		reader.seek(point.out)
+		lines = iter(reader)
+		line_number = point.lines+1
+		if not point.after_newline:
+			# (the rest of a line that started before the checkpoint)
+			next(lines, None)
+			line_number += 1
+		for line in lines:
+			if line_number >= First:
+				if Last is not None and line_number > Last:
+					return
+				yield line
+			line_number += 1
+
+def line_ranges(In_file, Start, N_ranges, Index=None):
+	""" Split In_file's decompressed data from byte Start (the start of a line) into up to
+		N_ranges ranges that each begin at the start of a line, right after a checkpoint,
+		so that each can be read by its own process (see IndexedGzipReader and
+		partition_functions.range_lines) without decompressing the others.
+
+		Returns: a list of (start, end) decompressed byte offsets, in file order
+	"""
+	if type(N_ranges) is not int or N_ranges < 1:
+		raise ValueError("N_ranges needs to be an integer > 0.")
+	with IndexedGzipReader(In_file, Index) as reader:
+		index = reader.index
+		boundaries = [Start]
+		for k in range(1, N_ranges):
+			target = Start + (index.length-Start)*k//N_ranges
+			point = index.point_at(target)
+			if point.out <= boundaries[-1]:
+				continue
+			if point.after_newline:
+				offset = point.out
+			else:
+				reader.seek(point.out)
+				reader.readline()
+				offset = reader.tell()
+			if boundaries[-1] < offset < index.length:
+				boundaries.append(offset)
+	boundaries.append(index.length)
+	return [(boundaries[k], boundaries[k+1]) for k in range(len(boundaries)-1)]
@@ -7,31 +7,47 @@
 ### A bunch of helper functions I think I'll use a lot
 
 import os
-from subprocess import call
+import collections
+import itertools
+import pipes
+from subprocess import Popen, PIPE
 import gzip
+import io
+import signal
+import struct
 import time
+import zlib
+
+import file_search
+import job_executors
+
+# numpy is optional (only the *_array functions need it)
+try:
+	import numpy
+except ImportError:
+	numpy = None
 
 
 def remove_all(array, element):
-	""" Remove all instances of element from array.
+	""" Remove all instances of element from array (in place, in one pass).
 
 		Arguments:
-			array 	= type: list.
+			array 	= type: list. (For numpy arrays, see remove_all_array)
 			element = object that you wish to remove all of from array.
 	"""
 	if not isinstance(array, list):
 		raise Exception("Please only give lists to this function.")
-	n = array.count(element)
-	while n > 0:
-		array.remove(element)
-		n = array.count(element)
+	# (the same test list.remove uses)
+	array[:] = [x for x in array if not (x is element or x == element)]
 
 def index_all(array, element):
 	"""Return all indeces of array that point to an element.
 
 		Arguments:
-			array 	= type: list.
+			array 	= type: list. (For numpy arrays, see index_all_array)
 			element = object that you wish to get indeces for from array.
+
+		To get the indeces of lots of elements, index_values does them all in one pass.
 	"""
 	if not isinstance(array, list):
 		raise Exception("Please only give lists to this function.")
@@ -39,6 +55,59 @@ def index_all(array, element):
 	matched_indices = [i for i, x in enumerate(array)if x == element]
 	return matched_indices
 
+def index_values(array):
+	"""Return a dict of each distinct element of array -> all indeces that point to it,
+		in one pass (instead of a call to index_all per element).
+
+		Arguments:
+			array 	= type: list. Its elements need to be hashable. (For numpy arrays, see
+				index_values_array)
+	"""
+	if not isinstance(array, list):
+		raise Exception("Please only give lists to this function.")
+
+	indices = dict()
+	for i, x in enumerate(array):
+		if x in indices:
+			indices[x].append(i)
+		else:
+			indices[x] = [i]
+	return indices
+
+def _check_numpy_array(array):
+	if numpy is None:
+		raise ImportError("numpy isn't installed. Use a list with the non-_array version instead.")
+	if not isinstance(array, numpy.ndarray) or array.ndim != 1:
+		raise Exception("Please only give 1 dimensional numpy arrays to this function.")
+
+def remove_all_array(array, element):
+	""" Return a copy of numpy array without any instances of element.
+
+		(Numpy arrays can't shrink in place, unlike lists in remove_all.)
+	"""
+	_check_numpy_array(array)
+	return array[array != element]
+
+def index_all_array(array, element):
+	"""Return a numpy array of all indeces of numpy array that point to an element.
+	"""
+	_check_numpy_array(array)
+	return numpy.flatnonzero(array == element)
+
+def index_values_array(array):
+	"""Return a dict of each distinct element of numpy array -> numpy array of all indeces
+		that point to it (in order), without going through the elements one by one in python.
+	"""
+	_check_numpy_array(array)
+	# A stable sort keeps each element's indeces in order
+	order = numpy.argsort(array, kind='mergesort')
+	if len(order) == 0:
+		return dict()
+	ordered = array[order]
+	# Where each run of equal elements starts
+	starts = numpy.flatnonzero(ordered[1:] != ordered[:-1])+1
+	return dict(zip(ordered[numpy.concatenate(([0], starts))].tolist(), numpy.split(order, starts)))
+
 def make_scisub_job_command(
 	Script,
 	ScriptDir,
@@ -143,16 +212,138 @@ def make_scisub_job_command(
 
 	return [command, "IS_SCISUB_COMMAND"]
 
-def submit_scisub_job(Command):
+def submit_scisub_job(Command, Executor=None):
 	""" Given the output from make_scisub_job_command, submit a job.
+
+	Arguments:
+		Command:	output from make_scisub_job_command
+		Executor:	Optional. Where to run the job: a job_executors.LSFExecutor (bsub, what
+						this always did) or job_executors.LocalExecutor (a pool of processes on
+						this machine). Defaults to job_executors.default_executor().
+
+	Returns: list of job_executors.JobHandles, one per job (per task, for a job array from
+		make_scisub_array_command), with the job's ID and log files. To wait for them, see
+		job_executors.JobTracker.
 	"""
 	if type(Command) is not list:
 		raise ValueError("Command isn't from make_scisub_job_command...(not a list)")
 	if Command[1] != "IS_SCISUB_COMMAND":
 		raise ValueError("Command isn't from make_scisub_job_command...(where is 'IS_SCISUB_COMMAND'?)")
+	if Executor is None:
+		Executor = job_executors.default_executor()
+
+	# Hand it to the executor
+	return Executor.submit(Command[0])
+
+def make_scisub_array_command(
+	Script,
+	ScriptDir,
+	Arg_sets,
+	Name="",
+	Queue = "voight_normal",
+	ErrOut=True,
+	ErrOutDir = "",
+	Language="python",
+	Max_running=None):
+	"""Generate a command that submits Script once per set of arguments as a single LSF job
+		array, instead of one bsub per job (which is hard on the LSF master).
+
+	Arguments:
+		Script, ScriptDir, Queue, ErrOut, ErrOutDir, Language: same as make_scisub_job_command
+		Arg_sets:		list with the command line arguments for each job. Each is a string
+							(like Extra in make_scisub_job_command) or a list of arguments
+							(which get quoted for you).
+		Name:			Optional string. Name of the job array. Defaults to Script's name.
+		Max_running:	Optional integer > 0. Most jobs of the array to run at once.
 
-	# Submit a system command
-	call([Command[0]],shell=True)
+	The argument sets are written to a file (one per line), along with a small bash script
+		that each job of the array runs: it reads line $LSB_JOBINDEX of that file and runs
+		Script with it. Both go in ErrOutDir (or the current directory, if there is none),
+		named after the array. Job i's log files end with _i.err and _i.out.
+
+	Returns a list like make_scisub_job_command's (so submit_scisub_job can submit it).
+
+		Example output (for 3 argument sets, at most 2 running at once):
+
+		['bsub -J 'my_script_year_month_day_hr_min_sec[1-3]%2'
+			   -e /project/voight_subrate/.../logs/my_script_year_month_day_hr_min_sec_%I.err
+			   -o /project/voight_subrate/.../logs/my_script_year_month_day_hr_min_sec_%I.out
+			   -q voight_normal
+			   bash /project/voight_subrate/.../logs/my_script_year_month_day_hr_min_sec.array.sh',
+		'IS_SCISUB_COMMAND']
+	"""
+	ACCEPTABLE_LANGUAGES = {"python": "python", "R": "Rscript", "bash": "bash"}
+	if Language not in ACCEPTABLE_LANGUAGES:
+		raise ValueError(str(Language)+" not one of the following: "+str(sorted(ACCEPTABLE_LANGUAGES)))
+	if (type(Script) is not str 
+		or type(ScriptDir) is not str 
+		or type(Queue) is not str 
+		or type(ErrOutDir) is not str 
+		or type(Name) is not str):
+		raise ValueError("Script, ScriptDir, Queue, ErrOutDir, and Name need to be strings.")
+	if type(ErrOut) is not bool:
+		raise ValueError("ErrOut needs to be a boolean.")
+	if Script[-2:] != "py" and Script[-1:] != "R" and Script[-2:] != "sh":
+		raise ValueError("Expected a .py python, .sh shell, or .R R script, instead got: "+Script)
+	if not (os.path.isdir(ScriptDir)):
+		raise ValueError(ScriptDir+" not found.")
+	if ScriptDir[-1] != "/":
+		raise ValueError("ScriptDir needs to end with a forward slash.")
+	if not os.path.isfile(ScriptDir+Script):
+		raise ValueError(Script+" not found in "+ScriptDir)
+	if (Queue != "voight_normal" 
+		and Queue != "voight_long"
+		and Queue != "voight_priority"):
+		raise ValueError(
+			"Expected voight_normal, voight_long, or voight_priority, instead got: "+Queue)
+	if len(ErrOutDir) > 0:	
+		if not (os.path.isdir(ErrOutDir)):
+			raise ValueError(ErrOutDir+" not found.")
+		if ErrOutDir[-1] != "/":
+			raise ValueError("ErrOutDir needs to end with a forward slash.")
+	if type(Arg_sets) is not list or len(Arg_sets) == 0:
+		raise ValueError("Arg_sets needs to be a non-empty list.")
+	if Max_running is not None and (type(Max_running) is not int or Max_running < 1):
+		raise ValueError("Max_running needs to be an integer > 0.")
+
+	lines = list()
+	for args in Arg_sets:
+		if type(args) is list or type(args) is tuple:
+			args = " ".join(pipes.quote(str(arg)) for arg in args)
+		elif type(args) is not str:
+			raise ValueError("Each of Arg_sets needs to be a string or a list, not: "+str(args))
+		if "\n" in args or "\r" in args:
+			raise ValueError("Arguments can't have newlines in them: "+args)
+		lines.append(args+"\n")
+
+	time_stamp = time.strftime("%Y_%m_%d_%H_%M_%S")
+	if len(Name) == 0:
+		Name = os.path.splitext(Script)[0]+"_"+time_stamp
+	if len(ErrOutDir) > 0:
+		array_dir = ErrOutDir
+	else:
+		array_dir = os.getcwd()+"/"
+	args_file = array_dir+Name+".args"
+	array_script = array_dir+Name+".array.sh"
+	with open(args_file, 'wb') as handle:
+		handle.writelines(lines)
+	with open(array_script, 'wb') as handle:
+		handle.write("#!/bin/bash\n")
+		handle.write("# Job $LSB_JOBINDEX of the "+Name+" job array: run "+Script+" with line $LSB_JOBINDEX of "+args_file+"\n")
+		handle.write("args=$(sed -n \"${LSB_JOBINDEX}p\" "+pipes.quote(args_file)+")\n")
+		handle.write("eval \"exec "+ACCEPTABLE_LANGUAGES[Language]+" "+pipes.quote(ScriptDir+Script)+" $args\"\n")
+
+	job_name = Name+"[1-"+str(len(lines))+"]"
+	if Max_running is not None:
+		job_name = job_name+"%"+str(Max_running)
+	command = "bsub -J "+pipes.quote(job_name)+" "
+	if ErrOut:
+		command = command + "-e "+ErrOutDir+Name+"_%I.err "
+		command = command + "-o "+ErrOutDir+Name+"_%I.out "
+	command = command + "-q "+Queue
+	command = command + " bash "+array_script
+
+	return [command, "IS_SCISUB_COMMAND"]
 
 def make_consign_job_command(
 	Script,
@@ -246,25 +437,297 @@ def make_consign_job_command(
 
 	return [command, "IS_CONSIGN_COMMAND"]
 
-def submit_consign_job(Command):
+def submit_consign_job(Command, Executor=None):
 	""" Given the output from make_consign_job_command, submit a job.
+
+	Arguments:
+		Command:	output from make_consign_job_command
+		Executor:	Optional. Where to run the job: a job_executors.LSFExecutor (bsub, what
+						this always did) or job_executors.LocalExecutor (a pool of processes on
+						this machine). Defaults to job_executors.default_executor().
+
+	Returns: list of job_executors.JobHandles, one per job (per task, for a job array from
+		make_scisub_array_command), with the job's ID and log files. To wait for them, see
+		job_executors.JobTracker.
 	"""
 	if type(Command) is not list:
 		raise ValueError("Command isn't from make_consign_job_command...(not a list)")
 	if Command[1] != "IS_CONSIGN_COMMAND":
 		raise ValueError("Command isn't from make_consign_job_command...(where is 'IS_CONSIGN_COMMAND'?)")
+	if Executor is None:
+		Executor = job_executors.default_executor()
+
+	# Hand it to the executor
+	return Executor.submit(Command[0])
+
+# Magic bytes at the start of compressed files
+GZIP_MAGIC = "\x1f\x8b"
+ZSTD_MAGIC = "\x28\xb5\x2f\xfd"
+
+# External decompressors, fastest first. They run in their own process, so decompressing
+#  happens alongside whatever we're doing with the lines.
+GZIP_DECOMPRESSORS = [["pigz", "-dc"], ["gzip", "-dc"]]
+ZSTD_DECOMPRESSORS = [["zstd", "-dcq"]]
+
+# An empty BGZF block. Marks the end of a BGZF file.
+BGZF_EOF = ("\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43\x02\x00"
+	"\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00")
+# Max uncompressed bytes per BGZF block (same as htslib)
+BGZF_BLOCK_SIZE = 0xff00
+
+def which(Program):
+	"""Return the full path to Program if it is on the PATH, else None.
+	"""
+	for directory in os.environ.get("PATH", "").split(os.pathsep):
+		path = os.path.join(directory, Program)
+		if os.path.isfile(path) and os.access(path, os.X_OK):
+			return path
+	return None
+
+def compression_of(Path):
+	"""Return 'gz' or 'zst' if Path is a compressed file (going by its first bytes), else None.
+
+		BGZF files are gzip files, so they are 'gz' too.
+	"""
+	with open(Path, 'rb') as handle:
+		magic = handle.read(4)
+	if magic[:2] == GZIP_MAGIC:
+		return "gz"
+	if magic == ZSTD_MAGIC:
+		return "zst"
+	return None
+
+class PipeReader(object):
+	"""Read the stdout of an external decompressor like a file.
+
+		Raises IOError on close() if the decompressor failed.
+	"""
+	def __init__(self, Command, Path):
+		self.command = Command
+		self.name = Path
+		# (python ignores SIGPIPE, and so would the decompressor, which then complains
+		#  and fails when the pipe is closed early, instead of quietly dying)
+		self.process = Popen(Command+[Path], stdout=PIPE, bufsize=1024*1024, close_fds=True,
+			preexec_fn=lambda: signal.signal(signal.SIGPIPE, signal.SIG_DFL))
+		self.stdout = self.process.stdout
+
+	def __iter__(self):
+		return iter(self.stdout)
+
+	def read(self, *args):
+		return self.stdout.read(*args)
+
+	def readline(self, *args):
+		return self.stdout.readline(*args)
+
+	def close(self):
+		if self.stdout.closed:
+			return
+		self.stdout.close()
+		code = self.process.wait()
+		# Closing the pipe early kills the decompressor with SIGPIPE, which is fine.
+		if code != 0 and code != -signal.SIGPIPE:
+			raise IOError(" ".join(self.command)+" "+self.name+" exited with "+str(code))
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+class BgzfWriter(object):
+	"""Write a BGZF file: gzip made of independent blocks of at most 64Kb.
+
+		Any gzip reader can read it, and it can be indexed for random access (e.g. by
+			tabix). Opening an extant file with Mode 'ab' adds blocks to its end.
+	"""
+	def __init__(self, Path, Mode='wb', Level=6):
+		if Mode not in ['wb', 'ab']:
+			raise ValueError("Mode needs to be 'wb' or 'ab', not: "+str(Mode))
+		self.name = Path
+		self.level = Level
+		self.handle = open(Path, Mode)
+		self.buffer = list()
+		self.buffered = 0
+
+	def write(self, Data):
+		# Copy buffer()s (e.g. of a memory map that might be closed before we flush)
+		if type(Data) is not str:
+			Data = str(Data)
+		self.buffer.append(Data)
+		self.buffered += len(Data)
+		if self.buffered >= BGZF_BLOCK_SIZE:
+			data = "".join(self.buffer)
+			n_full = len(data)//BGZF_BLOCK_SIZE*BGZF_BLOCK_SIZE
+			for start in xrange(0, n_full, BGZF_BLOCK_SIZE):
+				self._write_block(data[start:start+BGZF_BLOCK_SIZE])
+			self.buffer = [data[n_full:]]
+			self.buffered = len(data)-n_full
+
+	def _write_block(self, Block):
+		compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+		cdata = compressor.compress(Block)+compressor.flush()
+		# gzip header with the BGZF 'BC' extra field holding (block size - 1)
+		header = struct.pack("<BBBBIBBHBBHH", 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(cdata)+25)
+		trailer = struct.pack("<II", zlib.crc32(Block) & 0xffffffff, len(Block))
+		self.handle.write(header+cdata+trailer)
+
+	def close(self):
+		if self.handle.closed:
+			return
+		if self.buffered > 0:
+			self._write_block("".join(self.buffer))
+		self.buffer = list()
+		self.buffered = 0
+		self.handle.write(BGZF_EOF)
+		self.handle.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+def open_file(Path, Mode='rb', Compress=None, Level=6):
+	"""Open a plain, gzip (or BGZF), or zstd file. Use in place of open().
+
+		Arguments:
+			Path:		"/my_directory/my_file.txt[.gz]"
+			Mode:		'rb' to read, 'wb' to write, 'ab' to append
+			Compress:	When writing: None (plain text), 'gz', or 'bgzf'.
+						When reading, the compression is figured out from the file itself.
+			Level:		compression level (1 = fastest, 9 = smallest) when writing
+
+		When reading compressed files, pigz/gzip (or zstd) are used if they are on the PATH,
+			otherwise python's gzip module (zstd files need zstd).
+
+		Returns: a file-like object to iterate over / write to (and close!)
+	"""
+	if Mode == 'rb':
+		compression = compression_of(Path)
+		if compression is None:
+			return open(Path, 'rb')
+		if compression == "gz":
+			decompressors = GZIP_DECOMPRESSORS
+		else:
+			decompressors = ZSTD_DECOMPRESSORS
+		for command in decompressors:
+			if which(command[0]) is not None:
+				return PipeReader(command, Path)
+		if compression == "zst":
+			raise ValueError(Path+" is zstd compressed, but zstd isn't on the PATH.")
+		# io.BufferedReader makes iterating over gzip lines a lot faster than GzipFile alone
+		return io.BufferedReader(gzip.open(Path, 'rb'), 1024*1024)
+	elif Mode == 'wb' or Mode == 'ab':
+		if Compress is None:
+			return open(Path, Mode)
+		elif Compress == "gz":
+			return gzip.open(Path, Mode, Level)
+		elif Compress == "bgzf":
+			return BgzfWriter(Path, Mode, Level)
+		raise ValueError("Compress needs to be None, 'gz', or 'bgzf', not: "+str(Compress))
+	raise ValueError("Mode needs to be 'rb', 'wb', or 'ab', not: "+str(Mode))
+
+def _preview_line(Line, Delim):
+	if Delim is None:
+		return Line
+	return Line.rstrip('\r\n').split(Delim)
+
+def iter_lines(Path, First=1, Last=None, Delim=None):
+	""" Yield lines First through Last of a plain, gzip or zstd file, reading only as far
+		as Last (so in constant memory, however big the file is).
+
+		Arguments:
+			Path:	"/my_directory/my_file.txt[.gz]"
+			First:	integer > 0. First line to yield (1 = first line of the file)
+			Last:	Optional integer >= First. Last line to yield. Defaults to the end of the file.
+			Delim:	Optional. Yield each line split into a list of fields at Delim (e.g. '\\t')
+					instead of the line as it is (newline and all).
+
+		If a gzip file has an up to date index (see gzip_index.py), reading starts at the
+			checkpoint before First instead of at the top of the file.
+	"""
+	if type(First) is not int or First < 1:
+		raise ValueError("First needs to be an integer > 0.")
+	if Last is not None and (type(Last) is not int or Last < First):
+		raise ValueError("Last needs to be an integer >= First.")
+	if not os.path.isfile(Path):
+		raise ValueError(Path+" not found.")
+	if First > 1 and compression_of(Path) == "gz":
+		# (imported here, since gzip_index imports this module)
+		import gzip_index
+		index = gzip_index.current_index(Path)
+		if index is not None:
+			for line in gzip_index.lines_from(Path, First, Last, index):
+				yield _preview_line(line, Delim)
+			return
+	with open_file(Path, 'rb') as handle:
+		for line in itertools.islice(handle, First-1, Last):
+			yield _preview_line(line, Delim)
+
+def head_lines(Path, Lines=10, Delim="\t"):
+	""" Return the first Lines lines of a plain, gzip or zstd file, each split into a list of
+		fields at Delim (or as they are, if Delim is None). See iter_lines.
+	"""
+	if type(Lines) is not int or Lines < 1:
+		raise ValueError("Lines needs to be an integer > 0.")
+	return list(iter_lines(Path, 1, Lines, Delim))
+
+def line_range(Path, First, Last, Delim="\t"):
+	""" Return lines First through Last (counting from 1, like sed -n 'First,Lastp') of a plain,
+		gzip or zstd file, each split into a list of fields at Delim (or as they are, if Delim
+		is None). See iter_lines.
+	"""
+	return list(iter_lines(Path, First, Last, Delim))
 
-	# Submit a system command
-	call([Command[0]],shell=True)
+def tail_lines(Path, Lines=10, Delim="\t", Block_size=64*1024):
+	""" Return the last Lines lines of a plain, gzip or zstd file, each split into a list of
+		fields at Delim (or as they are, if Delim is None).
 
-def gz_head(File, Dir="", Lines=10):
-	""" Preview top Lines of a file.gz
+		Plain files are read backwards from the end, Block_size bytes at a time, until
+			there are enough lines. Compressed files can't be read backwards, so are read
+			from the start, keeping just the last Lines lines.
+	"""
+	if type(Lines) is not int or Lines < 1:
+		raise ValueError("Lines needs to be an integer > 0.")
+	if type(Block_size) is not int or Block_size < 1:
+		raise ValueError("Block_size needs to be an integer > 0.")
+	if not os.path.isfile(Path):
+		raise ValueError(Path+" not found.")
+	if compression_of(Path) is not None:
+		with open_file(Path, 'rb') as handle:
+			lines = collections.deque(handle, Lines)
+		return [_preview_line(line, Delim) for line in lines]
+	with open(Path, 'rb') as handle:
+		handle.seek(0, os.SEEK_END)
+		pos = handle.tell()
+		blocks = []
+		n_newlines = 0
+		# The last Lines lines start after the Lines-th newline from the end (not counting
+		#  the last character, which is the last line's own newline if it has one)
+		while pos > 0 and n_newlines < Lines:
+			size = min(Block_size, pos)
+			pos -= size
+			handle.seek(pos)
+			block = handle.read(size)
+			if len(blocks) == 0:
+				n_newlines += block.count("\n", 0, len(block)-1)
+			else:
+				n_newlines += block.count("\n")
+			blocks.append(block)
+	blocks.reverse()
+	lines = "".join(blocks).splitlines(True)
+	return [_preview_line(line, Delim) for line in lines[-Lines:]]
+
+def gz_head(File, Dir="", Lines=10, First=1):
+	""" Preview top Lines of a file.gz (decompressed with pigz if it's on the PATH)
 
 		Arguments:
 			File: 	"my_fav_file.txt.gz" [needs to be a .gz file]
 			Dir: 	"/my_directory/" [optional, you may make File a the full filepath instead.]
 			Lines:	Integer greater than 0.
-			Split:	Optional string. If 
+			First:	Integer greater than 0. Preview Lines lines starting at this one instead
+					(fast deep into big files once they have a gzip_index; see iter_lines).
 	"""
 	if type(File) is not str or type(Dir) is not str:
 		raise ValueError("All arguments need to be strings.")
@@ -280,18 +743,13 @@ def gz_head(File, Dir="", Lines=10):
 	if not os.path.isfile(Dir+File):
 		raise ValueError(File+" not found in directory\n"+Dir)
 
+	if type(First) is not int or First < 1:
+		raise ValueError("First needs to be an integer > 0.")
+
 	path = Dir+File
-	# 'rb' means read
-	f_IN = gzip.open(path, 'rb')
-	for line in f_IN:
-		if Lines == 0:
-			break
-		# Remove newline chars and split by tab
-		split_line = line.rstrip('\r\n').split('\t')
+	for split_line in line_range(path, First, First+Lines-1, '\t'):
 		print split_line
 		print '\n'
-		Lines = Lines-1
-	f_IN.close()
 
 def my_head(File, Dir="", Lines=10):
 	""" Preview top Lines of a (non gz) file
@@ -316,21 +774,20 @@ def my_head(File, Dir="", Lines=10):
 		raise ValueError(File+" not found in directory\n"+Dir)
 
 	path = Dir+File
-	with open(path, 'rb') as the_file:
-		content = the_file.readlines()
-		for line in content:
-			if Lines == 0:
-				break
-			# Remove newline chars and split by tab
-			# split_line = line.rstrip('\r\n').split('\t')
-			print line
-			Lines = Lines-1
+	# Only reads as far as it needs to (see head_lines / tail_lines / line_range for
+	#  getting the fields back instead of printing them)
+	for line in head_lines(path, Lines, None):
+		print line
 
 def bash_sort(File, In_dir, Out_dir, Col, Delim = "\\t", Sort_style="", Header = True):
-	""" Bash sort a file, return location of sorted file.
+	""" Sort a file by a column, return location of sorted file.
+
+		(It used to shell out to head, tail and sort. Now it's a wrapper around
+			sort_functions.external_sort, which does it in one read of the file, on all cores,
+			and can also sort by several columns.)
 
 		Arguments:
-			File: 		"my_fav_file.txt"
+			File: 		"my_fav_file.txt" [or "my_fav_file.txt.gz"]
 			In_dir: 	"/my_directory/" [optional, you may make File a the full filepath instead
 			Out_dir:	"/some_dir" where sorted file is saved
 			Col:		integer. Which column to sort by? [1 = first column]
@@ -339,11 +796,17 @@ def bash_sort(File, In_dir, Out_dir, Col, Delim = "\\t", Sort_style="", Header =
 			Header: 	boolean. Does the file have a header?
 
 		Assumptions:
-			File is not gz-zipped (or compressed at all)
-			File ends in '.'txt'
+			File ends in '.txt' (or '.txt.gz', and then so will the sorted file)
 			File has a single lined header, or no header
 
-		Returns: filepath of the sorted file
+		Notes:
+			Lines with equal values in Col stay in the order they were in, and text is
+				compared byte by byte (like LC_ALL=C sort -s).
+			File is checked first (like sort -c), and only sorted if it isn't already.
+				Whether File (and the sorted file) are sorted is noted in a small cache next to
+				them, so calling this again on the same, unchanged File returns straight away.
+
+		Returns: filepath of the sorted file (File's own, if it was already sorted)
 	"""
 	if type(File) is not str or type(In_dir) is not str or type(Out_dir) is not str:
 		raise TypeError("File, In_dir, and Out_dir need to be strings.")
@@ -359,8 +822,12 @@ def bash_sort(File, In_dir, Out_dir, Col, Delim = "\\t", Sort_style="", Header =
 			raise ValueError(Out_dir+" not found.")
 		if Out_dir[-1] != "/":
 			raise ValueError("Out_dir needs to end with a forward slash.")
-	if File[-4:] != ".txt":
-		raise ValueError("Please only use this function on .txt files.")
+	if File[-4:] == ".txt":
+		extension = ".txt"
+	elif File[-7:] == ".txt.gz":
+		extension = ".txt.gz"
+	else:
+		raise ValueError("Please only use this function on .txt (or .txt.gz) files.")
 	if not os.path.isfile(In_dir+File):
 		raise ValueError(File+" not found in directory\n"+In_dir)
 	if type(Sort_style) is not str:
@@ -370,55 +837,93 @@ def bash_sort(File, In_dir, Out_dir, Col, Delim = "\\t", Sort_style="", Header =
 
 	print "Passed bash_sort checks."
 
+	# (imported here, since sort_functions imports this module)
+	import sort_functions
+
 	in_file_path = In_dir + File	
-	out_file_path = Out_dir + File[:-4]+"_sorted.txt"
-	
-	# Which column will be sorted by
-	sort_at = str(Col)+","+str(Col)
-	if Header:
-		# Save the header to out_file
-		command = "head " + in_file_path + " -n 1 > " + out_file_path
-		call([command], shell= True)
-				
-		# This command is for checking if the column is already sorted.
-		check_if_sorted_command = "tail -n +2 " + in_file_path + " | sort -t "+Delim+" -"+Sort_style+"k " + sort_at + " -c"
-		test_sorted = call([check_if_sorted_command], shell = True)
-		# If not sorted:
-		if test_sorted == 1:
-			# This sorts the file, but skips the header when sorting it, and writes the result to file
-			command = "tail -n +2 " + in_file_path + " | sort -t "+Delim+" -"+Sort_style+"k " + sort_at + " >> " + out_file_path
-			call([command], shell = True)
-		# Else not sorted, just return original file path
-		else:
-			# Delete out_file that was going to be sorted
-			command = "rm "+out_file_path
-			call([command], shell = True)
-			return in_file_path
-	# Else no header
+	out_file_path = Out_dir + File[:-len(extension)]+"_sorted"+extension
+	if extension == ".txt.gz":
+		compress = "gz"
 	else:
-		# This command is for checking if the column is already sorted.
-		check_if_sorted_command = "sort "+in_file_path+" -t "+Delim+" -"+Sort_style+"k " + sort_at + " -c"
-		test_sorted = call([check_if_sorted_command], shell = True)
-		# If not sorted:
-		if test_sorted == 1:
-		
-			
-			command = "sort "+in_file_path+" -t "+Delim+" -"+Sort_style+"k " + sort_at + " > " + out_file_path
-			call([command], shell = True)
-		# Else file is already sorted
-		else:
-			return in_file_path
-
+		compress = None
+	# Delim was written for the shell, so a tab comes in as a backslash and a t
+	if Delim == "\\t":
+		Delim = "\t"
+	if Sort_style == "n":
+		keys = [(Col-1, "num")]
+	else:
+		keys = [(Col-1, "str")]
+
+	# If already sorted, just return original file path. (Checking writes nothing, stops at
+	#  the first line out of order, and is looked up in / noted in the sort cache, see
+	#  sort_functions.record_sortedness.)
+	if sort_functions.is_sorted(in_file_path, keys, Delim, Header):
+		return in_file_path
+	sort_functions.external_sort(in_file_path, out_file_path, keys, Delim, Header, compress)
 	return out_file_path
 
-def grep_for_files(Dir, Pattern, Lacks = ""):
+def bash_join(Left_file, Right_file, Out_file, Left_col, Right_col, How="inner", Delim="\\t",
+	Sort_style="", Header=True, Fill="NA"):
+	""" Join two files sorted by bash_sort on their sorted columns, without loading either into
+		memory (see sort_functions.merge_join).
+
+		Arguments:
+			Left_file:	"/my_directory/left_sorted.txt" [or .txt.gz]
+			Right_file:	"/my_directory/right_sorted.txt" [or .txt.gz]
+			Out_file:	"/my_out_directory/joined.txt" [.gz to compress it]
+			Left_col:	integer. Which column Left_file was sorted by? [1 = first column]
+			Right_col:	integer. Which column Right_file was sorted by? [1 = first column]
+			How:		'inner', 'left' or 'outer'
+			Delim:		string. If tab, must be '\\t'
+			Sort_style:	string. 'n' or '' [as given to bash_sort]
+			Header:		boolean. Do the files have a header?
+			Fill:		string. Put in the columns of the missing side of unmatched lines.
+
+		Each output line is the left line, then the right line without its join column.
+			Raises ValueError if either file turns out not to be sorted.
+
+		Returns: dict of the number of lines written and of matched / unmatched lines
+	"""
+	if type(Left_col) is not int or Left_col <= 0 or type(Right_col) is not int or Right_col <= 0:
+		raise ValueError("Left_col and Right_col need to be integers > 0.")
+	if Sort_style != "n" and Sort_style != "":
+		raise ValueError("Sort_style needs to be 'n' or '', not: "+str(Sort_style))
+	# (imported here, since sort_functions imports this module)
+	import sort_functions
+
+	# Delim was written for the shell, so a tab comes in as a backslash and a t
+	if Delim == "\\t":
+		Delim = "\t"
+	if Sort_style == "n":
+		kind = "num"
+	else:
+		kind = "str"
+	if Out_file[-3:] == ".gz":
+		compress = "gz"
+	else:
+		compress = None
+	return sort_functions.merge_join(Left_file, Right_file, Out_file, Left_col-1, Right_col-1,
+		How, kind, Delim, Header, Fill, compress)
+
+def grep_for_files(Dir, Pattern, Lacks = "", Style = "substring", Index_file = None, Workers = 8,
+	Refresh = True):
 	"""Search a directory (recursively) for files that contain 'Pattern' in their name.
 
 		Arguments:
 			Dir:	"/my_directory/"
-			Pattern:"pattern_to_match"
+			Pattern:"pattern_to_match" [or a list of them: names have to match all of them]
 			Lacks:   A pattern file needs to lack
-				string
+				string [or a list of them: names can't match any of them]
+			Style:	'substring' (Pattern is in the name), 'glob' ('*.txt') or 'regex'
+			Index_file:	Optional. Keep an index of Dir's tree here. Searching again only
+				re-lists the directories that changed since (see file_search.py), which
+				makes searching the same big tree in a loop a lot quicker.
+			Workers:	Number of threads listing directories at once.
+			Refresh:	With an Index_file, check Dir for changes before searching? True
+				(stats every directory), False (searches the index alone, in milliseconds,
+				but may miss changes), or a number of seconds: only check if the index
+				was last checked longer ago than that. E.g. searching in a loop with
+				Refresh=60 checks the tree at most once a minute.
 
 		Assumptions:
 			Dir is extant
@@ -427,29 +932,28 @@ def grep_for_files(Dir, Pattern, Lacks = ""):
 		Returns:
 			A list of files that matched (full file path!) - will be [] if no matches.
 	"""
-	if type(Dir) is not str or type(Pattern) is not str:
+	if type(Dir) is not str:
+		raise ValueError("Dir and Pattern need to be strings.")
+	if type(Pattern) is str:
+		patterns = [Pattern]
+	elif type(Pattern) is list and all(type(p) is str for p in Pattern):
+		patterns = Pattern
+	else:
 		raise ValueError("Dir and Pattern need to be strings.")
 
 	if not (os.path.isdir(Dir)):
 		raise ValueError(Dir+" not found.")
 
-	if len(Pattern) == 0:
+	if len(patterns) == 0 or min(len(p) for p in patterns) == 0:
 		raise ValueError("Pattern was an empty string. It should not be an empty string.")
 	
-	if not isinstance(Lacks, str):
+	if isinstance(Lacks, list):
+		if not all(isinstance(l, str) for l in Lacks):
+			raise ValueError("Lacks needs to be a string (empty '' is fine)")
+	elif not isinstance(Lacks, str):
 		raise ValueError("Lacks needs to be a string (empty '' is fine)")
 
-	matched_files = list()
-	for root, subdirs, files in os.walk(Dir):
-		# ID files that contain the Pattern
-		for f in files:
-			if Pattern in f:
-				if len(Lacks)>0:
-					# Skip file if i contains the Lacks string
-					if Lacks in f:
-						continue
-				matched_files.append(os.path.join(root,f))
-	return matched_files
+	return file_search.find_files(Dir, patterns, Lacks, Style, Index_file, Workers, Refresh)
 
 def new_sub_dir_file(File_path, Appendage):
 	"""Given a file path, return a new file path in the same directory with an appended text
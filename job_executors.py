@@ -0,0 +1,535 @@
+#/usr/bin/python
+
+# job_executors.py
+# 2016_3_20
+
+### Where the jobs from helper_functions.make_scisub_job_command / make_consign_job_command
+###    (and make_scisub_array_command) run.
+###
+###    LSFExecutor hands the bsub command to LSF, like submit_scisub_job always has.
+###    LocalExecutor runs the same command on this machine instead, on a bounded pool of
+###    processes, so a pipeline built on the submit functions also runs on a laptop or in CI.
+###    It reads the bsub options it needs out of the command: the -e / -o log files (so the
+###    logs end up in the same ErrOutDir, named the same way) and -J job arrays, whose tasks
+###    each get their own LSB_JOBINDEX (and %I in their log names), like on LSF.
+###
+###    The submit functions use default_executor(), which is the one set with
+###    set_default_executor(), else the one named by $JOB_EXECUTOR ('lsf' or 'local'),
+###    else LSF if bsub is on the PATH and local if it isn't.
+###
+###    Submitting gives back a JobHandle per job (per task, for job arrays), with its job ID
+###    (parsed out of what bsub says) and log files. A JobTracker waits for them: every so often
+###    it checks on all the unfinished jobs at once (a single bjobs call for LSF), checking less
+###    often while nothing is finishing. To try it without LSF, see fake_lsf.py.
+
+import sys, os
+import re
+import shlex
+import pipes
+import atexit
+import threading
+import time
+import multiprocessing
+from subprocess import call, Popen, PIPE, STDOUT
+from multiprocessing.pool import ThreadPool
+
+import helper_functions
+
+EXECUTORS = ["lsf", "local"]
+
+# bsub options that take a value (others are flags)
+BSUB_VALUE_OPTIONS = ["-J", "-e", "-o", "-eo", "-oo", "-q", "-n", "-R", "-W", "-M", "-P", "-G",
+	"-u", "-w", "-m", "-g", "-sla", "-app", "-cwd", "-E", "-Ep"]
+# What JobTracker asks bjobs for (bjobs -o, LSF 9.1 and up), and the most job IDs per bjobs call
+BJOBS_FIELDS = "jobid jobindex stat exit_code delimiter='|'"
+BJOBS_MAX_IDS = 500
+# Job states that mean it's finished
+FINISHED_STATES = ["DONE", "EXIT", "LOST"]
+
+
+def parse_job_name(Name):
+	""" Split a bsub -J job name into (name, list of array indices, most tasks to run at once).
+
+		"my_job" -> ("my_job", [0], None)
+		"my_job[1-3,7]%2" -> ("my_job", [1, 2, 3, 7], 2)
+		(ranges can have a step, like LSF's: "my_job[1-9:2]")
+	"""
+	match = re.match(r"^(.*)\[([0-9,\-:]+)\](?:%([0-9]+))?$", Name)
+	if match is None:
+		return Name, [0], None
+	indices = list()
+	for part in match.group(2).split(","):
+		step = 1
+		if ":" in part:
+			part, step = part.split(":")
+			step = int(step)
+		if "-" in part:
+			start, end = part.split("-")
+			indices.extend(range(int(start), int(end)+1, step))
+		else:
+			indices.append(int(part))
+	limit = None
+	if match.group(3) is not None:
+		limit = int(match.group(3))
+	return match.group(1), indices, limit
+
+def parse_bsub_command(Command):
+	""" Pull a bsub command apart.
+
+		Arguments:
+			Command:	"bsub -e my.err -o my.out -q voight_normal python my_script.py arg"
+
+		Returns: dict with
+			"name", "indices", "limit": see parse_job_name (name defaults to the command's first word)
+			"err", "out": the -e / -o log files (None if not given; -eo / -oo count too)
+			"queue": the -q queue (None if not given)
+			"command": the command the job runs, "python my_script.py arg"
+	"""
+	words = shlex.split(Command)
+	if len(words) == 0 or words[0] != "bsub":
+		raise ValueError("Not a bsub command: "+Command)
+	options = dict()
+	i = 1
+	while i < len(words) and words[i].startswith("-"):
+		if words[i] in BSUB_VALUE_OPTIONS:
+			if i+1 == len(words):
+				raise ValueError(words[i]+" needs a value in: "+Command)
+			options[words[i]] = words[i+1]
+			i += 2
+		else:
+			i += 1
+	if i == len(words):
+		raise ValueError("No command to run in: "+Command)
+	# (the command's words go back together as they were split, so quoting survives)
+	command = " ".join(pipes.quote(word) for word in words[i:])
+	name, indices, limit = parse_job_name(options.get("-J", words[i]))
+	return {"name": name, "indices": indices, "limit": limit,
+		"err": options.get("-e", options.get("-eo")), "out": options.get("-o", options.get("-oo")),
+		"queue": options.get("-q"), "command": command}
+
+def log_file(Template, Job_id, Index):
+	""" Fill in a -e / -o log file name the way LSF does (%J: job ID, %I: array index).
+	"""
+	return Template.replace("%J", str(Job_id)).replace("%I", str(Index))
+
+
+class JobHandle(object):
+	""" A submitted job, or one task of a job array (from an executor's submit).
+
+		Attributes:
+			executor:	the executor it was submitted to
+			job_id:		its ID (LSF's, for LSF jobs)
+			index:		its index in its job array (0 if it isn't in one)
+			name:		its name (bsub -J, without the array part)
+			err, out:	full paths of its -e / -o log files (None if it has none)
+			status:		its state when it was last checked on: LSF's PEND, RUN, DONE, EXIT, ...
+							or LOST if LSF doesn't know about it anymore
+			exit_code:	its exit code, once it's finished (None if that isn't known)
+	"""
+	def __init__(self, Executor, Job_id, Index, Name, Err, Out):
+		self.executor = Executor
+		self.job_id = Job_id
+		self.index = Index
+		self.name = Name
+		self.err = Err
+		self.out = Out
+		self.status = "PEND"
+		self.exit_code = None
+
+	def done(self):
+		""" Has it finished (one way or another)?
+		"""
+		return self.status in FINISHED_STATES
+
+	def failed(self):
+		""" Did it finish with anything but a 0 exit code (or get lost)?
+		"""
+		return self.done() and (self.status != "DONE" or self.exit_code not in [0, None])
+
+	def label(self):
+		""" "12" for job 12, "12[3]" for task 3 of job array 12.
+		"""
+		if self.index == 0:
+			return str(self.job_id)
+		return str(self.job_id)+"["+str(self.index)+"]"
+
+	def describe(self):
+		""" One line about how it went, with its log files.
+		"""
+		text = "Job "+self.label()+" ("+self.name+"): "+self.status
+		if self.exit_code is not None:
+			text += ", exit code "+str(self.exit_code)
+		if self.err is not None or self.out is not None:
+			text += ". Logs: "+", ".join([str(self.err), str(self.out)])
+		return text
+
+	def __repr__(self):
+		return "<JobHandle "+self.label()+" "+self.status+">"
+
+def make_handles(Executor, Job_id, Job, Cwd):
+	""" A JobHandle for each task of a parsed bsub command (from parse_bsub_command).
+	"""
+	handles = list()
+	for index in Job["indices"]:
+		logs = list()
+		for template in [Job["err"], Job["out"]]:
+			if template is None:
+				logs.append(None)
+			else:
+				logs.append(os.path.join(Cwd, log_file(template, Job_id, index)))
+		handles.append(JobHandle(Executor, Job_id, index, Job["name"], logs[0], logs[1]))
+	return handles
+
+
+class LSFExecutor(object):
+	""" Submit jobs to LSF with bsub (what submit_scisub_job / submit_consign_job always did).
+	"""
+	name = "lsf"
+
+	def submit(self, Command):
+		""" Run a bsub command (bsub's message is passed on to stdout).
+
+			Returns: list of JobHandles, one per task (just one, unless it's a job array)
+		"""
+		job = parse_bsub_command(Command)
+		process = Popen([Command], shell=True, stdout=PIPE, stderr=STDOUT)
+		output = process.communicate()[0]
+		sys.stdout.write(output)
+		match = re.search(r"Job <([0-9]+)> is submitted", output)
+		if process.returncode != 0 or match is None:
+			raise Exception("bsub didn't take the job (exit code "+str(process.returncode)+"): "
+				+output.strip())
+		return make_handles(self, int(match.group(1)), job, os.getcwd())
+
+	def poll(self, Handles):
+		""" Update the status of Handles (all of them, with one bjobs call).
+
+			Jobs bjobs says it doesn't know (LSF forgets finished jobs after a while) are LOST.
+			If bjobs doesn't answer at all, nothing changes (try again later).
+		"""
+		job_ids = sorted(set(handle.job_id for handle in Handles))
+		states = dict()
+		not_found = set()
+		# (a few hundred IDs at a time, to keep the command line short)
+		for k in range(0, len(job_ids), BJOBS_MAX_IDS):
+			process = Popen(["bjobs", "-a", "-noheader", "-o", BJOBS_FIELDS]
+				+[str(job_id) for job_id in job_ids[k:k+BJOBS_MAX_IDS]], stdout=PIPE, stderr=PIPE)
+			output, errors = process.communicate()
+			for line in output.splitlines():
+				fields = line.strip().split("|")
+				if len(fields) != 4 or not fields[0].isdigit():
+					continue
+				job_id, index, status, exit_code = fields
+				if index.isdigit():
+					index = int(index)
+				else:
+					index = 0
+				states[(int(job_id), index)] = (status, exit_code)
+			for job_id, index in re.findall(r"Job <([0-9]+)(?:\[([0-9]+)\])?> is not found", errors):
+				not_found.add((int(job_id), int(index or 0)))
+		for handle in Handles:
+			if (handle.job_id, handle.index) in states:
+				handle.status, exit_code = states[(handle.job_id, handle.index)]
+				if exit_code.isdigit():
+					handle.exit_code = int(exit_code)
+				elif handle.status == "DONE":
+					handle.exit_code = 0
+			elif (handle.job_id, handle.index) in not_found or (handle.job_id, 0) in not_found:
+				handle.status = "LOST"
+
+	def wait(self, Job_ids=None):
+		""" LSF keeps track of its own jobs, so there is nothing to wait for here
+			(see JobTracker to wait for them).
+		"""
+		return dict()
+
+class LocalExecutor(object):
+	""" Run bsub commands on this machine, at most Workers processes at a time.
+
+		Arguments:
+			Workers:	Optional integer > 0. Most jobs to run at once. Defaults to the
+							number of cores.
+
+		Each job's stderr / stdout are appended to its -e / -o log files, like LSF does
+			(or go to this process's, if it has none). Jobs run with /bin/sh from the current
+			directory, with LSB_JOBID and LSB_JOBINDEX set (LSB_JOBINDEX is 0 unless the job
+			is a task of a job array). Job arrays run at most their %limit tasks at once.
+
+		submit() returns right away with the job's handles; wait() waits for the jobs and
+			gives their exit codes.
+	"""
+	name = "local"
+
+	def __init__(self, Workers=None):
+		if Workers is None:
+			Workers = multiprocessing.cpu_count()
+		if type(Workers) is not int or Workers < 1:
+			raise ValueError("Workers needs to be an integer > 0.")
+		self.workers = Workers
+		self.pool = None
+		self.lock = threading.Lock()
+		self.next_id = 1
+		# job ID -> dict of array index -> pool result (its exit code)
+		self.jobs = dict()
+		# (job ID, index) of the tasks that have started running
+		self.started = set()
+
+	def submit(self, Command):
+		""" Start running a bsub command's job (each of its tasks, for a job array).
+
+			Returns: list of JobHandles, one per task (just one, unless it's a job array).
+				Job IDs count up from 1.
+		"""
+		job = parse_bsub_command(Command)
+		if job["limit"] is not None:
+			slots = threading.BoundedSemaphore(job["limit"])
+		else:
+			slots = None
+		with self.lock:
+			if self.pool is None:
+				self.pool = ThreadPool(self.workers)
+			job_id = self.next_id
+			self.next_id += 1
+			tasks = dict()
+			for index in job["indices"]:
+				tasks[index] = self.pool.apply_async(_run_task,
+					(job, job_id, index, os.getcwd(), slots, self.started))
+			self.jobs[job_id] = tasks
+		return make_handles(self, job_id, job, os.getcwd())
+
+	def poll(self, Handles):
+		""" Update the status of Handles.
+		"""
+		for handle in Handles:
+			result = self.jobs[handle.job_id][handle.index]
+			if result.ready():
+				handle.exit_code = result.get()
+				if handle.exit_code == 0:
+					handle.status = "DONE"
+				else:
+					handle.status = "EXIT"
+			elif (handle.job_id, handle.index) in self.started:
+				handle.status = "RUN"
+
+	def wait(self, Job_ids=None):
+		""" Wait for jobs to finish.
+
+			Arguments:
+				Job_ids:	Optional list of job IDs (from submit's handles). Defaults to
+								every job submitted so far.
+
+			Returns: dict of job ID -> dict of array index -> exit code (index 0 if the
+				job isn't an array). Jobs that were killed by a signal have a negative
+				exit code, -signal (like subprocess's).
+		"""
+		if Job_ids is None:
+			with self.lock:
+				Job_ids = sorted(self.jobs)
+		exit_codes = dict()
+		for job_id in Job_ids:
+			if job_id not in self.jobs:
+				raise ValueError("No job "+str(job_id)+" was submitted to this executor.")
+			exit_codes[job_id] = dict((index, result.get())
+				for index, result in self.jobs[job_id].items())
+		return exit_codes
+
+	def close(self):
+		""" Wait for every job, then stop the pool.
+		"""
+		with self.lock:
+			pool = self.pool
+			self.pool = None
+		if pool is not None:
+			pool.close()
+			pool.join()
+
+def _run_task(Job, Job_id, Index, Cwd, Slots, Started):
+	""" Run one task of a job (from LocalExecutor.submit) and return its exit code.
+	"""
+	if Slots is not None:
+		Slots.acquire()
+	try:
+		Started.add((Job_id, Index))
+		env = dict(os.environ)
+		env["LSB_JOBID"] = str(Job_id)
+		env["LSB_JOBINDEX"] = str(Index)
+		handles = list()
+		try:
+			for template in [Job["out"], Job["err"]]:
+				if template is None:
+					handles.append(None)
+				else:
+					handles.append(open(os.path.join(Cwd, log_file(template, Job_id, Index)), 'ab'))
+			return call(["/bin/sh", "-c", Job["command"]], cwd=Cwd, env=env,
+				stdout=handles[0], stderr=handles[1], close_fds=True)
+		finally:
+			for handle in handles:
+				if handle is not None:
+					handle.close()
+	finally:
+		if Slots is not None:
+			Slots.release()
+
+
+class JobTracker(object):
+	""" Wait for submitted jobs, checking on all the unfinished ones at once (one bjobs call,
+		for LSF jobs) every so often.
+
+		Arguments:
+			Handles:		Optional list of JobHandles (from submit). More can be add()ed.
+			Interval:		seconds between checks, to start with
+			Max_interval:	most seconds between checks
+			Backoff:		number >= 1. After a check where nothing finished, the next one
+								waits this many times longer (up to Max_interval). Once something
+								finishes, it's back to Interval.
+
+		Example usage:
+			tracker = JobTracker(submit_scisub_job(command) + submit_scisub_job(other_command))
+			failed, unfinished = tracker.wait_all()
+			for handle in failed:
+				print handle.describe()
+	"""
+	def __init__(self, Handles=None, Interval=5, Max_interval=120, Backoff=1.5):
+		if Interval <= 0 or Max_interval < Interval:
+			raise ValueError("Interval needs to be > 0, and Max_interval at least Interval.")
+		if Backoff < 1:
+			raise ValueError("Backoff needs to be >= 1.")
+		self.interval = Interval
+		self.max_interval = Max_interval
+		self.backoff = Backoff
+		self.wait_secs = Interval
+		self.handles = list()
+		if Handles is not None:
+			self.add(Handles)
+
+	def add(self, Handles):
+		""" Keep track of more JobHandles (a handle, or a list of them).
+		"""
+		if isinstance(Handles, JobHandle):
+			Handles = [Handles]
+		self.handles.extend(Handles)
+
+	def pending(self):
+		""" The handles that haven't finished (as of the last check).
+		"""
+		return [handle for handle in self.handles if not handle.done()]
+
+	def failures(self):
+		""" The handles that finished without an exit code of 0 (as of the last check).
+		"""
+		return [handle for handle in self.handles if handle.failed()]
+
+	def poll(self):
+		""" Check on every unfinished job: one query per executor.
+
+			Returns: list of the handles that finished since the last check
+		"""
+		pending = self.pending()
+		# id of executor -> (executor, its handles)
+		by_executor = dict()
+		for handle in pending:
+			key = id(handle.executor)
+			if key not in by_executor:
+				by_executor[key] = (handle.executor, list())
+			by_executor[key][1].append(handle)
+		for executor, handles in by_executor.values():
+			executor.poll(handles)
+		return [handle for handle in pending if handle.done()]
+
+	def next_wait(self, Finished):
+		""" Seconds to wait before the next check, after one where Finished jobs finished.
+		"""
+		if Finished > 0:
+			self.wait_secs = self.interval
+		else:
+			self.wait_secs = min(self.wait_secs*self.backoff, self.max_interval)
+		return self.wait_secs
+
+	def as_completed(self, Timeout=None):
+		""" Yield each handle as its job finishes (the ones that already had, first).
+
+			Arguments:
+				Timeout:	Optional. Stop after this many seconds, even if jobs are left.
+		"""
+		start = time.time()
+		for handle in self.handles:
+			if handle.done():
+				yield handle
+		# (the first check waits Interval)
+		self.wait_secs = self.interval/float(self.backoff)
+		while True:
+			finished = self.poll()
+			for handle in finished:
+				yield handle
+			if len(self.pending()) == 0:
+				return
+			wait = self.next_wait(len(finished))
+			if Timeout is not None:
+				left = Timeout-(time.time()-start)
+				if left <= 0:
+					return
+				wait = min(wait, left)
+			time.sleep(wait)
+
+	def wait_all(self, Timeout=None):
+		""" Wait for every job to finish.
+
+			Arguments:
+				Timeout:	Optional. Give up after this many seconds.
+
+			Returns: (list of handles that failed, list of handles that hadn't finished
+				by Timeout)
+		"""
+		for handle in self.as_completed(Timeout):
+			pass
+		return self.failures(), self.pending()
+
+	def report_failures(self):
+		""" Print a line about each job that failed, with its log files. Returns how many.
+		"""
+		failed = self.failures()
+		for handle in failed:
+			print handle.describe()
+		return len(failed)
+
+
+_DEFAULT = [None]
+# default LocalExecutors that get waited on at exit
+_CLOSE_AT_EXIT = list()
+
+def make_executor(Name, Workers=None):
+	""" An executor by name: 'lsf' or 'local' (with Workers, see LocalExecutor).
+	"""
+	if Name == "lsf":
+		return LSFExecutor()
+	elif Name == "local":
+		return LocalExecutor(Workers)
+	raise ValueError("Executor needs to be one of "+str(EXECUTORS)+", not: "+str(Name))
+
+def set_default_executor(Executor):
+	""" Use Executor (an LSFExecutor / LocalExecutor, or 'lsf' / 'local') for jobs submitted
+		without one. Returns it.
+	"""
+	if type(Executor) is str:
+		Executor = make_executor(Executor)
+	_DEFAULT[0] = Executor
+	return Executor
+
+def default_executor():
+	""" The executor jobs are submitted to when none is given (see the top of this file).
+
+		A local default executor is waited on when python exits, so jobs submitted with it
+			finish (like they would have on LSF) even if nothing waits for them.
+	"""
+	if _DEFAULT[0] is None:
+		name = os.environ.get("JOB_EXECUTOR")
+		if name is None:
+			if helper_functions.which("bsub") is not None:
+				name = "lsf"
+			else:
+				name = "local"
+		set_default_executor(make_executor(name))
+	if isinstance(_DEFAULT[0], LocalExecutor) and _DEFAULT[0] not in _CLOSE_AT_EXIT:
+		_CLOSE_AT_EXIT.append(_DEFAULT[0])
+		atexit.register(_DEFAULT[0].close)
+	return _DEFAULT[0]
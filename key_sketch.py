@@ -0,0 +1,311 @@
+#/usr/bin/python
+
+# key_sketch.py
+# 2016_3_26
+
+### A quick look at a column's keys before partitioning by it: about how many distinct keys
+###    there are (HyperLogLog) and which keys have the most lines (heavy hitters), in a fixed
+###    amount of memory however many keys there are, and a recommendation of how to run
+###    col_grep.py on it (a file per key, hash buckets, or --aggregate).
+###
+###    HyperLogLog: each key is hashed; the first Precision bits of the hash pick a register,
+###    which keeps the most leading zeros seen in the rest of the bits. 2**Precision registers
+###    (16384 bytes at the default 14) estimate the number of distinct keys to within about
+###    1.04/sqrt(2**Precision) (0.8%).
+###
+###    Heavy hitters: Misra-Gries (the batch-mergeable form of space-saving) keeps counts of at
+###    most Capacity keys. Lines are counted a batch at a time; whenever more than Capacity keys
+###    are held, the (Capacity+1)th biggest count is taken off every key, and keys that get to 0
+###    are dropped. Any key with more than lines/(Capacity+1) lines is sure to be kept, and its
+###    count is at most that much too low.
+###
+###    Sampling: with Sample < 1, each line is looked at with probability Sample (the lines in
+###    between are still read, but not split or hashed). Counts of heavy hitters are scaled up
+###    by 1/Sample. The number of distinct keys can't be scaled like that, so it's given as a
+###    range: at least as many as were seen, at most that many divided by Sample.
+
+import math
+import random
+import hashlib
+import itertools
+
+import helper_functions
+import partition_functions
+
+# Registers of a HyperLogLog are 2**Precision
+PRECISION = 14
+# Most keys the heavy hitters summary keeps
+CAPACITY = 1000
+# Lines counted at a time
+BATCH_LINES = 65536
+# More groups than this is too many files for one directory (and most file systems)
+MAX_GROUP_FILES = 10000
+# Groups with fewer lines than this on average are better summarized (--aggregate) than written
+MIN_GROUP_LINES = 4
+# About how many groups to put in each hash bucket, when recommending --buckets
+GROUPS_PER_BUCKET = 1000
+
+def key_hash(Key):
+	""" A 64 bit hash of a key (the first 8 bytes of its md5, so it's the same on every machine
+		and python).
+	"""
+	return int(hashlib.md5(Key).hexdigest()[:16], 16)
+
+class HyperLogLog(object):
+	""" Estimates how many distinct keys have been added.
+
+		Arguments:
+			Precision:	integer from 4 to 18. Uses 2**Precision bytes.
+	"""
+	def __init__(self, Precision=PRECISION):
+		if type(Precision) is not int or not 4 <= Precision <= 18:
+			raise ValueError("Precision needs to be an integer from 4 to 18.")
+		self.precision = Precision
+		self.m = 1 << Precision
+		self.registers = bytearray(self.m)
+
+	def add(self, Keys):
+		""" Add each of Keys (an iterable of strings; repeats are fine, but cost time).
+		"""
+		registers = self.registers
+		shift = 64-self.precision
+		low_mask = (1 << shift)-1
+		for key in Keys:
+			x = key_hash(key)
+			index = x >> shift
+			# (leading zeros of the other bits, plus 1)
+			rank = shift-(x & low_mask).bit_length()+1
+			if rank > registers[index]:
+				registers[index] = rank
+
+	def merge(self, Other):
+		""" Add in the keys of another HyperLogLog of the same Precision.
+		"""
+		if Other.precision != self.precision:
+			raise ValueError("Can only merge HyperLogLogs of the same Precision.")
+		for k in range(self.m):
+			if Other.registers[k] > self.registers[k]:
+				self.registers[k] = Other.registers[k]
+
+	def estimate(self):
+		""" About how many distinct keys were added.
+		"""
+		m = float(self.m)
+		if self.m >= 128:
+			alpha = 0.7213/(1+1.079/m)
+		else:
+			alpha = {16: 0.673, 32: 0.697, 64: 0.709}[self.m]
+		total = 0.0
+		zeros = 0
+		for rank in self.registers:
+			total += 2.0**-rank
+			if rank == 0:
+				zeros += 1
+		estimate = alpha*m*m/total
+		# Few keys: linear counting (of the registers still 0) is more accurate
+		if estimate <= 2.5*m and zeros > 0:
+			estimate = m*math.log(m/zeros)
+		return int(round(estimate))
+
+class HeavyHitters(object):
+	""" Keeps the keys with the most lines (Misra-Gries), and about how many they have.
+
+		Arguments:
+			Capacity:	integer > 0. Most keys to keep.
+	"""
+	def __init__(self, Capacity=CAPACITY):
+		if type(Capacity) is not int or Capacity < 1:
+			raise ValueError("Capacity needs to be an integer > 0.")
+		self.capacity = Capacity
+		self.counts = dict()
+		# Lines added, and the most any count can be too low by
+		self.n = 0
+		self.error = 0
+
+	def add_counts(self, Counts):
+		""" Add a dict of key -> number of lines (e.g. of a batch).
+		"""
+		counts = self.counts
+		for key, count in Counts.iteritems():
+			if key in counts:
+				counts[key] += count
+			else:
+				counts[key] = count
+			self.n += count
+		if len(counts) > self.capacity:
+			cut = sorted(counts.itervalues(), reverse=True)[self.capacity]
+			self.error += cut
+			self.counts = dict((key, count-cut) for key, count in counts.iteritems() if count > cut)
+
+	def top(self, N=None):
+		""" The N (default all kept) keys with the most lines, as (key, at least this many lines)
+			biggest first. Each has at most error more lines than that.
+		"""
+		ranked = sorted(self.counts.iteritems(), key=lambda item: (-item[1], item[0]))
+		if N is not None:
+			ranked = ranked[:N]
+		return ranked
+
+def sampled_lines(Handle, Sample=1.0, Seed=0):
+	""" Yield each line of an open file with probability Sample (lines in between are read,
+		but skipped in C).
+	"""
+	if Sample >= 1.0:
+		for line in Handle:
+			yield line
+		return
+	rng = random.Random(Seed)
+	log_keep = math.log(1.0-Sample)
+	while True:
+		# (lines skipped before the next one kept: geometric, like a coin flip per line)
+		skip = int(math.log(1.0-rng.random())/log_keep)
+		line = next(itertools.islice(Handle, skip, None), None)
+		if line is None:
+			return
+		yield line
+
+def prescan(In_file, Delim, Skip, Column_index, Sample=1.0, Max_lines=None, Precision=PRECISION,
+	Capacity=CAPACITY, Top=20, Seed=0):
+	""" Estimate how many distinct keys a column has, and find the keys with the most lines,
+		in fixed memory (see the top of this file).
+
+		Arguments:
+			In_file:		"/my_directory/my_file.txt" (may be gzip or zstd compressed)
+			Delim:			the actual delimiter character (e.g. '\\t', not 'tab')
+			Skip:			integer >= 0. How many lines at the top to skip?
+			Column_index:	integer >= 0. Which column to look at? (0 is first column)
+			Sample:			number in (0, 1]. Fraction of lines to look at.
+			Max_lines:		Optional integer > 0. Stop after looking at this many lines
+							(the estimates are then only of the top of the file).
+			Precision:		see HyperLogLog
+			Capacity:		see HeavyHitters
+			Top:			integer > 0. How many of the biggest keys to report.
+			Seed:			for the sampling
+
+		Returns: dict of
+			"lines_seen": lines looked at, "lines": about how many lines were read (all of
+				them, unless Max_lines stopped it early), "complete": whether the whole file was
+				read, "sample": Sample,
+			"distinct_seen": about how many distinct keys were in the lines looked at,
+			"distinct_low", "distinct_high": range of about how many there are in all,
+			"top": list of (key, about how many lines) of the biggest keys, biggest first,
+			"top_error": the most those line counts can be off by
+	"""
+	if type(Skip) is not int or Skip < 0:
+		raise ValueError("Skip needs to be an integer >= 0.")
+	if type(Column_index) is not int or Column_index < 0:
+		raise ValueError("Column_index needs to be an integer >= 0.")
+	if type(Sample) not in [int, float] or not 0 < Sample <= 1:
+		raise ValueError("Sample needs to be a number in (0, 1].")
+	if Max_lines is not None and (type(Max_lines) is not int or Max_lines < 1):
+		raise ValueError("Max_lines needs to be an integer > 0.")
+	if type(Top) is not int or Top < 1:
+		raise ValueError("Top needs to be an integer > 0.")
+	hll = HyperLogLog(Precision)
+	hitters = HeavyHitters(Capacity)
+	n_seen = 0
+	complete = True
+	with helper_functions.open_file(In_file, 'rb') as handle:
+		partition_functions.skip_lines(handle, Skip)
+		keyed = partition_functions.keyed_lines(sampled_lines(handle, Sample, Seed), Delim,
+			Column_index, Skip)
+		while True:
+			batch_lines = BATCH_LINES
+			if Max_lines is not None:
+				batch_lines = min(batch_lines, Max_lines-n_seen)
+				if batch_lines == 0:
+					complete = next(keyed, None) is None
+					break
+			counts = dict()
+			n = 0
+			for key, line in itertools.islice(keyed, batch_lines):
+				if key in counts:
+					counts[key] += 1
+				else:
+					counts[key] = 1
+				n += 1
+			if n == 0:
+				break
+			n_seen += n
+			# (each distinct key of the batch is only hashed once)
+			hll.add(counts.iterkeys())
+			hitters.add_counts(counts)
+	distinct = hll.estimate()
+	scale = 1.0/Sample
+	n_lines = int(round(n_seen*scale))
+	return {"lines_seen": n_seen, "lines": n_lines, "complete": complete, "sample": Sample,
+		"distinct_seen": distinct, "distinct_low": distinct,
+		"distinct_high": max(distinct, min(int(round(distinct*scale)), n_lines)),
+		"top": [(key, int(round(count*scale))) for key, count in hitters.top(Top)],
+		"top_error": int(round(hitters.error*scale))}
+
+def recommend(Scan, Max_open=None):
+	""" Recommend how to partition, from a prescan.
+
+		Arguments:
+			Scan:		dict from prescan
+			Max_open:	Optional. Files that can be kept open at once (see
+						partition_functions.default_max_open)
+
+		Returns: (mode, col_grep.py options to use, list of reasons), where mode is 'files'
+			(a file per key), 'buckets' (--buckets) or 'aggregate' (--aggregate)
+	"""
+	if Max_open is None:
+		Max_open = partition_functions.default_max_open()
+	reasons = []
+	low = Scan["distinct_low"]
+	high = Scan["distinct_high"]
+	lines = max(Scan["lines"], 1)
+	if high > low:
+		reasons.append("Somewhere between "+str(low)+" and "+str(high)+" distinct keys (only a sample"
+			" of lines was looked at).")
+	else:
+		reasons.append("About "+str(low)+" distinct keys.")
+	# (with a sample, go by the most keys there could be)
+	if Scan["lines"] > 0 and lines/float(max(high, 1)) < MIN_GROUP_LINES:
+		reasons.append("That's fewer than "+str(MIN_GROUP_LINES)+" lines per key on average, so a file"
+			" per key would mostly be tiny files. Summarize them instead.")
+		mode = "aggregate"
+		options = "--aggregate --value_columns <columns to sum up>"
+	elif high > MAX_GROUP_FILES:
+		buckets = max(16, min(Max_open, int(math.ceil(high/float(GROUPS_PER_BUCKET)))))
+		reasons.append("More than "+str(MAX_GROUP_FILES)+" files is too many for one directory."
+			" Hash the keys into "+str(buckets)+" bucket files instead (about "
+			+str(int(math.ceil(high/float(buckets))))+" keys each, each key's lines can be pulled"
+			" back out with partition_functions.bucket_key_lines).")
+		mode = "buckets"
+		options = "--buckets "+str(buckets)
+	else:
+		mode = "files"
+		options = ""
+		if high > Max_open:
+			reasons.append("More keys than the "+str(Max_open)+" files that can be kept open at once,"
+				" so files will be closed and reopened. Buffering lines cuts down on that.")
+			options = "--buffer_mb 512"
+	if len(Scan["top"]) > 0:
+		key, count = Scan["top"][0]
+		share = count/float(lines)
+		if share > 0.5:
+			reasons.append("Key "+repr(key)+" has about "+str(int(round(100*share)))+"% of the lines,"
+				" so its file will be most of the output (and the slowest part of --engine bsub).")
+	return mode, options, reasons
+
+def print_prescan(Scan, Recommendation, Show=10):
+	""" Print a prescan and its recommendation.
+	"""
+	mode, options, reasons = Recommendation
+	print "=============="
+	if Scan["complete"]:
+		print "Looked at "+str(Scan["lines_seen"])+" of about "+str(Scan["lines"])+" lines."
+	else:
+		print ("Looked at "+str(Scan["lines_seen"])+" lines from the top of the file (stopped early,"
+			" so this is only of the top of the file).")
+	if len(Scan["top"]) == 0:
+		print "No key has more than about "+str(Scan["top_error"])+" lines."
+	else:
+		print "Biggest keys (lines, each at most "+str(Scan["top_error"])+" too low):"
+		for key, count in Scan["top"][:Show]:
+			print "\t"+key+"\t"+str(count)
+	print "Recommended: "+mode+("" if len(options) == 0 else " ("+options+")")
+	for reason in reasons:
+		print "\t"+reason
@@ -0,0 +1,1096 @@
+#/usr/bin/python
+
+# partition_functions.py
+# 2016_2_20
+
+### Functions for splitting a delimited file into one file per group (see col_grep.py)
+
+import sys
+import os
+import re
+import math
+import heapq
+import hashlib
+import cPickle
+import zlib
+import mmap
+import time
+import resource
+import shutil
+import multiprocessing
+from collections import OrderedDict
+
+import helper_functions
+import gzip_index
+
+# Name of the sidecar index written in hash bucket mode
+BUCKET_INDEX = "bucket_index.txt"
+# Name of the checkpoint incremental_partition keeps in the out dir
+CHECKPOINT = ".col_grep_checkpoint"
+# How much of the input (at its start, and just before the checkpoint) is checksummed
+CHECKSUM_BYTES = 1024*1024
+
+
+def default_max_open():
+	""" How many output files can we safely keep open at once?
+
+		Half of the soft file descriptor limit (leaves room for everything else the
+			process has open), capped at 1024.
+	"""
+	soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+	if soft == resource.RLIM_INFINITY or soft <= 0:
+		return 1024
+	return max(1, min(soft // 2, 1024))
+
+def group_file_path(Out_dir, Group, Folderize, Compress=None):
+	"""Return the path of the file a group's lines are written to.
+
+		Arguments:
+			Out_dir:	"/my_out_directory/"
+			Group:		the group name (the value from the column of interest)
+			Folderize:	'y_fold' (out_dir/group/group) or 'n_fold' (out_dir/group)
+			Compress:	None, 'gz' or 'bgzf'. Compressed group files end in .gz
+	"""
+	if Compress is None:
+		name = Group
+	else:
+		name = Group+".gz"
+	if Folderize == "y_fold":
+		return os.path.join(Out_dir, Group, name)
+	elif Folderize == "n_fold":
+		return os.path.join(Out_dir, name)
+	raise ValueError("Folderize needs to be 'y_fold' or 'n_fold', not: "+str(Folderize))
+
+class HandlePool(object):
+	""" A bounded pool of open output files.
+
+		When more than Max_open files are wanted at once, the least recently used file
+			is closed. A file is truncated the first time it is opened, and re-opened in
+			append mode after it has been evicted, so any number of files can be written
+			to with a fixed number of file descriptors.
+
+		Compress: None, 'gz' or 'bgzf' (see helper_functions.open_file). Re-opened gzip files
+			get a new gzip member appended, which gzip readers handle fine.
+	"""
+	def __init__(self, Max_open=None, Compress=None):
+		if Max_open is None:
+			Max_open = default_max_open()
+		if type(Max_open) is not int or Max_open < 1:
+			raise ValueError("Max_open needs to be an integer > 0.")
+		self.max_open = Max_open
+		self.compress = Compress
+		self.handles = OrderedDict()
+		self.seen = set()
+		# Files opened since touched was last cleared
+		self.touched = set()
+		self.n_opens = 0
+		self.n_evictions = 0
+
+	def get(self, Path):
+		""" Return an open, writable handle for Path.
+		"""
+		handle = self.handles.pop(Path, None)
+		if handle is None:
+			if len(self.handles) >= self.max_open:
+				old_path, old_handle = self.handles.popitem(last=False)
+				old_handle.close()
+				self.n_evictions += 1
+			if Path in self.seen:
+				handle = helper_functions.open_file(Path, 'ab', self.compress)
+			else:
+				handle = helper_functions.open_file(Path, 'wb', self.compress)
+				self.seen.add(Path)
+			self.n_opens += 1
+			self.touched.add(Path)
+		# Most recently used goes to the end
+		self.handles[Path] = handle
+		return handle
+
+	def close_all(self):
+		for handle in self.handles.itervalues():
+			handle.close()
+		self.handles.clear()
+
+class BufferedGroupWriter(object):
+	""" Holds lines in memory per output file, and writes them out in big chunks.
+
+		Writing each line straight to its file means lots of tiny writes, and (once there
+			are more files than a HandlePool keeps open) opening and closing files all the
+			time, which shared file systems are slow at. Instead, lines are kept in a
+			buffer per file until the buffers hold Cap_bytes in all. Then the biggest
+			buffers are written out (one write each) until they hold at most half of
+			Cap_bytes, so files with lots of lines get written in big pieces and files
+			with few lines are only opened now and then.
+
+		Arguments:
+			Pool:		the HandlePool to write through
+			Cap_bytes:	integer > 0. Most bytes of lines to hold in memory at once.
+
+		Attributes (for tuning Cap_bytes):
+			n_flushes:		number of (one per file) writes
+			bytes_flushed:	bytes written
+			n_cap_hits:		times the buffers got full
+			max_flush:		biggest single write (bytes)
+	"""
+	def __init__(self, Pool, Cap_bytes):
+		if type(Cap_bytes) not in [int, long] or Cap_bytes < 1:
+			raise ValueError("Cap_bytes needs to be an integer > 0.")
+		self.pool = Pool
+		self.cap_bytes = Cap_bytes
+		# path -> list of lines
+		self.buffers = dict()
+		# path -> bytes in its buffer
+		self.sizes = dict()
+		self.n_bytes = 0
+		self.n_flushes = 0
+		self.bytes_flushed = 0
+		self.n_cap_hits = 0
+		self.max_flush = 0
+
+	def write(self, Path, Line):
+		""" Add Line to Path's buffer, writing out buffers if that fills them up.
+		"""
+		# (mmap_keyed_lines gives buffers into a map that may be closed before the flush)
+		if type(Line) is not str:
+			Line = str(Line)
+		buffer = self.buffers.get(Path)
+		if buffer is None:
+			self.buffers[Path] = [Line]
+			self.sizes[Path] = len(Line)
+		else:
+			buffer.append(Line)
+			self.sizes[Path] += len(Line)
+		self.n_bytes += len(Line)
+		if self.n_bytes >= self.cap_bytes:
+			self.n_cap_hits += 1
+			self.flush_largest(self.cap_bytes//2)
+
+	def flush_path(self, Path):
+		""" Write out Path's buffer in one go.
+		"""
+		chunk = "".join(self.buffers.pop(Path))
+		del self.sizes[Path]
+		self.pool.get(Path).write(chunk)
+		self.n_bytes -= len(chunk)
+		self.n_flushes += 1
+		self.bytes_flushed += len(chunk)
+		self.max_flush = max(self.max_flush, len(chunk))
+
+	def flush_largest(self, Target_bytes):
+		""" Write out the biggest buffers until the rest hold at most Target_bytes.
+		"""
+		for path in sorted(self.sizes, key=self.sizes.get, reverse=True):
+			if self.n_bytes <= Target_bytes:
+				break
+			self.flush_path(path)
+
+	def flush(self):
+		""" Write out every buffer (in path order, so files are written in a steady order).
+		"""
+		for path in sorted(self.buffers):
+			self.flush_path(path)
+
+def bucket_of(Key, Buckets):
+	""" Which of Buckets hash buckets does Key go in?
+
+		Uses crc32, so a key always lands in the same bucket (across runs, machines,
+			and python versions).
+	"""
+	return (zlib.crc32(Key) & 0xffffffff) % Buckets
+
+def bucket_name(Bucket, Buckets):
+	""" File name of a hash bucket, e.g. bucket_0007 (zero-padded so they sort).
+	"""
+	return "bucket_"+str(Bucket).zfill(len(str(Buckets-1)))
+
+def write_bucket_index(Out_dir, Group_counts, Buckets):
+	""" Write the sidecar index of a hash bucket partition: Out_dir/bucket_index.txt
+
+		Format (tab-delimited):
+			#buckets	N
+			key	bucket_file_name	number_of_lines
+		Keys are sorted.
+	"""
+	with open(os.path.join(Out_dir, BUCKET_INDEX), 'wb') as handle:
+		handle.write("#buckets\t"+str(Buckets)+"\n")
+		for key in sorted(Group_counts):
+			handle.write(key+"\t"+bucket_name(bucket_of(key, Buckets), Buckets)+"\t"
+				+str(Group_counts[key])+"\n")
+
+def read_bucket_index(Out_dir):
+	""" Read the sidecar index of a hash bucket partition.
+
+		Returns: (number of buckets, dict of key -> (bucket file name, number of lines))
+	"""
+	keys = dict()
+	with open(os.path.join(Out_dir, BUCKET_INDEX), 'rb') as handle:
+		buckets = int(handle.readline().rstrip('\r\n').split('\t')[1])
+		for line in handle:
+			key, name, count = line.rstrip('\r\n').split('\t')
+			keys[key] = (name, int(count))
+	return buckets, keys
+
+def bucket_key_lines(Out_dir, Key, Delim, Column_index, Folderize="n_fold"):
+	""" Yield the lines of one key from a hash bucket partition.
+
+		Only the key's bucket is read (found by hashing the key, so the index isn't
+			loaded, just its first line).
+
+		Arguments:
+			Out_dir:		the out_DIR of the partition
+			Key:			the value from the column of interest you want the lines of
+			Delim:			the actual delimiter character (e.g. '\\t', not 'tab')
+			Column_index:	the column the file was partitioned by
+			Folderize:		what the partition was run with
+	"""
+	with open(os.path.join(Out_dir, BUCKET_INDEX), 'rb') as handle:
+		buckets = int(handle.readline().rstrip('\r\n').split('\t')[1])
+	name = bucket_name(bucket_of(Key, buckets), buckets)
+	path = group_file_path(Out_dir, name, Folderize)
+	if not os.path.isfile(path):
+		path = group_file_path(Out_dir, name, Folderize, "gz")
+		if not os.path.isfile(path):
+			return
+	with helper_functions.open_file(path, 'rb') as bucket:
+		for line in bucket:
+			if line.rstrip('\r\n').split(Delim, Column_index+1)[Column_index] == Key:
+				yield line
+
+def get_key(Line, Delim, Column_index, Line_number):
+	""" Return the value at Column_index of a line (without the newline chars).
+
+		Raises ValueError if the line isn't delimited by Delim, or if the column of
+			interest is missing or empty.
+	"""
+	if Delim not in Line:
+		raise ValueError("You fool! '"+Delim+"' isn't the delim of the file!")
+	fields = Line.rstrip('\r\n').split(Delim, Column_index+1)
+	if len(fields) <= Column_index:
+		raise ValueError("Line "+str(Line_number)+" has no column "+str(Column_index)+".")
+	key = fields[Column_index]
+	if len(key) == 0:
+		raise ValueError("Line "+str(Line_number)+" was empty in col of interest.")
+	return key
+
+def skip_offset(In_file, Skip):
+	""" Return the byte offset of the first line after the Skip skipped lines (of a plain file).
+	"""
+	with open(In_file, 'rb') as handle:
+		for i in range(Skip):
+			if len(handle.readline()) == 0:
+				break
+		return handle.tell()
+
+def skip_lines(Handle, Skip):
+	""" Read past the first Skip lines of an open file.
+	"""
+	for i in range(Skip):
+		if len(Handle.readline()) == 0:
+			break
+
+def line_aligned_offset(Handle, Target):
+	""" Return the byte offset of the first line that starts at or after Target (Target > 0).
+	"""
+	# Whatever line byte Target-1 is in, the next line starts at or after Target
+	Handle.seek(Target-1)
+	Handle.readline()
+	return Handle.tell()
+
+def complete_lines_end(In_file):
+	""" Return the byte offset just past the last newline in In_file, so a last line that is
+		still being written isn't read.
+	"""
+	with open(In_file, 'rb') as handle:
+		handle.seek(0, os.SEEK_END)
+		pos = handle.tell()
+		while pos > 0:
+			start = max(0, pos-65536)
+			handle.seek(start)
+			k = handle.read(pos-start).rfind("\n")
+			if k >= 0:
+				return start+k+1
+			pos = start
+	return 0
+
+def split_byte_ranges(In_file, Start, N_ranges):
+	""" Split In_file (from byte Start to the end) into up to N_ranges byte ranges that
+			each begin at the start of a line.
+
+		Returns: a list of (start, end) byte offsets, in file order. Fewer than N_ranges
+			ranges are returned if the file has fewer lines than that.
+	"""
+	if type(N_ranges) is not int or N_ranges < 1:
+		raise ValueError("N_ranges needs to be an integer > 0.")
+	size = os.path.getsize(In_file)
+	boundaries = [Start]
+	with open(In_file, 'rb') as handle:
+		for k in range(1, N_ranges):
+			target = Start + (size-Start)*k//N_ranges
+			if target <= boundaries[-1]:
+				continue
+			offset = line_aligned_offset(handle, target)
+			if boundaries[-1] < offset < size:
+				boundaries.append(offset)
+	boundaries.append(size)
+	return [(boundaries[k], boundaries[k+1]) for k in range(len(boundaries)-1)]
+
+def range_lines(Handle, Start, End):
+	""" Yield the lines of an open plain file from byte Start up to byte End.
+	"""
+	Handle.seek(Start)
+	pos = Start
+	for line in Handle:
+		if pos >= End:
+			break
+		pos += len(line)
+		yield line
+
+def keyed_lines(Lines, Delim, Column_index, First_line=0, Close=False):
+	""" The 'lines' scanner: yield (key, line) for each line of an open file (or iterable
+		of lines). A missing newline on the last line is added.
+
+		If Close, Lines (an open file) is closed when we're done with it.
+	"""
+	i = First_line
+	n_splits = Column_index+1
+	min_fields = max(Column_index, 1)
+	try:
+		for line in Lines:
+			fields = line.rstrip('\r\n').split(Delim, n_splits)
+			# (Same checks as get_key, without calling it for every line)
+			if len(fields) > min_fields and len(fields[Column_index]) > 0:
+				key = fields[Column_index]
+			else:
+				key = get_key(line, Delim, Column_index, i)
+			if line[-1:] != "\n":
+				line = line+"\n"
+			yield key, line
+			i += 1
+	finally:
+		if Close:
+			Lines.close()
+
+def key_pattern(Delim, Column_index):
+	""" Regex that matches a whole line from its start, with the key as group 1.
+
+		Like keyed_lines, the key only loses the '\r's at the end of the line: a '\r' with
+			anything but line ending after it is part of the key.
+	"""
+	if len(Delim) != 1:
+		raise ValueError("The mmap scanner only works with single character delimiters.")
+	d = re.escape(Delim)
+	key = "((?:[^"+d+"\\r\\n]+|\\r+(?=[^\\r\\n]))*)"
+	return re.compile("(?:[^"+d+"\\n]*"+d+"){"+str(Column_index)+"}"+key+"[^\\n]*\\n?")
+
+def mmap_keyed_lines(Map, Start, End, Delim, Column_index, First_line=0):
+	""" The 'mmap' scanner: yield (key, line) for each line of a memory mapped file from byte
+		Start up to byte End.
+
+		The regex finds the key in the map itself, so the key is the only thing copied out
+			of the map: lines are buffer()s pointing into it. Write (or copy) them before
+			the map is closed! A missing newline on the last line is added.
+	"""
+	match = key_pattern(Delim, Column_index).match
+	pos = Start
+	i = First_line
+	while pos < End:
+		m = match(Map, pos)
+		if m is None or m.end(1) == m.start(1) or (Column_index == 0
+			and Map[m.end(1):m.end(1)+1] != Delim):
+			# Something is off about this line. get_key will complain about it, or get the
+			#  key if nothing is actually wrong.
+			end = Map.find("\n", pos, End)
+			if end < 0:
+				end = End
+			else:
+				end += 1
+			key = get_key(Map[pos:end], Delim, Column_index, i)
+		else:
+			end = m.end()
+			key = m.group(1)
+		if Map[end-1:end] == "\n":
+			yield key, buffer(Map, pos, end-pos)
+		else:
+			yield key, Map[pos:end]+"\n"
+		pos = end
+		i += 1
+
+def _mmap_file_keyed_lines(In_file, Delim, Skip, Column_index):
+	""" mmap_keyed_lines over a whole file (after the Skip skipped lines).
+	"""
+	start = skip_offset(In_file, Skip)
+	size = os.path.getsize(In_file)
+	if start >= size:
+		return
+	with open(In_file, 'rb') as handle:
+		Map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+		try:
+			for pair in mmap_keyed_lines(Map, start, size, Delim, Column_index, Skip):
+				yield pair
+		finally:
+			Map.close()
+
+def scan_file(In_file, Delim, Skip, Column_index, Scanner="lines"):
+	""" Return an iterator of (key, line) for each line of In_file after the Skip skipped ones.
+
+		Arguments:
+			Scanner:	'lines' (reads line by line, works on compressed files too) or
+						'mmap' (plain files only, falls back to 'lines' for compressed files)
+			(the rest are the same as stream_partition)
+	"""
+	if Scanner == "mmap" and helper_functions.compression_of(In_file) is None:
+		return _mmap_file_keyed_lines(In_file, Delim, Skip, Column_index)
+	elif Scanner == "lines" or Scanner == "mmap":
+		handle = helper_functions.open_file(In_file, 'rb')
+		skip_lines(handle, Skip)
+		return keyed_lines(handle, Delim, Column_index, Skip, Close=True)
+	raise ValueError("Scanner needs to be 'lines' or 'mmap', not: "+str(Scanner))
+
+def compare_scanners(In_file, Delim, Skip, Column_index):
+	""" Time finding every line's key in In_file with each scanner, next to the way
+		col_grep.py used to do it (splitting each line fully, twice).
+
+		Prints and returns: dict of scanner -> lines/sec
+	"""
+	rates = dict()
+	start = time.time()
+	n = 0
+	with helper_functions.open_file(In_file, 'rb') as handle:
+		skip_lines(handle, Skip)
+		for line in handle:
+			if len(line.rstrip('\r\n').split(Delim)[Column_index]) > 0:
+				key = line.rstrip('\r\n').split(Delim)[Column_index]
+			n += 1
+	rates["split (old)"] = n/max(time.time()-start, 1e-9)
+	for scanner in ["lines", "mmap"]:
+		start = time.time()
+		n = 0
+		for key, line in scan_file(In_file, Delim, Skip, Column_index, scanner):
+			n += 1
+		rates[scanner] = n/max(time.time()-start, 1e-9)
+	for scanner in ["split (old)", "lines", "mmap"]:
+		print scanner+":\t"+str(int(rates[scanner]))+" lines/sec"
+	return rates
+
+def format_seconds(Seconds):
+	""" 3725.2 -> "1:02:05"
+	"""
+	Seconds = int(Seconds)
+	return str(Seconds//3600)+":"+str(Seconds//60 % 60).zfill(2)+":"+str(Seconds % 60).zfill(2)
+
+class Progress(object):
+	""" Prints a progress record (at most) every Interval seconds of a long run: bytes read,
+		lines/sec, groups seen, open files and about how long is left.
+
+		Arguments:
+			Total_bytes:	Optional. Bytes that will be read in all (for the % done and time left).
+			Interval:		seconds between records
+			Label:			put at the start of each record (e.g. which worker it's from)
+
+		Call update() as often as you like (every few thousand lines is cheap enough), or
+			check due() first if working out the numbers isn't cheap.
+	"""
+	def __init__(self, Total_bytes=None, Interval=60, Label="progress"):
+		if Interval <= 0:
+			raise ValueError("Interval needs to be > 0.")
+		self.total_bytes = Total_bytes
+		self.interval = Interval
+		self.label = Label
+		self.start = time.time()
+		self.last = self.start
+
+	def due(self):
+		""" Has it been Interval seconds since the last record?
+		"""
+		return time.time()-self.last >= self.interval
+
+	def update(self, N_lines, N_bytes, N_groups, N_open=None):
+		""" Print a record if it has been Interval seconds since the last one.
+		"""
+		now = time.time()
+		if now-self.last < self.interval:
+			return
+		self.last = now
+		print self.record(N_lines, N_bytes, N_groups, N_open, now)
+		# (so it shows up in LSF's -o file as it happens)
+		sys.stdout.flush()
+
+	def record(self, N_lines, N_bytes, N_groups, N_open=None, Now=None):
+		if Now is None:
+			Now = time.time()
+		elapsed = max(Now-self.start, 1e-9)
+		record = (self.label+": "+str(round(N_bytes/(1024.0*1024.0), 1))+" MB read")
+		if self.total_bytes:
+			record += " ("+str(round(100.0*N_bytes/self.total_bytes, 1))+"%)"
+		record += (", "+str(N_lines)+" lines ("+str(int(N_lines/elapsed))+" lines/sec), "
+			+str(N_groups)+" groups")
+		if N_open is not None:
+			record += ", "+str(N_open)+" files open"
+		if self.total_bytes and N_bytes > 0:
+			left = max(0, self.total_bytes-N_bytes)*elapsed/N_bytes
+			record += ", about "+format_seconds(left)+" left"
+		return record
+
+class Partitioner(object):
+	""" Writes (key, line) pairs to their group's file, keeping track of the groups seen and
+		how many lines (and bytes) each has. Use partition_keyed, unless you need to keep writing to the
+		same files over several calls (like incremental_partition does).
+
+		Arguments are the same as partition_keyed.
+	"""
+	def __init__(self, Out_dir, Folderize, Max_open=None, Compress=None, Buckets=None,
+		Buffer_bytes=None, Progress=None):
+		self.out_dir = Out_dir
+		self.folderize = Folderize
+		self.compress = Compress
+		self.buckets = Buckets
+		self.pool = HandlePool(Max_open, Compress)
+		if Buffer_bytes is None:
+			self.buffer = None
+		else:
+			self.buffer = BufferedGroupWriter(self.pool, Buffer_bytes)
+		self.progress = Progress
+		self.group_counts = dict()
+		self.group_bytes = dict()
+		# Lines written over all calls to write
+		self.n_lines = 0
+		# Bytes in group_bytes before the first call to write
+		self.base_bytes = None
+		# output file name -> path
+		self.paths = dict()
+
+	def write(self, Keyed_lines):
+		""" Write each (key, line) pair to its file. Returns the number of lines written.
+		"""
+		group_counts = self.group_counts
+		group_bytes = self.group_bytes
+		paths = self.paths
+		get_handle = self.pool.get
+		if self.buffer is not None:
+			buffer_write = self.buffer.write
+		progress = self.progress
+		if self.base_bytes is None:
+			self.base_bytes = sum(group_bytes.itervalues())
+		n = 0
+		for key, line in Keyed_lines:
+			if key in group_counts:
+				group_counts[key] += 1
+				group_bytes[key] += len(line)
+			else:
+				group_counts[key] = 1
+				group_bytes[key] = len(line)
+			if self.buckets is None:
+				name = key
+			else:
+				name = bucket_name(bucket_of(key, self.buckets), self.buckets)
+			path = paths.get(name)
+			if path is None:
+				if self.folderize == "y_fold" and not os.path.isdir(os.path.join(self.out_dir, name)):
+					os.makedirs(os.path.join(self.out_dir, name))
+				path = group_file_path(self.out_dir, name, self.folderize, self.compress)
+				paths[name] = path
+			if self.buffer is None:
+				get_handle(path).write(line)
+			else:
+				buffer_write(path, line)
+			n += 1
+			if progress is not None and n & 8191 == 0 and progress.due():
+				progress.update(self.n_lines+n, sum(group_bytes.itervalues())-self.base_bytes,
+					len(group_counts), len(self.pool.handles))
+		self.n_lines += n
+		return n
+
+	def close(self):
+		""" Write out anything buffered and close every file.
+		"""
+		if self.buffer is not None:
+			self.buffer.flush()
+		self.pool.close_all()
+
+	def stats(self):
+		""" Return a dict of how the output went: bytes of lines per group ("group_bytes"),
+			files opened and evicted from the pool, and (if buffering) writes, bytes written,
+			times the buffer cap was hit and the biggest write.
+		"""
+		stats = {"group_bytes": dict(self.group_bytes), "opens": self.pool.n_opens,
+			"evictions": self.pool.n_evictions}
+		if self.buffer is not None:
+			stats["flushes"] = self.buffer.n_flushes
+			stats["bytes_flushed"] = self.buffer.bytes_flushed
+			stats["cap_hits"] = self.buffer.n_cap_hits
+			stats["max_flush"] = self.buffer.max_flush
+		return stats
+
+def add_stats(Stats, More):
+	""" Add the numbers in dict More to those in dict Stats (keys starting with "max_" take the
+		max, and dicts of numbers are added key by key).
+	"""
+	for key, value in More.iteritems():
+		if type(value) is dict:
+			add_stats(Stats.setdefault(key, dict()), value)
+		elif key not in Stats:
+			Stats[key] = value
+		elif key.startswith("max_"):
+			Stats[key] = max(Stats[key], value)
+		else:
+			Stats[key] += value
+
+def partition_keyed(Keyed_lines, Out_dir, Folderize, Max_open=None, Compress=None, Buckets=None,
+	Buffer_bytes=None, Stats=None, Progress=None):
+	""" Write each line to the file of its group.
+
+		Arguments:
+			Keyed_lines:	(key, line) pairs, e.g. from keyed_lines or mmap_keyed_lines
+			Out_dir:		"/my_out_directory/" [extant]
+			Folderize:		'y_fold' or 'n_fold'
+			Max_open:		Optional integer. Max number of output files open at once.
+							Defaults to default_max_open().
+			Compress:		None, 'gz' or 'bgzf'. How to compress the group files.
+			Buckets:		Optional integer. Instead of a file per group, write to this many
+							hash bucket files (see bucket_of).
+			Buffer_bytes:	Optional integer. Hold up to this many bytes of lines in memory,
+							and write them out in big chunks (see BufferedGroupWriter).
+			Stats:			Optional dict. The output stats (see Partitioner.stats) are
+							added to it.
+			Progress:		Optional Progress, to print progress records with.
+
+		Lines are written unchanged, in the same order as they come. Group files are
+			truncated first.
+
+		Returns: dict of group -> number of lines
+	"""
+	partitioner = Partitioner(Out_dir, Folderize, Max_open, Compress, Buckets, Buffer_bytes,
+		Progress)
+	try:
+		partitioner.write(Keyed_lines)
+	finally:
+		partitioner.close()
+	if Stats is not None:
+		add_stats(Stats, partitioner.stats())
+	return partitioner.group_counts
+
+def partition_lines(Lines, Delim, Column_index, Out_dir, Folderize, Max_open=None,
+	First_line=0, Compress=None, Buckets=None, Buffer_bytes=None, Stats=None, Progress=None):
+	""" Write each line to the file of its group.
+
+		Arguments:
+			Lines:			lines to partition (an open file, or any iterable of lines)
+			Delim:			the actual delimiter character (e.g. '\\t', not 'tab')
+			Column_index:	integer >= 0. Which column to group by? (0 is first column)
+			First_line:		line number of the first line (only used in error messages)
+			(the rest are the same as partition_keyed)
+
+		Lines are written unchanged (a missing newline on the last line is added), in
+			the same order as they come. Group files are truncated first.
+
+		Returns: dict of group -> number of lines
+	"""
+	return partition_keyed(keyed_lines(Lines, Delim, Column_index, First_line), Out_dir,
+		Folderize, Max_open=Max_open, Compress=Compress, Buckets=Buckets,
+		Buffer_bytes=Buffer_bytes, Stats=Stats, Progress=Progress)
+
+def partition_range(In_file, Start, End, Delim, Column_index, Out_dir, Folderize,
+	Max_open=None, First_line=0, Compress=None, Buckets=None, Scanner="lines", Buffer_bytes=None,
+	Stats=None, Progress=None):
+	""" Write each line of In_file from byte Start up to byte End to the file of its group.
+
+		Arguments:
+			In_file:		"/my_directory/my_file.txt" (plain, or gzip: then Start and End are
+								offsets in the decompressed data, read with gzip_index)
+			Start:			byte offset of the first line to partition (start of a line)
+			End:			byte offset to stop at (start of a line)
+			Scanner:		'lines' or 'mmap' (see scan_file; gzip files are read by line)
+			(the rest are the same as partition_lines)
+
+		Returns: dict of group -> number of lines
+	"""
+	if Start >= End:
+		return dict()
+	if helper_functions.compression_of(In_file) == "gz":
+		# (Start and End are offsets in the decompressed data: see gzip_index.line_ranges)
+		with gzip_index.IndexedGzipReader(In_file, gzip_index.current_index(In_file)) as handle:
+			return partition_lines(range_lines(handle, Start, End), Delim, Column_index, Out_dir,
+				Folderize, Max_open=Max_open, First_line=First_line, Compress=Compress,
+				Buckets=Buckets, Buffer_bytes=Buffer_bytes, Stats=Stats, Progress=Progress)
+	with open(In_file, 'rb') as handle:
+		if Scanner == "mmap":
+			Map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+			try:
+				return partition_keyed(
+					mmap_keyed_lines(Map, Start, End, Delim, Column_index, First_line),
+					Out_dir, Folderize, Max_open=Max_open, Compress=Compress, Buckets=Buckets,
+					Buffer_bytes=Buffer_bytes, Stats=Stats, Progress=Progress)
+			finally:
+				Map.close()
+		return partition_lines(range_lines(handle, Start, End), Delim, Column_index, Out_dir,
+			Folderize, Max_open=Max_open, First_line=First_line, Compress=Compress, Buckets=Buckets,
+			Buffer_bytes=Buffer_bytes, Stats=Stats, Progress=Progress)
+
+def stream_partition(In_file, Delim, Skip, Column_index, Out_dir, Folderize, Max_open=None,
+	Compress=None, Buckets=None, Scanner="lines", Buffer_bytes=None, Stats=None,
+	Progress_secs=None):
+	""" Read In_file once, writing each line to the file of its group.
+
+		Arguments:
+			In_file:		"/my_directory/my_file.txt" (may be gzip or zstd compressed)
+			Delim:			the actual delimiter character (e.g. '\\t', not 'tab')
+			Skip:			integer >= 0. How many lines at the top to skip?
+			Column_index:	integer >= 0. Which column to group by? (0 is first column)
+			Out_dir:		"/my_out_directory/" [extant]
+			Folderize:		'y_fold' or 'n_fold'
+			Max_open:		Optional integer. Max number of output files open at once.
+							Defaults to default_max_open().
+			Compress:		None, 'gz' or 'bgzf'. How to compress the group files.
+			Buckets:		Optional integer. Instead of a file per group, write to this many
+							hash bucket files, plus an index of which bucket each group is
+							in (see write_bucket_index and bucket_key_lines).
+			Scanner:		'lines' or 'mmap'. How to find each line's key (see scan_file).
+			Buffer_bytes:	Optional integer. Hold up to this many bytes of lines in memory,
+							and write them out in big chunks (see BufferedGroupWriter).
+			Stats:			Optional dict. The output stats (see Partitioner.stats) are
+							added to it.
+			Progress_secs:	Optional number. Print a progress record (see Progress) every
+							this many seconds.
+
+		Returns: (number of lines not skipped, dict of group -> number of lines)
+	"""
+	if Progress_secs is None:
+		progress = None
+	elif helper_functions.compression_of(In_file) is None:
+		progress = Progress(os.path.getsize(In_file)-skip_offset(In_file, Skip), Progress_secs)
+	else:
+		# (don't know how big it is uncompressed)
+		progress = Progress(None, Progress_secs)
+	group_counts = partition_keyed(scan_file(In_file, Delim, Skip, Column_index, Scanner),
+		Out_dir, Folderize, Max_open=Max_open, Compress=Compress, Buckets=Buckets,
+		Buffer_bytes=Buffer_bytes, Stats=Stats, Progress=progress)
+	if Buckets is not None:
+		write_bucket_index(Out_dir, group_counts, Buckets)
+	return sum(group_counts.itervalues()), group_counts
+
+def plan_batches(Group_bytes, Scan_bytes, Target_bytes, Max_jobs):
+	""" Pack groups into jobs so that each job gets about Target_bytes of work.
+
+		A col_grep.py bsub job greps its groups out of the input one at a time, so each
+			group costs one scan of the input (Scan_bytes) plus writing its own lines.
+			Groups are handed out biggest first, each to the job with the least work so far,
+			across as many jobs as it takes to get to Target_bytes per job (but at most
+			Max_jobs, and no more jobs than groups).
+
+		Arguments:
+			Group_bytes:	dict of group -> number of bytes of its lines
+			Scan_bytes:		bytes read to scan the input once (i.e. its size)
+			Target_bytes:	integer > 0. How much work (in bytes read + written) per job?
+			Max_jobs:		integer > 0. Most jobs to make.
+
+		Returns: list of (estimated bytes of work, list of groups) per job, most work first
+	"""
+	if Target_bytes <= 0:
+		raise ValueError("Target_bytes needs to be > 0.")
+	if type(Max_jobs) is not int or Max_jobs < 1:
+		raise ValueError("Max_jobs needs to be an integer > 0.")
+	if len(Group_bytes) == 0:
+		return []
+	costs = dict()
+	for group, n_bytes in Group_bytes.iteritems():
+		costs[group] = Scan_bytes+n_bytes
+	total = sum(costs.itervalues())
+	n_jobs = min(Max_jobs, len(costs), max(1, int(math.ceil(total/float(Target_bytes)))))
+	# (work so far, job number, groups) for each job, least work on top
+	jobs = [(0, k, []) for k in range(n_jobs)]
+	for group in sorted(costs, key=lambda g: (-costs[g], g)):
+		work, k, batch = heapq.heappop(jobs)
+		batch.append(group)
+		heapq.heappush(jobs, (work+costs[group], k, batch))
+	jobs.sort(reverse=True)
+	return [(work, batch) for work, k, batch in jobs]
+
+def _partition_shard(Arguments):
+	""" Pool worker: partition one byte range of a file into its own shard directory.
+	"""
+	(In_file, Start, End, Delim, Column_index, Shard_dir, Max_open, Compress, Buckets,
+		Scanner, Buffer_bytes, Progress_secs) = Arguments
+	os.mkdir(Shard_dir)
+	stats = dict()
+	if Progress_secs is None:
+		progress = None
+	else:
+		progress = Progress(End-Start, Progress_secs, "progress ("+os.path.basename(Shard_dir)+")")
+	start = time.time()
+	try:
+		group_counts = partition_range(In_file, Start, End, Delim, Column_index, Shard_dir,
+			"n_fold", Max_open=Max_open, Compress=Compress, Buckets=Buckets, Scanner=Scanner,
+			Buffer_bytes=Buffer_bytes, Stats=stats, Progress=progress)
+	except ValueError as e:
+		raise ValueError(str(e)+" (line numbers counted from byte "+str(Start)+" of "+In_file+")")
+	stats["max_worker_seconds"] = time.time()-start
+	return group_counts, stats
+
+def _merge_shards(Arguments):
+	""" Pool worker: concatenate one group's (or bucket's) shards (in file order) into its file.
+
+		(Concatenated gzip / BGZF files are valid gzip / BGZF files.)
+	"""
+	Group, Shard_dirs, Out_dir, Folderize, Compress = Arguments
+	if Folderize == "y_fold":
+		os.makedirs(os.path.join(Out_dir, Group))
+	with open(group_file_path(Out_dir, Group, Folderize, Compress), 'wb') as out_handle:
+		for shard_dir in Shard_dirs:
+			shard = group_file_path(shard_dir, Group, "n_fold", Compress)
+			with open(shard, 'rb') as in_handle:
+				shutil.copyfileobj(in_handle, out_handle, 1024*1024)
+			os.remove(shard)
+
+def parallel_partition(In_file, Delim, Skip, Column_index, Out_dir, Folderize, Workers,
+	Max_open=None, Compress=None, Buckets=None, Scanner="lines", Buffer_bytes=None, Stats=None,
+	Progress_secs=None):
+	""" Like stream_partition, but split the work over Workers local processes.
+
+		In_file is cut into Workers byte ranges at line boundaries. Each range is
+			partitioned by its own process into a shard directory inside Out_dir, then
+			each group's shards are concatenated in file order, so the group files are
+			byte-for-byte the same as stream_partition's (the same once decompressed, if
+			Compress is used).
+
+		Gzip (and BGZF) In_files are split using an index of checkpoints to decompress
+			them from (see gzip_index.py; it's built the first time, and saved next to
+			In_file), so each process only decompresses its own range. Other compressed
+			In_files (zstd) can't be split, so they are partitioned by stream_partition instead.
+
+		Arguments:
+			(same as stream_partition)
+			Workers:	integer > 0. Number of processes to use.
+
+		Buffer_bytes is the cap for all the processes together (each gets an equal share).
+			Each process prints its own progress records. Stats also gets how long the
+			slowest process took ("max_worker_seconds") and the time spent partitioning
+			and merging the shards ("phase_seconds").
+
+		Returns: (number of lines not skipped, dict of group -> number of lines)
+	"""
+	if type(Workers) is not int or Workers < 1:
+		raise ValueError("Workers needs to be an integer > 0.")
+	compression = helper_functions.compression_of(In_file)
+	if compression == "gz" and gzip_index.available() and Workers > 1:
+		index = gzip_index.get_gzip_index(In_file)
+		with gzip_index.IndexedGzipReader(In_file, index) as handle:
+			skip_lines(handle, Skip)
+			start = handle.tell()
+		ranges = gzip_index.line_ranges(In_file, start, Workers, index)
+	elif compression is not None:
+		print "FYI, "+In_file+" is compressed, so it will be partitioned by a single process."
+		return stream_partition(In_file, Delim, Skip, Column_index, Out_dir, Folderize,
+			Max_open=Max_open, Compress=Compress, Buckets=Buckets, Scanner=Scanner,
+			Buffer_bytes=Buffer_bytes, Stats=Stats, Progress_secs=Progress_secs)
+	else:
+		start = skip_offset(In_file, Skip)
+		ranges = split_byte_ranges(In_file, start, Workers)
+	if Workers == 1 or len(ranges) == 1:
+		return stream_partition(In_file, Delim, Skip, Column_index, Out_dir, Folderize,
+			Max_open=Max_open, Compress=Compress, Buckets=Buckets, Scanner=Scanner,
+			Buffer_bytes=Buffer_bytes, Stats=Stats, Progress_secs=Progress_secs)
+
+	if Buffer_bytes is None:
+		shard_buffer_bytes = None
+	else:
+		shard_buffer_bytes = max(1, Buffer_bytes//min(Workers, len(ranges)))
+	shard_dirs = [os.path.join(Out_dir, ".shard_"+str(k)) for k in range(len(ranges))]
+	pool = multiprocessing.Pool(min(Workers, len(ranges)))
+	try:
+		phase_start = time.time()
+		shard_results = pool.map(_partition_shard,
+			[(In_file, ranges[k][0], ranges[k][1], Delim, Column_index, shard_dirs[k], Max_open,
+				Compress, Buckets, Scanner, shard_buffer_bytes, Progress_secs)
+				for k in range(len(ranges))])
+		phase_seconds = {"partitioning": time.time()-phase_start}
+		shard_counts = [counts for counts, stats in shard_results]
+		if Stats is not None:
+			for counts, stats in shard_results:
+				add_stats(Stats, stats)
+		# Which shards (in file order) does each group (or bucket) have lines in?
+		group_counts = dict()
+		group_shards = dict()
+		for k in range(len(ranges)):
+			for group, count in shard_counts[k].iteritems():
+				if group in group_counts:
+					group_counts[group] += count
+				else:
+					group_counts[group] = count
+				if Buckets is None:
+					name = group
+				else:
+					name = bucket_name(bucket_of(group, Buckets), Buckets)
+				if name not in group_shards:
+					group_shards[name] = [shard_dirs[k]]
+				elif group_shards[name][-1] != shard_dirs[k]:
+					group_shards[name].append(shard_dirs[k])
+		phase_start = time.time()
+		pool.map(_merge_shards,
+			[(group, shards, Out_dir, Folderize, Compress)
+				for group, shards in group_shards.iteritems()])
+		phase_seconds["merging"] = time.time()-phase_start
+		if Stats is not None:
+			add_stats(Stats, {"phase_seconds": phase_seconds})
+	finally:
+		pool.close()
+		pool.join()
+		for shard_dir in shard_dirs:
+			if os.path.isdir(shard_dir):
+				shutil.rmtree(shard_dir)
+	if Buckets is not None:
+		write_bucket_index(Out_dir, group_counts, Buckets)
+	return sum(group_counts.itervalues()), group_counts
+
+def prefix_checksum(In_file, Offset):
+	""" md5 of the first CHECKSUM_BYTES of In_file and the CHECKSUM_BYTES just before Offset.
+
+		A cheap way to tell if the part of In_file before Offset was changed (as opposed
+			to In_file just being appended to) without reading all of it.
+	"""
+	md5 = hashlib.md5()
+	with open(In_file, 'rb') as handle:
+		md5.update(handle.read(min(CHECKSUM_BYTES, Offset)))
+		start = max(0, Offset-CHECKSUM_BYTES)
+		handle.seek(start)
+		md5.update(handle.read(Offset-start))
+	return md5.hexdigest()
+
+def read_checkpoint(Out_dir):
+	""" Return the checkpoint incremental_partition left in Out_dir (a dict), or None.
+	"""
+	path = os.path.join(Out_dir, CHECKPOINT)
+	if not os.path.isfile(path):
+		return None
+	with open(path, 'rb') as handle:
+		return cPickle.load(handle)
+
+def write_checkpoint(Out_dir, Checkpoint):
+	""" Save a checkpoint (written to a temp file and renamed, so it's never half written).
+	"""
+	path = os.path.join(Out_dir, CHECKPOINT)
+	with open(path+".tmp", 'wb') as handle:
+		cPickle.dump(Checkpoint, handle, cPickle.HIGHEST_PROTOCOL)
+	os.rename(path+".tmp", path)
+
+def incremental_partition(In_file, Delim, Skip, Column_index, Out_dir, Folderize, Max_open=None,
+	Compress=None, Buckets=None, Scanner="lines", Checkpoint_bytes=256*1024*1024,
+	Buffer_bytes=None, Stats=None, Progress_secs=None):
+	""" Like stream_partition, but picks up where the last run on Out_dir left off.
+
+		Every Checkpoint_bytes of In_file, all group files are closed and a checkpoint is
+			saved in Out_dir (CHECKPOINT) with: how far into In_file we got, a checksum of
+			In_file up to there (see prefix_checksum), and the size of every group file
+			(by its path in Out_dir).
+			The next run on the same Out_dir only reads what was added to In_file since
+			then, appending to the group files (and making new ones for new groups).
+
+		If a run is killed, the next run cuts the group files back to their size at the
+			last checkpoint and starts from there, so no line is written twice.
+
+		Only complete lines are read: a last line with no newline (yet) waits for the next run.
+
+		Arguments:
+			In_file:			"/my_directory/my_file.txt" [plain text, that only gets appended to]
+			Checkpoint_bytes:	integer > 0. How often to save a checkpoint.
+			(the rest are the same as stream_partition)
+
+		Returns: (number of lines read this run, dict of group -> number of lines in all runs)
+	"""
+	if helper_functions.compression_of(In_file) is not None:
+		raise ValueError("Incremental runs only work on plain text files, and "+In_file+" is compressed.")
+	if type(Checkpoint_bytes) is not int or Checkpoint_bytes < 1:
+		raise ValueError("Checkpoint_bytes needs to be an integer > 0.")
+	settings = {"in_file": os.path.abspath(In_file), "delim": Delim, "skip": Skip,
+		"column_index": Column_index, "folderize": Folderize, "compress": Compress,
+		"buckets": Buckets}
+	checkpoint = read_checkpoint(Out_dir)
+	if checkpoint is None:
+		if len(os.listdir(Out_dir)) > 0:
+			raise ValueError(Out_dir+" already contains files, but no checkpoint.")
+		checkpoint = dict(settings)
+		checkpoint["offset"] = skip_offset(In_file, Skip)
+		checkpoint["checksum"] = prefix_checksum(In_file, checkpoint["offset"])
+		checkpoint["n_lines"] = 0
+		checkpoint["group_counts"] = dict()
+		checkpoint["group_bytes"] = dict()
+		# Group file path in Out_dir -> size. (Relative to Out_dir, so it can be given another
+		#  way next time, e.g. "out", "./out/" or "/full/path/out", or from another directory.)
+		checkpoint["group_file_sizes"] = dict()
+		write_checkpoint(Out_dir, checkpoint)
+	else:
+		for setting in sorted(settings):
+			if checkpoint[setting] != settings[setting]:
+				raise ValueError(Out_dir+" was made with "+setting+" = "+str(checkpoint[setting])
+					+", not "+str(settings[setting]))
+		if (os.path.getsize(In_file) < checkpoint["offset"]
+			or prefix_checksum(In_file, checkpoint["offset"]) != checkpoint["checksum"]):
+			raise ValueError(In_file+" was changed (not just appended to) since the last run. "
+				+"Please start over with an empty out dir.")
+		# (older checkpoints have the group file paths as they were built from Out_dir)
+		if "file_sizes" in checkpoint:
+			checkpoint["group_file_sizes"] = dict((os.path.relpath(path, Out_dir), size)
+				for path, size in checkpoint.pop("file_sizes").iteritems())
+		# Undo anything written after the last checkpoint (if the last run was killed)
+		for name, size in checkpoint["group_file_sizes"].iteritems():
+			path = os.path.join(Out_dir, name)
+			if os.path.isfile(path) and os.path.getsize(path) != size:
+				with open(path, 'r+b') as handle:
+					handle.truncate(size)
+
+	offset = checkpoint["offset"]
+	end = complete_lines_end(In_file)
+	if Progress_secs is None:
+		progress = None
+	else:
+		progress = Progress(end-offset, Progress_secs)
+	partitioner = Partitioner(Out_dir, Folderize, Max_open, Compress, Buckets, Buffer_bytes,
+		progress)
+	partitioner.group_counts = checkpoint["group_counts"]
+	# (checkpoints from before group bytes were kept only count bytes from here on)
+	partitioner.group_bytes = checkpoint.setdefault("group_bytes", dict())
+	# Files from earlier runs get appended to. (Files made after the last checkpoint of a
+	#  killed run aren't in there, so they get started over.)
+	partitioner.pool.seen = set(os.path.join(Out_dir, name)
+		for name in checkpoint["group_file_sizes"])
+	n_lines = 0
+	with open(In_file, 'rb') as handle:
+		if Scanner == "mmap" and offset < end:
+			Map = mmap.mmap(handle.fileno(), end, access=mmap.ACCESS_READ)
+		else:
+			Map = None
+		try:
+			while offset < end:
+				if end-offset > Checkpoint_bytes:
+					stop = min(end, line_aligned_offset(handle, offset+Checkpoint_bytes))
+				else:
+					stop = end
+				first_line = Skip+checkpoint["n_lines"]
+				if Map is not None:
+					keyed = mmap_keyed_lines(Map, offset, stop, Delim, Column_index, first_line)
+				else:
+					keyed = keyed_lines(range_lines(handle, offset, stop), Delim, Column_index,
+						first_line)
+				try:
+					n = partitioner.write(keyed)
+				finally:
+					# Closed files are complete (even gzip'd ones), so can be cut back to
+					#  this size if the run gets killed before the next checkpoint.
+					partitioner.close()
+				for path in partitioner.pool.touched:
+					name = os.path.relpath(path, Out_dir)
+					checkpoint["group_file_sizes"][name] = os.path.getsize(path)
+				partitioner.pool.touched.clear()
+				n_lines += n
+				offset = stop
+				checkpoint["offset"] = offset
+				checkpoint["checksum"] = prefix_checksum(In_file, offset)
+				checkpoint["n_lines"] += n
+				write_checkpoint(Out_dir, checkpoint)
+		finally:
+			if Map is not None:
+				Map.close()
+	if Stats is not None:
+		add_stats(Stats, partitioner.stats())
+	if Buckets is not None:
+		write_bucket_index(Out_dir, checkpoint["group_counts"], Buckets)
+	return n_lines, checkpoint["group_counts"]
@@ -0,0 +1,607 @@
+#/usr/bin/python
+
+# sort_functions.py
+# 2016_3_5
+
+### An external merge sort for delimited files that are too big to sort in memory
+###    (helper_functions.bash_sort uses it).
+###
+###    The file is read once, in chunks of about Chunk_bytes. Each chunk is sorted by a worker
+###    process and spilled to a temp file, then the sorted chunks are merged (a heap picks the
+###    next line out of all of them). Sorting is stable: lines with equal keys stay in the
+###    order they were in. Strings compare byte by byte (like LC_ALL=C sort).
+###
+###    Files sorted this way can be joined on their key column by merge_join, which reads both
+###    at once, line by line, so it doesn't need to hold either of them in memory.
+
+import os
+import json
+import heapq
+import shutil
+import itertools
+import tempfile
+import multiprocessing
+
+import helper_functions
+
+KEY_TYPES = ["str", "num"]
+# Kinds of merge_join
+JOIN_TYPES = ["inner", "left", "outer"]
+# Name of the file (one per directory) that notes which files are sorted (see record_sortedness)
+SORT_CACHE = ".sort_cache.json"
+
+
+def check_keys(Keys):
+	""" Make sure Keys is a list of (Column_index, type) pairs, where Column_index is an
+		integer >= 0 (0 is first column) and type is 'str' or 'num'.
+	"""
+	if type(Keys) not in [list, tuple] or len(Keys) == 0:
+		raise ValueError("Keys needs to be a non-empty list of (Column_index, type) pairs.")
+	for key in Keys:
+		if type(key) not in [list, tuple] or len(key) != 2:
+			raise ValueError("Each key needs to be a (Column_index, type) pair, not: "+str(key))
+		column, kind = key
+		if type(column) is not int or column < 0:
+			raise ValueError("Key column needs to be an integer >= 0, not: "+str(column))
+		if kind not in KEY_TYPES:
+			raise ValueError("Key type needs to be 'str' or 'num', not: "+str(kind))
+
+def number_key(Field):
+	""" Sort key of a numeric field: fields that aren't numbers (e.g. "" or "NA") sort
+		before all numbers, by their text. So does "nan" (which float() takes, but which
+		isn't less or more than anything, so can't be put in order with numbers).
+	"""
+	try:
+		value = float(Field)
+	except ValueError:
+		return (0, 0.0, Field)
+	if value != value:
+		return (0, 0.0, Field)
+	return (1, value, "")
+
+def key_function(Keys, Delim):
+	""" Return a function of a line that gives its sort key (a tuple, one item per key).
+
+		A line with too few columns gets "" for the missing ones.
+	"""
+	check_keys(Keys)
+	n_split = max(column for column, kind in Keys)+1
+	if len(Keys) == 1 and Keys[0][1] == "str":
+		column = Keys[0][0]
+		def key(Line):
+			fields = Line.rstrip('\r\n').split(Delim, n_split)
+			if column < len(fields):
+				return fields[column]
+			return ""
+		return key
+	def key(Line):
+		fields = Line.rstrip('\r\n').split(Delim, n_split)
+		values = []
+		for column, kind in Keys:
+			if column < len(fields):
+				field = fields[column]
+			else:
+				field = ""
+			if kind == "num":
+				values.append(number_key(field))
+			else:
+				values.append(field)
+		return tuple(values)
+	return key
+
+def read_chunks(Handle, Chunk_bytes):
+	""" Yield lists of lines from Handle, each about Chunk_bytes long in all (every line
+		ends with a newline: one is added to the last line if it's missing).
+	"""
+	chunk = []
+	size = 0
+	for line in Handle:
+		if line[-1:] != "\n":
+			line += "\n"
+		chunk.append(line)
+		size += len(line)
+		if size >= Chunk_bytes:
+			yield chunk
+			chunk = []
+			size = 0
+	if len(chunk) > 0:
+		yield chunk
+
+def sort_chunk(Lines, Keys, Delim):
+	""" Sort a list of lines by Keys.
+
+		Returns: (the sorted lines, was it already sorted?, first key, last key)
+			(first and last key are of the lines as they came)
+	"""
+	if len(Lines) == 0:
+		return Lines, True, None, None
+	key = key_function(Keys, Delim)
+	keys = map(key, Lines)
+	already_sorted = all(keys[i] <= keys[i+1] for i in xrange(len(keys)-1))
+	if already_sorted:
+		return Lines, True, keys[0], keys[-1]
+	order = sorted(xrange(len(Lines)), key=keys.__getitem__)
+	return [Lines[i] for i in order], False, keys[0], keys[-1]
+
+def _sort_chunk(Arguments):
+	""" Pool worker: sort a chunk of lines and spill it to Tmp_file.
+	"""
+	Lines, Keys, Delim, Tmp_file = Arguments
+	lines, already_sorted, first, last = sort_chunk(Lines, Keys, Delim)
+	with open(Tmp_file, 'wb') as handle:
+		handle.writelines(lines)
+	return already_sorted, first, last
+
+def merge_sorted(In_files, Keys, Delim, Out_handle):
+	""" Merge files that are each sorted by Keys into Out_handle (a k-way merge with a heap).
+
+		Ties go to the file listed first, so merging chunks in file order keeps the sort stable.
+
+		Returns: number of lines written
+	"""
+	key = key_function(Keys, Delim)
+	handles = [open(path, 'rb') for path in In_files]
+	try:
+		# (key, file number, line) of the next line of each file
+		heap = []
+		for k in range(len(handles)):
+			line = handles[k].readline()
+			if line:
+				heap.append((key(line), k, line))
+		heapq.heapify(heap)
+		n = 0
+		while len(heap) > 0:
+			line_key, k, line = heap[0]
+			Out_handle.write(line)
+			n += 1
+			line = handles[k].readline()
+			if line:
+				heapq.heapreplace(heap, (key(line), k, line))
+			else:
+				heapq.heappop(heap)
+	finally:
+		for handle in handles:
+			handle.close()
+	return n
+
+def external_sort(In_file, Out_file, Keys, Delim="\t", Header=False, Compress=None, Workers=None,
+	Chunk_bytes=64*1024*1024, Tmp_dir=None, Max_merge=128, Use_cache=True):
+	""" Sort a (plain, gzip or zstd) delimited file by one or more columns, in a single read
+		of In_file, without holding all of it in memory.
+
+		Arguments:
+			In_file:		"/my_directory/my_file.txt[.gz]"
+			Out_file:		"/my_out_directory/my_file_sorted.txt[.gz]"
+			Keys:			list of (Column_index, type) to sort by, most important first.
+							Column_index: integer >= 0 (0 is first column)
+							type: 'str' (compare as text) or 'num' (compare as numbers)
+							e.g. [(2, 'str'), (3, 'num')]
+			Delim:			the actual delimiter character (e.g. '\\t', not 'tab')
+			Header:			boolean. Is the first line a header? (It's written first, unsorted.)
+			Compress:		None, 'gz' or 'bgzf'. How to compress Out_file.
+			Workers:		Optional integer > 0. Processes to sort chunks with. Defaults to
+							the number of cores.
+			Chunk_bytes:	integer > 0. About how many bytes of lines to sort at a time.
+							Up to 2*Workers chunks are held in memory at once.
+			Tmp_dir:		Optional directory for the sorted chunks. Defaults to Out_file's.
+			Max_merge:		integer > 1. Most chunks to merge at once (one open file each).
+							More chunks than that get merged in several passes.
+			Use_cache:		boolean. Note in the sort cache (see record_sortedness) whether
+							In_file was sorted, and that Out_file is.
+
+		Returns: (number of lines sorted (not counting the header), was In_file already sorted?)
+	"""
+	if not os.path.isfile(In_file):
+		raise ValueError(In_file+" not found.")
+	check_keys(Keys)
+	if Workers is None:
+		Workers = multiprocessing.cpu_count()
+	if type(Workers) is not int or Workers < 1:
+		raise ValueError("Workers needs to be an integer > 0.")
+	if type(Chunk_bytes) not in [int, long] or Chunk_bytes < 1:
+		raise ValueError("Chunk_bytes needs to be an integer > 0.")
+	if type(Max_merge) is not int or Max_merge < 2:
+		raise ValueError("Max_merge needs to be an integer > 1.")
+	if Tmp_dir is None:
+		Tmp_dir = os.path.dirname(os.path.abspath(Out_file))
+
+	n, already_sorted = _sort_file(In_file, Out_file, Keys, Delim, Header, Compress, Workers,
+		Chunk_bytes, Tmp_dir, Max_merge)
+	if Use_cache:
+		record_sortedness(In_file, Keys, Delim, Header, already_sorted)
+		record_sortedness(Out_file, Keys, Delim, Header, True)
+	return n, already_sorted
+
+def _sort_file(In_file, Out_file, Keys, Delim, Header, Compress, Workers, Chunk_bytes, Tmp_dir,
+	Max_merge):
+	""" Does the work of external_sort (which checks its arguments).
+	"""
+	tmp_dir = tempfile.mkdtemp(prefix=".sort_", dir=Tmp_dir)
+	pool = None
+	try:
+		with helper_functions.open_file(In_file, 'rb') as in_handle:
+			header = None
+			if Header:
+				header = in_handle.readline()
+				if header[-1:] != "\n" and len(header) > 0:
+					header += "\n"
+			chunks = read_chunks(in_handle, Chunk_bytes)
+			first_chunk = next(chunks, [])
+			second_chunk = next(chunks, None)
+			if second_chunk is None:
+				# Fits in one chunk: no need for temp files
+				lines, already_sorted, first, last = sort_chunk(first_chunk, Keys, Delim)
+				with helper_functions.open_file(Out_file, 'wb', Compress) as out_handle:
+					if header is not None:
+						out_handle.write(header)
+					out_handle.writelines(lines)
+				return len(lines), already_sorted
+
+			# Sort chunks in parallel, with at most Workers of them waiting to be sorted
+			pool = multiprocessing.Pool(Workers)
+			tmp_files = []
+			pending = []
+			results = []
+			def submit(Chunk):
+				tmp_file = os.path.join(tmp_dir, "chunk_"+str(len(tmp_files)))
+				tmp_files.append(tmp_file)
+				pending.append(pool.apply_async(_sort_chunk, [(Chunk, Keys, Delim, tmp_file)]))
+			submit(first_chunk)
+			submit(second_chunk)
+			del first_chunk, second_chunk
+			for chunk in chunks:
+				if len(pending) >= Workers:
+					results.append(pending.pop(0).get())
+				submit(chunk)
+			for result in pending:
+				results.append(result.get())
+		pool.close()
+		pool.join()
+		pool = None
+
+		# It was already sorted if every chunk was, and each chunk starts where the last left off
+		already_sorted = all(already for already, first, last in results)
+		for k in range(len(results)-1):
+			if results[k][2] > results[k+1][1]:
+				already_sorted = False
+
+		# Merge Max_merge chunks at a time until there are few enough to merge into Out_file
+		n_passes = 0
+		while len(tmp_files) > Max_merge:
+			merged = []
+			for k in range(0, len(tmp_files), Max_merge):
+				tmp_file = os.path.join(tmp_dir, "pass_"+str(n_passes)+"_"+str(len(merged)))
+				with open(tmp_file, 'wb') as out_handle:
+					merge_sorted(tmp_files[k:k+Max_merge], Keys, Delim, out_handle)
+				for path in tmp_files[k:k+Max_merge]:
+					os.remove(path)
+				merged.append(tmp_file)
+			tmp_files = merged
+			n_passes += 1
+		with helper_functions.open_file(Out_file, 'wb', Compress) as out_handle:
+			if header is not None:
+				out_handle.write(header)
+			n = merge_sorted(tmp_files, Keys, Delim, out_handle)
+	finally:
+		if pool is not None:
+			pool.terminate()
+			pool.join()
+		shutil.rmtree(tmp_dir)
+	return n, already_sorted
+
+def is_sorted(In_file, Keys, Delim="\t", Header=False, Use_cache=True):
+	""" Is a (plain, gzip or zstd) delimited file sorted by Keys? Stops reading at the first
+		line that is out of order. Arguments are the same as external_sort.
+
+		If Use_cache, the answer is looked up in (and afterwards saved to) the sort cache,
+			so asking again about the same, unchanged file doesn't read it at all.
+	"""
+	check_keys(Keys)
+	if Use_cache:
+		cached = cached_sortedness(In_file, Keys, Delim, Header)
+		if cached is not None:
+			return cached
+	key = key_function(Keys, Delim)
+	answer = True
+	with helper_functions.open_file(In_file, 'rb') as handle:
+		if Header:
+			handle.readline()
+		last = None
+		for line in handle:
+			this = key(line)
+			if last is not None and this < last:
+				answer = False
+				break
+			last = this
+	if Use_cache:
+		record_sortedness(In_file, Keys, Delim, Header, answer)
+	return answer
+
+def sort_cache_path(In_file):
+	"""Where the sort cache of In_file's directory lives: "<its directory>/SORT_CACHE"
+	"""
+	return os.path.join(os.path.dirname(os.path.abspath(In_file)), SORT_CACHE)
+
+def sort_spec(Keys, Delim, Header):
+	""" A string naming a way to sort, e.g. "1:str,2:num|\t|header"
+	"""
+	spec = ",".join(str(column)+":"+kind for column, kind in Keys)+"|"+Delim
+	if Header:
+		return spec+"|header"
+	return spec+"|no_header"
+
+def read_sort_cache(Cache_file):
+	""" Return the sort cache in Cache_file (a dict), or an empty one if it's missing or broken.
+	"""
+	if not os.path.isfile(Cache_file):
+		return dict()
+	try:
+		with open(Cache_file, 'rb') as handle:
+			return json.load(handle)
+	except ValueError:
+		return dict()
+
+def cached_sortedness(In_file, Keys, Delim="\t", Header=False):
+	""" Look up in the sort cache whether In_file is sorted by Keys, without reading In_file.
+
+		Returns: True or False, or None if the cache doesn't know (or In_file has changed
+			size or modification time since it was noted)
+	"""
+	entry = read_sort_cache(sort_cache_path(In_file)).get(os.path.basename(In_file))
+	if entry is None:
+		return None
+	stat = os.stat(In_file)
+	if entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime:
+		return None
+	return entry["sorted"].get(sort_spec(Keys, Delim, Header))
+
+def record_sortedness(In_file, Keys, Delim, Header, Sorted):
+	""" Note in the sort cache whether In_file is sorted by Keys.
+
+		The cache is a small JSON file (SORT_CACHE) in In_file's directory, holding for each
+			file its size and modification time, and whether it's sorted each way it was
+			checked. A file that changes gets a fresh entry. If the directory can't be written
+			to, nothing is noted.
+	"""
+	cache_file = sort_cache_path(In_file)
+	name = os.path.basename(In_file)
+	stat = os.stat(In_file)
+	cache = read_sort_cache(cache_file)
+	entry = cache.get(name)
+	if entry is None or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime:
+		entry = {"size": stat.st_size, "mtime": stat.st_mtime, "sorted": dict()}
+		cache[name] = entry
+	entry["sorted"][sort_spec(Keys, Delim, Header)] = Sorted
+	# Forget files that are gone
+	for old_name in cache.keys():
+		if not os.path.isfile(os.path.join(os.path.dirname(cache_file), old_name)):
+			del cache[old_name]
+	tmp_file = cache_file+"."+str(os.getpid())+".tmp"
+	try:
+		with open(tmp_file, 'wb') as handle:
+			json.dump(cache, handle)
+		os.rename(tmp_file, cache_file)
+	except (IOError, OSError):
+		if os.path.isfile(tmp_file):
+			os.remove(tmp_file)
+
+class SortedLines(object):
+	""" The lines of a (plain, gzip or zstd) file that should be sorted by a column, checked as
+		they're read.
+
+		Arguments:
+			In_file:	"/my_directory/my_file.txt[.gz]"
+			Column:		integer >= 0. The column it's sorted by.
+			Kind:		'str' or 'num' (see check_keys)
+			Delim:		the actual delimiter character
+			Header:		boolean. Is the first line a header? (It's read into header.)
+
+		Iterating gives (key, line) for each line. If a line's key is smaller than the one
+			before it, ValueError is raised (and unsorted is set).
+	"""
+	def __init__(self, In_file, Column, Kind, Delim, Header):
+		self.in_file = In_file
+		self.column = Column
+		self.kind = Kind
+		self.delim = Delim
+		self.handle = helper_functions.open_file(In_file, 'rb')
+		self.header = None
+		if Header:
+			self.header = self.handle.readline()
+		# (read ahead, so its width is known before iterating)
+		self.first = self.handle.readline()
+		self.first_number = int(Header)+1
+		self.unsorted = False
+
+	def __iter__(self):
+		key_of = key_function([(self.column, self.kind)], self.delim)
+		last = None
+		if len(self.first) == 0:
+			return
+		lines = itertools.chain([self.first], self.handle)
+		for line_number, line in enumerate(lines, self.first_number):
+			key = key_of(line)
+			if last is not None and key < last:
+				self.unsorted = True
+				raise ValueError(self.in_file+" isn't sorted by column "+str(self.column)+" ("
+					+self.kind+"): line "+str(line_number)+" comes before the line above it."
+					+" Sort it first (see external_sort / helper_functions.bash_sort).")
+			last = key
+			yield key, line
+
+	def close(self):
+		self.handle.close()
+
+def _split_key(Line, Column, Delim):
+	""" (the text of Column, the rest of the fields, each with a Delim in front) of a line.
+		Missing columns are "".
+	"""
+	fields = Line.rstrip('\r\n').split(Delim)
+	if len(fields) <= Column:
+		fields.extend([""]*(Column+1-len(fields)))
+	key = fields.pop(Column)
+	if len(fields) == 0:
+		return key, ""
+	return key, Delim+Delim.join(fields)
+
+def _key_group(Key, Line, Lines, Column, Delim, Max_lines, Tmp_dir):
+	""" The right parts (see _split_key) of Line and the lines after it in Lines (an iterator
+		of (key, line)) that have key Key. Past Max_lines of them, they go in a temp file
+		instead of memory.
+
+		Returns: (a list of them, or an open temp file of them (one per line, rewound),
+			(key, line) of the next line, or (None, None) if there isn't one)
+	"""
+	key = Key
+	line = Line
+	parts = []
+	spill = None
+	while line is not None and key == Key:
+		part = _split_key(line, Column, Delim)[1]
+		if spill is not None:
+			spill.write(part+"\n")
+		elif len(parts) < Max_lines:
+			parts.append(part)
+		else:
+			spill = tempfile.TemporaryFile(prefix=".join_", dir=Tmp_dir)
+			spill.writelines(p+"\n" for p in parts)
+			spill.write(part+"\n")
+			parts = None
+		key, line = next(Lines, (None, None))
+	if spill is None:
+		return parts, (key, line)
+	spill.seek(0)
+	return spill, (key, line)
+
+def _width(Lines):
+	""" How many columns a file (a SortedLines) has: as many as its header, or first line.
+	"""
+	if Lines.header is not None:
+		line = Lines.header
+	else:
+		line = Lines.first
+	return max(line.rstrip('\r\n').count(Lines.delim)+1, Lines.column+1)
+
+def merge_join(Left_file, Right_file, Out_file, Left_column, Right_column, How="inner",
+	Kind="str", Delim="\t", Header=False, Fill="NA", Compress=None, Max_group_lines=100000,
+	Tmp_dir=None, Use_cache=True):
+	""" Join two (plain, gzip or zstd) delimited files that are each sorted by their key
+		column, reading each of them once, at the same time (a merge join).
+
+		Arguments:
+			Left_file:		"/my_directory/left.txt[.gz]"
+			Right_file:		"/my_directory/right.txt[.gz]"
+			Out_file:		"/my_out_directory/joined.txt[.gz]"
+			Left_column:	integer >= 0. Key column of Left_file (0 is first column)
+			Right_column:	integer >= 0. Key column of Right_file
+			How:			'inner' (lines with a key in both files), 'left' (plus the left lines
+							with no match) or 'outer' (plus the unmatched lines of both)
+			Kind:			'str' or 'num'. How the files are sorted (see external_sort).
+							With 'num', keys match if they're the same number ("1" and "1.0").
+			Delim:			the actual delimiter character (e.g. '\\t', not 'tab')
+			Header:			boolean. Do both files start with a header? (Out_file gets one.)
+			Fill:			what to put in the columns of the missing side of unmatched lines
+			Compress:		None, 'gz' or 'bgzf'. How to compress Out_file.
+			Max_group_lines:integer > 0. Most right lines of one key to hold in memory. More than
+							that (lots of duplicates of a key) go in a temp file in Tmp_dir.
+			Tmp_dir:		Optional. Defaults to Out_file's directory.
+			Use_cache:		boolean. Look up in the sort cache (see record_sortedness) whether
+							the files are sorted before reading them, and note that they are
+							after.
+
+		Each output line is the left line, then the right line without its key column. A key
+			that's in both files n and m times gives n*m lines. Lines come out in key order
+			(and in file order within a key).
+
+		The files are checked to be sorted as they're read: if one isn't, ValueError is
+			raised (and no Out_file is written). Memory doesn't grow with the size of the files.
+
+		Returns: dict with the number of lines written ("lines"), of matched pairs ("matched"),
+			and of unmatched left ("left_only") and right ("right_only") lines
+	"""
+	if How not in JOIN_TYPES:
+		raise ValueError("How needs to be one of "+str(JOIN_TYPES)+", not: "+str(How))
+	check_keys([(Left_column, Kind), (Right_column, Kind)])
+	if type(Max_group_lines) is not int or Max_group_lines < 1:
+		raise ValueError("Max_group_lines needs to be an integer > 0.")
+	for path, column in [(Left_file, Left_column), (Right_file, Right_column)]:
+		if not os.path.isfile(path):
+			raise ValueError(path+" not found.")
+		if Use_cache and cached_sortedness(path, [(column, Kind)], Delim, Header) is False:
+			raise ValueError(path+" isn't sorted by column "+str(column)+" ("+Kind+"). Sort it first"
+				+" (see external_sort / helper_functions.bash_sort).")
+	if Tmp_dir is None:
+		Tmp_dir = os.path.dirname(os.path.abspath(Out_file))
+
+	counts = {"lines": 0, "matched": 0, "left_only": 0, "right_only": 0}
+	left = SortedLines(Left_file, Left_column, Kind, Delim, Header)
+	right = None
+	tmp_file = Out_file+"."+str(os.getpid())+".tmp"
+	try:
+		right = SortedLines(Right_file, Right_column, Kind, Delim, Header)
+		# What unmatched lines get for the missing side
+		right_fill = "".join(Delim+Fill for k in range(_width(right)-1))
+		left_fields = [Fill]*_width(left)
+		# (key, line) of the next line of each side, (None, None) once it's used up
+		left_lines = iter(left)
+		right_lines = iter(right)
+		left_key, left_line = next(left_lines, (None, None))
+		right_key, right_line = next(right_lines, (None, None))
+		with helper_functions.open_file(tmp_file, 'wb', Compress) as out:
+			write = out.write
+			if Header:
+				right_header = _split_key(right.header, Right_column, Delim)[1]
+				right_header += "".join(Delim for k in range(_width(right)-1-right_header.count(Delim)))
+				write(left.header.rstrip('\r\n')+right_header+"\n")
+			while left_line is not None or right_line is not None:
+				if right_line is None or (left_line is not None and left_key < right_key):
+					if How != "inner":
+						write(left_line.rstrip('\r\n')+right_fill+"\n")
+						counts["lines"] += 1
+					counts["left_only"] += 1
+					left_key, left_line = next(left_lines, (None, None))
+				elif left_line is None or right_key < left_key:
+					if How == "outer":
+						left_fields[Left_column], part = _split_key(right_line, Right_column, Delim)
+						write(Delim.join(left_fields)+part+"\n")
+						counts["lines"] += 1
+					counts["right_only"] += 1
+					right_key, right_line = next(right_lines, (None, None))
+				else:
+					key = left_key
+					parts, (right_key, right_line) = _key_group(right_key, right_line, right_lines,
+						Right_column, Delim, Max_group_lines, Tmp_dir)
+					n = 0
+					try:
+						while left_line is not None and left_key == key:
+							left_line = left_line.rstrip('\r\n')
+							if type(parts) is list:
+								for part in parts:
+									write(left_line+part+"\n")
+								n += len(parts)
+							else:
+								parts.seek(0)
+								for part in parts:
+									write(left_line+part)
+									n += 1
+							left_key, left_line = next(left_lines, (None, None))
+					finally:
+						if type(parts) is not list:
+							parts.close()
+					counts["lines"] += n
+					counts["matched"] += n
+		os.rename(tmp_file, Out_file)
+	finally:
+		for lines, path, column in [(left, Left_file, Left_column), (right, Right_file, Right_column)]:
+			if lines is None:
+				continue
+			lines.close()
+			# (so the next try fails straight away)
+			if Use_cache and lines.unsorted:
+				record_sortedness(path, [(column, Kind)], Delim, Header, False)
+		if os.path.isfile(tmp_file):
+			os.remove(tmp_file)
+	if Use_cache:
+		record_sortedness(Left_file, [(Left_column, Kind)], Delim, Header, True)
+		record_sortedness(Right_file, [(Right_column, Kind)], Delim, Header, True)
+	return counts
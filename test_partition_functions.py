@@ -0,0 +1,134 @@
+#/usr/bin/python
+
+# test_partition_functions.py
+# 2016_4_2
+
+### Checks that incremental_partition's resuming works: picking up what was appended, cutting
+###    group files back to the last checkpoint after a killed run, leaving a partial last line
+###    for the next run, and finding its group files again when Out_dir is given another way.
+###    Also that the 'mmap' scanner finds the same keys as the 'lines' one.
+###
+###    Run with: python -m unittest test_partition_functions
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import partition_functions
+
+def read_groups(Out_dir):
+	""" dict of group file name -> its contents (skipping the checkpoint).
+	"""
+	groups = dict()
+	for name in os.listdir(Out_dir):
+		if name != partition_functions.CHECKPOINT:
+			with open(os.path.join(Out_dir, name), 'rb') as handle:
+				groups[name] = handle.read()
+	return groups
+
+class IncrementalPartitionTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.cwd = os.getcwd()
+		self.in_file = os.path.join(self.dir, "in.txt")
+		self.out_dir = os.path.join(self.dir, "out")
+		os.mkdir(self.out_dir)
+
+	def tearDown(self):
+		os.chdir(self.cwd)
+		shutil.rmtree(self.dir)
+
+	def append(self, Text):
+		with open(self.in_file, 'ab') as handle:
+			handle.write(Text)
+
+	def one_shot(self):
+		""" What stream_partition makes of In_file's complete lines, in one go.
+		"""
+		out_dir = tempfile.mkdtemp(dir=self.dir)
+		with open(self.in_file, 'rb') as handle:
+			text = handle.read()
+		complete = os.path.join(self.dir, "complete.txt")
+		with open(complete, 'wb') as handle:
+			handle.write(text[:text.rfind("\n")+1])
+		n, counts = partition_functions.stream_partition(complete, ",", 1, 0, out_dir, "n_fold")
+		return read_groups(out_dir), counts
+
+	def test_resume_after_kill(self):
+		self.append("key,value\n")
+		for i in range(40):
+			self.append("k"+str(i % 3)+","+str(i)+"\n")
+		# (a checkpoint every ~50 bytes, so there's more than one)
+		n, counts = partition_functions.incremental_partition(self.in_file, ",", 1, 0,
+			self.out_dir, "n_fold", Checkpoint_bytes=50)
+		self.assertEqual(n, 40)
+		# A killed run wrote lines after the checkpoint: to a group file it had, and to a new one
+		with open(os.path.join(self.out_dir, "k1"), 'ab') as handle:
+			handle.write("k1,junk\nk1,half a li")
+		with open(os.path.join(self.out_dir, "k3"), 'wb') as handle:
+			handle.write("k3,junk\n")
+		# More lines, the last one not finished yet
+		for i in range(40, 50):
+			self.append("k"+str(i % 4)+","+str(i)+"\n")
+		self.append("k2,5")
+		n, counts = partition_functions.incremental_partition(self.in_file, ",", 1, 0,
+			self.out_dir, "n_fold", Checkpoint_bytes=50)
+		self.assertEqual(n, 10)
+		expected_groups, expected_counts = self.one_shot()
+		self.assertEqual(read_groups(self.out_dir), expected_groups)
+		self.assertEqual(counts, expected_counts)
+		# The rest of the partial line shows up, and the next run gets it
+		self.append("0\n")
+		n, counts = partition_functions.incremental_partition(self.in_file, ",", 1, 0,
+			self.out_dir, "n_fold", Checkpoint_bytes=50)
+		self.assertEqual(n, 1)
+		expected_groups, expected_counts = self.one_shot()
+		self.assertEqual(read_groups(self.out_dir), expected_groups)
+		self.assertEqual(counts, expected_counts)
+		self.assertTrue(expected_groups["k2"].endswith("k2,50\n"))
+
+	def test_resume_with_other_out_dir_spelling(self):
+		self.append("key,value\na,1\nb,2\na,3\n")
+		os.chdir(self.dir)
+		partition_functions.incremental_partition("in.txt", ",", 1, 0, "out", "n_fold")
+		self.append("a,4\n")
+		# The same Out_dir, spelled another way, from another directory
+		os.chdir(self.out_dir)
+		n, counts = partition_functions.incremental_partition(self.in_file, ",", 1, 0,
+			self.out_dir+"/", "n_fold")
+		self.assertEqual(n, 1)
+		self.assertEqual(counts, {"a": 3, "b": 1})
+		self.assertEqual(read_groups(self.out_dir), {"a": "a,1\na,3\na,4\n", "b": "b,2\n"})
+		# And a killed run is still cut back, given yet another way
+		with open(os.path.join(self.out_dir, "a"), 'ab') as handle:
+			handle.write("a,junk\n")
+		self.append("b,5\n")
+		os.chdir(self.dir)
+		n, counts = partition_functions.incremental_partition(self.in_file, ",", 1, 0,
+			"./out/../out", "n_fold")
+		self.assertEqual(counts, {"a": 3, "b": 2})
+		self.assertEqual(read_groups(self.out_dir), {"a": "a,1\na,3\na,4\n", "b": "b,2\nb,5\n"})
+
+class ScannerTest(unittest.TestCase):
+
+	def test_mmap_keys_match_lines_keys(self):
+		handle, in_file = tempfile.mkstemp()
+		try:
+			# '\r's in keys, ending lines (CRLF), both, and a last line with no newline
+			os.write(handle, "h,h,h\nx,a\rb,y\nx,ke\ry\r\nx,key\r\nx,k2\nx,\rq,z\nx,a\r,b\n"
+				+"x,z\r\r\nx,w\r")
+			os.close(handle)
+			for column_index in [0, 1]:
+				lines = list(partition_functions.scan_file(in_file, ",", 1, column_index, "lines"))
+				mmapped = [(key, str(line)) for key, line
+					in partition_functions.scan_file(in_file, ",", 1, column_index, "mmap")]
+				self.assertEqual(mmapped, lines)
+			self.assertEqual([key for key, line in lines],
+				["a\rb", "ke\ry", "key", "k2", "\rq", "a\r", "z", "w"])
+		finally:
+			os.remove(in_file)
+
+if __name__ == "__main__":
+	unittest.main()
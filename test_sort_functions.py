@@ -0,0 +1,216 @@
+#/usr/bin/python
+
+# test_sort_functions.py
+# 2016_4_2
+
+### Checks external_sort, is_sorted (and the sort cache they fill in), bash_sort and merge_join,
+###    against doing the same thing in memory with sorted() and loops.
+###
+###    Run with: python -m unittest test_sort_functions
+
+import os
+import gzip
+import random
+import shutil
+import tempfile
+import unittest
+
+import sort_functions
+import helper_functions
+
+def write_lines(Path, Lines):
+	with open(Path, 'wb') as handle:
+		handle.writelines(line+"\n" for line in Lines)
+
+def read_lines(Path):
+	with open(Path, 'rb') as handle:
+		return handle.read().splitlines()
+
+def random_lines(N, Seed):
+	""" N comma delimited lines of: a key with lots of repeats, a number (or "NA", "" or
+		"nan"), and the line number. Some lines are missing their last two columns.
+	"""
+	rng = random.Random(Seed)
+	numbers = ["NA", "", "nan", "0", "-0.5", "1", "1.0", "2e3", "-7", "10", "9.99"]
+	lines = []
+	for i in range(N):
+		key = "k"+str(rng.randint(0, 20))
+		if rng.random() < 0.05:
+			lines.append(key)
+		else:
+			lines.append(key+","+rng.choice(numbers)+","+str(i))
+	return lines
+
+def expected_key(Line, Keys):
+	""" What a line should sort by (written out separately from sort_functions.key_function).
+	"""
+	fields = Line.split(",")
+	key = []
+	for column, kind in Keys:
+		field = fields[column] if column < len(fields) else ""
+		if kind == "str":
+			key.append(field)
+			continue
+		try:
+			value = float(field)
+		except ValueError:
+			value = None
+		if value is None or value != value:
+			key.append((0, field))
+		else:
+			key.append((1, value))
+	return key
+
+class SortTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def test_nan_and_na_sort_before_numbers(self):
+		in_file = os.path.join(self.dir, "in.txt")
+		out_file = os.path.join(self.dir, "out.txt")
+		write_lines(in_file, ["3", "nan", "1", "NA", "2", "", "NaN", "0", "nan", "-inf"])
+		n, already_sorted = sort_functions.external_sort(in_file, out_file, [(0, "num")], ",")
+		self.assertEqual(n, 10)
+		self.assertFalse(already_sorted)
+		# (not numbers, by their text, then numbers)
+		self.assertEqual(read_lines(out_file),
+			["", "NA", "NaN", "nan", "nan", "-inf", "0", "1", "2", "3"])
+		for use_cache in [False, True]:
+			self.assertFalse(sort_functions.is_sorted(in_file, [(0, "num")], ",", Use_cache=use_cache))
+			self.assertTrue(sort_functions.is_sorted(out_file, [(0, "num")], ",", Use_cache=use_cache))
+		self.assertFalse(sort_functions.cached_sortedness(in_file, [(0, "num")], ","))
+		self.assertTrue(sort_functions.cached_sortedness(out_file, [(0, "num")], ","))
+		# A nan between numbers is out of order, wherever it is
+		for lines in [["1", "nan", "2"], ["1", "2", "nan"], ["nan", "1", "NA"]]:
+			write_lines(in_file, lines)
+			self.assertFalse(sort_functions.is_sorted(in_file, [(0, "num")], ",", Use_cache=False))
+
+	def test_matches_sorted(self):
+		lines = random_lines(3000, 1)
+		in_file = os.path.join(self.dir, "in.txt")
+		write_lines(in_file, ["key,number,i"]+lines)
+		for keys in [[(0, "str")], [(1, "num")], [(0, "str"), (1, "num")], [(1, "num"), (2, "str")]]:
+			expected = sorted(lines, key=lambda line: expected_key(line, keys))
+			# one chunk; several chunks merged at once; several passes of 2 chunks at a time
+			for chunk_bytes, max_merge in [(10**6, 128), (2000, 128), (2000, 2)]:
+				out_file = os.path.join(self.dir, "out.txt")
+				n, already_sorted = sort_functions.external_sort(in_file, out_file, keys, ",",
+					Header=True, Workers=2, Chunk_bytes=chunk_bytes, Max_merge=max_merge)
+				self.assertEqual(n, len(lines))
+				self.assertFalse(already_sorted)
+				self.assertEqual(read_lines(out_file), ["key,number,i"]+expected)
+				self.assertTrue(sort_functions.is_sorted(out_file, keys, ",", Header=True,
+					Use_cache=False))
+				# Sorting it again finds it already sorted
+				again = os.path.join(self.dir, "again.txt")
+				self.assertTrue(sort_functions.external_sort(out_file, again, keys, ",",
+					Header=True, Workers=2, Chunk_bytes=chunk_bytes)[1])
+			self.assertFalse(sort_functions.is_sorted(in_file, keys, ",", Header=True,
+				Use_cache=False))
+
+	def test_gzip_and_cache(self):
+		lines = random_lines(500, 2)
+		in_file = os.path.join(self.dir, "in.txt.gz")
+		with gzip.open(in_file, 'wb') as handle:
+			handle.writelines(line+"\n" for line in lines)
+		out_file = os.path.join(self.dir, "out.txt.gz")
+		sort_functions.external_sort(in_file, out_file, [(1, "num")], ",", Compress="gz",
+			Chunk_bytes=1000)
+		with gzip.open(out_file, 'rb') as handle:
+			self.assertEqual(handle.read().splitlines(),
+				sorted(lines, key=lambda line: expected_key(line, [(1, "num")])))
+		self.assertEqual(sort_functions.cached_sortedness(in_file, [(1, "num")], ","), False)
+		self.assertEqual(sort_functions.cached_sortedness(out_file, [(1, "num")], ","), True)
+		# (another way of sorting isn't known)
+		self.assertEqual(sort_functions.cached_sortedness(out_file, [(0, "str")], ","), None)
+
+	def test_bash_sort(self):
+		lines = random_lines(500, 3)
+		write_lines(os.path.join(self.dir, "in.txt"), ["key,number,i"]+lines)
+		out_dir = os.path.join(self.dir, "out")+"/"
+		os.mkdir(out_dir)
+		sorted_file = helper_functions.bash_sort("in.txt", self.dir+"/", out_dir, 2, Delim=",",
+			Sort_style="n")
+		self.assertEqual(sorted_file, out_dir+"in_sorted.txt")
+		expected = sorted(lines, key=lambda line: expected_key(line, [(1, "num")]))
+		self.assertEqual(read_lines(sorted_file), ["key,number,i"]+expected)
+		# An already sorted file is its own sorted file
+		self.assertEqual(helper_functions.bash_sort("in_sorted.txt", out_dir, out_dir, 2,
+			Delim=",", Sort_style="n"), sorted_file)
+		self.assertFalse(os.path.exists(out_dir+"in_sorted_sorted.txt"))
+
+def expected_join(Left, Right, How):
+	""" merge_join (with keys in the first column, and Fill "NA") done with loops.
+	"""
+	left_fill = ",NA"*Left[0].count(",")
+	right_fill = ",NA"*Right[0].count(",")
+	keys = sorted(set(line.split(",")[0] for line in Left+Right))
+	joined = []
+	for key in keys:
+		left = [line for line in Left if line.split(",")[0] == key]
+		right = ["".join(","+field for field in line.split(",")[1:]) for line in Right
+			if line.split(",")[0] == key]
+		if len(left) > 0 and len(right) > 0:
+			joined.extend(l+r for l in left for r in right)
+		elif len(left) > 0 and How != "inner":
+			joined.extend(l+right_fill for l in left)
+		elif len(right) > 0 and How == "outer":
+			joined.extend(key+left_fill+r for r in right)
+	return joined
+
+class MergeJoinTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.left = os.path.join(self.dir, "left.txt")
+		self.right = os.path.join(self.dir, "right.txt")
+		self.out = os.path.join(self.dir, "joined.txt")
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def test_duplicate_keys(self):
+		# a: 2 x 3, b: left only, c: 1 x 2, d: right only, e: 3 x 1
+		left = ["a,l1,x", "a,l2,y", "b,l3,z", "c,l4,w", "e,l5,v", "e,l6,u", "e,l7,t"]
+		right = ["a,r1", "a,r2", "a,r3", "c,r4", "c,r5", "d,r6", "e,r7"]
+		write_lines(self.left, ["key,l,m"]+left)
+		write_lines(self.right, ["key,r"]+right)
+		# (Max_group_lines 1 puts the right lines of a key in a temp file)
+		for max_group_lines in [100000, 1]:
+			for how in sort_functions.JOIN_TYPES:
+				counts = sort_functions.merge_join(self.left, self.right, self.out, 0, 0, how,
+					Delim=",", Header=True, Max_group_lines=max_group_lines)
+				expected = expected_join(left, right, how)
+				self.assertEqual(read_lines(self.out), ["key,l,m,r"]+expected)
+				self.assertEqual(counts["lines"], len(expected))
+				self.assertEqual(counts["matched"], 6+2+3)
+				self.assertEqual(counts["left_only"], 1)
+				self.assertEqual(counts["right_only"], 1)
+
+	def test_random(self):
+		rng = random.Random(4)
+		left = sorted(("k"+str(rng.randint(0, 30))+",l"+str(i) for i in range(300)),
+			key=lambda line: line.split(",")[0])
+		right = sorted(("k"+str(rng.randint(10, 40))+",r"+str(i) for i in range(200)),
+			key=lambda line: line.split(",")[0])
+		write_lines(self.left, left)
+		write_lines(self.right, right)
+		for how in sort_functions.JOIN_TYPES:
+			sort_functions.merge_join(self.left, self.right, self.out, 0, 0, how, Delim=",",
+				Max_group_lines=3, Use_cache=False)
+			self.assertEqual(read_lines(self.out), expected_join(left, right, how))
+
+	def test_unsorted(self):
+		write_lines(self.left, ["a,1", "c,2", "b,3"])
+		write_lines(self.right, ["a,4", "b,5", "c,6"])
+		self.assertRaises(ValueError, sort_functions.merge_join, self.left, self.right, self.out,
+			0, 0, "inner", Delim=",")
+		self.assertFalse(os.path.exists(self.out))
+		self.assertEqual(sort_functions.cached_sortedness(self.left, [(0, "str")], ","), False)
+
+if __name__ == "__main__":
+	unittest.main()